@@ -4,7 +4,10 @@ IndexTTS2 FastAPI API服务器
 兼容OpenAI TTS接口，支持通过参考音频路径进行语音合成
 """
 
+import asyncio
+import json
 import os
+import shutil
 import sys
 import tempfile
 import uuid
@@ -25,7 +28,7 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 sys.path.append(os.path.join(current_dir, "indextts"))
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks, Request
 from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
@@ -37,6 +40,10 @@ import base64
 
 # 导入IndexTTS2
 from indextts.infer_v2 import IndexTTS2
+from indextts.utils.batch import BATCH_OUTPUT_ROOT_ENV, STATUS_FILE, BatchRunner, ZipStream, parse_manifest, \
+    resolve_output_dir
+from indextts.utils.cpu_planner import CPU_TOPOLOGY_ENV, CPUPipelineExecutor, parse_topology
+from indextts.utils.shared_weights import SHARED_BUNDLE_ENV, process_memory, publish_shared_bundle
 
 # 配置日志
 logging.basicConfig(
@@ -131,8 +138,16 @@ class IndexTTS2WithLogging(IndexTTS2):
 
 # 全局变量
 tts_model = None
-model_dir = "models/IndexTTS-2"
+# uvicorn的工作进程重新导入本模块，命令行参数通过环境变量传递
+model_dir = os.environ.get("INDEXTTS_MODEL_DIR", "models/IndexTTS-2")
 config_path = os.path.join(model_dir, "config.yaml")
+# 父进程放入共享内存的模型包，工作进程只读映射
+shared_bundle_path = os.environ.get(SHARED_BUNDLE_ENV)
+# CPU执行拓扑：各阶段独立线程预算，不同请求在不同阶段并发执行
+cpu_topology = os.environ.get(CPU_TOPOLOGY_ENV)
+cpu_executor = None
+# 批量合成的服务器输出目录必须位于此目录下，未设置时不允许指定 output_dir
+batch_output_root = os.environ.get(BATCH_OUTPUT_ROOT_ENV)
 disable_cuda_kernel = False  # 是否禁用CUDA内核
 
 # 创建FastAPI应用
@@ -166,6 +181,7 @@ class TTSRequest(BaseModel):
     emo_text: Optional[str] = Field(None, description="情感描述文本")
     use_random: bool = Field(default=False, description="是否使用随机采样")
     verbose: bool = Field(default=False, description="是否输出详细信息")
+    pipelined: bool = Field(default=False, description="多段长文本时，GPT生成后续分段的同时合成已生成的分段")
 
 class OpenAICompatibleRequest(BaseModel):
     """OpenAI兼容的TTS请求模型"""
@@ -181,11 +197,15 @@ class HealthResponse(BaseModel):
     model_loaded: bool
     device: str
     timestamp: float
+    pid: int
+    shared_weights: bool = Field(description="模型权重是否映射自共享内存")
+    memory: Dict[str, int] = Field(description="本进程常驻内存（字节）: rss, shared（文件映射/共享内存）, private（匿名内存）")
+    shared_weights_bytes: int = Field(0, description="共享的模型包大小（字节）")
 
 # 初始化模型
 def initialize_model():
     """初始化IndexTTS2模型"""
-    global tts_model
+    global tts_model, cpu_executor
     
     try:
         logger.info("正在初始化IndexTTS2模型...")
@@ -206,15 +226,18 @@ def initialize_model():
         
         # 检查模型文件是否存在
         logger.info("检查模型文件...")
-        required_files = [
-            "config.yaml",
-            "gpt.pth", 
-            "s2mel.pth",
-            "bpe.model",
-            "wav2vec2bert_stats.pt",
-            "feat1.pt",
-            "feat2.pt"
-        ]
+        if shared_bundle_path is not None:
+            required_files = [shared_bundle_path]
+        else:
+            required_files = [
+                "config.yaml",
+                "gpt.pth", 
+                "s2mel.pth",
+                "bpe.model",
+                "wav2vec2bert_stats.pt",
+                "feat1.pt",
+                "feat2.pt"
+            ]
         
         for file in required_files:
             file_path = os.path.join(model_dir, file)
@@ -276,15 +299,25 @@ def initialize_model():
             logger.info("如果初始化过程中卡住，请按Ctrl+C中断并使用 --disable-cuda-kernel 参数重启")
         
         # 初始化模型
+        if shared_bundle_path is not None:
+            logger.info(f"从共享内存映射模型权重: {shared_bundle_path}")
+            if torch.cuda.is_available():
+                logger.warning("共享权重只在CPU推理时节省内存，GPU模式下权重仍会复制到显存")
         tts_model = IndexTTS2WithLogging(
             cfg_path=config_path,
             model_dir=model_dir,
             use_fp16=True,
             use_cuda_kernel=use_cuda_kernel,
             use_deepspeed=False,
-            device=None
+            device=None,
+            bundle_path=shared_bundle_path,
+            share_weights=shared_bundle_path is not None,
         )
         
+        if cpu_topology is not None:
+            cpu_executor = CPUPipelineExecutor(tts_model, cpu_topology)
+            logger.info(f"CPU分阶段流水线执行已启用: {cpu_topology}")
+        
         log_memory_usage("初始化完成后")
         
         logger.info("IndexTTS2模型初始化完成！")
@@ -310,6 +343,12 @@ def initialize_model():
         
         return False
 
+async def run_infer(**kwargs):
+    """执行合成：启用CPU流水线时提交到各阶段线程池并等待结果，否则直接调用 infer"""
+    if cpu_executor is not None:
+        return await asyncio.wrap_future(cpu_executor.submit(**kwargs))
+    return tts_model.infer(**kwargs)
+
 # 启动时初始化模型
 @app.on_event("startup")
 async def startup_event():
@@ -336,7 +375,11 @@ async def health_check():
         status="healthy" if tts_model is not None else "unhealthy",
         model_loaded=tts_model is not None,
         device=str(torch.cuda.get_device_name(0)) if torch.cuda.is_available() else "cpu",
-        timestamp=time.time()
+        timestamp=time.time(),
+        pid=os.getpid(),
+        shared_weights=shared_bundle_path is not None,
+        memory=process_memory(),
+        shared_weights_bytes=os.path.getsize(shared_bundle_path) if shared_bundle_path is not None else 0,
     )
 
 @app.post("/v1/audio/speech")
@@ -360,7 +403,7 @@ async def create_speech_openai_compatible(request: OpenAICompatibleRequest):
         # 进行语音合成
         logger.info(f"开始合成语音: {request.text[:50]}...")
         
-        result_path = tts_model.infer(
+        result_path = await run_infer(
             spk_audio_prompt=request.voice,
             text=request.text,
             output_path=output_path,
@@ -403,7 +446,7 @@ async def create_speech(request: TTSRequest):
         # 进行语音合成
         logger.info(f"开始合成语音: {request.text[:50]}...")
         
-        result_path = tts_model.infer(
+        result_path = await run_infer(
             spk_audio_prompt=request.voice,
             text=request.text,
             output_path=output_path,
@@ -413,7 +456,8 @@ async def create_speech(request: TTSRequest):
             use_emo_text=request.use_emo_text,
             emo_text=request.emo_text,
             use_random=request.use_random,
-            verbose=request.verbose
+            verbose=request.verbose,
+            pipelined=request.pipelined
         )
         
         # 返回音频文件
@@ -482,7 +526,7 @@ async def create_speech_with_upload(
         # 进行语音合成
         logger.info(f"开始合成语音: {text[:50]}...")
         
-        result_path = tts_model.infer(
+        result_path = await run_infer(
             spk_audio_prompt=voice_path,
             text=text,
             output_path=output_path,
@@ -514,6 +558,64 @@ async def create_speech_with_upload(
         logger.error(f"语音合成失败: {e}")
         raise HTTPException(status_code=500, detail=f"语音合成失败: {str(e)}")
 
+@app.post("/api/v1/tts/batch")
+async def create_speech_batch(request: Request, output_dir: Optional[str] = None, audio_format: str = "wav",
+                              pipelined: bool = True):
+    """
+    批量TTS接口，请求体为JSONL清单，每行一个条目（text、voice，及情感和生成参数，格式见 `parse_manifest`）
+    条目按参考音频分组合成，每完成一个条目即流式返回：
+    - 指定 output_dir 时音频写入服务器目录（--batch-output-root 下的子目录，含 status.jsonl，重复提交跳过已完成条目），
+      逐行返回各条目状态（NDJSON）
+    - 否则返回zip流，每完成一个条目写入其音频，最后写入 status.jsonl
+    """
+    if tts_model is None:
+        raise HTTPException(status_code=503, detail="模型未加载")
+    if audio_format not in ("wav", "flac"):
+        raise HTTPException(status_code=400, detail=f"不支持的音频格式: {audio_format}")
+    target_dir = None
+    if output_dir is not None:
+        if not batch_output_root:
+            raise HTTPException(status_code=403, detail="服务器未配置批量输出根目录（--batch-output-root），不能指定 output_dir")
+        try:
+            target_dir = resolve_output_dir(batch_output_root, output_dir)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    body = (await request.body()).decode("utf-8")
+    items = parse_manifest(body.splitlines())
+    if not items:
+        raise HTTPException(status_code=400, detail="清单为空")
+    logger.info(f"开始批量合成: {len(items)} 个条目")
+    resume = target_dir is not None
+    target_dir = target_dir or tempfile.mkdtemp(prefix="indextts_batch_")
+    runner = BatchRunner(tts_model, target_dir, audio_format=audio_format, pipelined=pipelined, resume=resume)
+
+    # 每个条目与其他接口一样通过 run_infer 执行，启用CPU流水线时在各阶段线程池中合成
+    async def stream_status():
+        async for record in runner.arun(items, run_infer):
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    async def stream_zip():
+        archive = ZipStream()
+        records = []
+        try:
+            async for record in runner.arun(items, run_infer):
+                records.append(record)
+                if record["status"] == "done":
+                    path = os.path.join(target_dir, record["output"])
+                    yield archive.add_file(path, record["output"])
+                    os.remove(path)
+            status = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+            yield archive.add_bytes(STATUS_FILE, status.encode("utf-8"))
+            yield archive.close()
+        finally:
+            shutil.rmtree(target_dir, ignore_errors=True)
+
+    if resume:
+        return StreamingResponse(stream_status(), media_type="application/x-ndjson")
+    return StreamingResponse(stream_zip(), media_type="application/zip",
+                             headers={"Content-Disposition": f"attachment; filename=batch_{int(time.time())}.zip"})
+
 @app.get("/api/v1/models")
 async def list_models():
     """列出可用模型"""
@@ -532,6 +634,20 @@ async def list_models():
         ]
     }
 
+@app.get("/api/v1/metrics/mel_budget")
+async def mel_budget_metrics():
+    """逐段mel token预算统计（估计值 vs 实际值），用于调优时长估计系数"""
+    if tts_model is None:
+        raise HTTPException(status_code=503, detail="模型未加载")
+    return tts_model.mel_budget.metrics()
+
+@app.get("/api/v1/metrics/cpu_pipeline")
+async def cpu_pipeline_metrics():
+    """CPU流水线各阶段的线程预算、排队/完成请求数和忙碌时间，忙碌时间最长的阶段是瓶颈"""
+    if cpu_executor is None:
+        raise HTTPException(status_code=404, detail="未启用CPU流水线执行（--cpu-topology）")
+    return cpu_executor.metrics()
+
 @app.get("/api/v1/voices")
 async def list_voices():
     """列出可用声音（这里返回示例）"""
@@ -557,13 +673,34 @@ if __name__ == "__main__":
     parser.add_argument("--workers", type=int, default=1, help="工作进程数")
     parser.add_argument("--reload", action="store_true", help="开发模式，自动重载")
     parser.add_argument("--disable-cuda-kernel", action="store_true", help="禁用CUDA内核（避免编译问题）")
+    parser.add_argument("--share-weights", action="store_true", help="父进程将模型权重放入共享内存，各工作进程只读映射同一份权重（CPU推理）")
+    parser.add_argument("--bundle", default=None, help="配合 --share-weights：`indextts bundle` 生成的模型包，默认 <model-dir>/indextts2.bundle.safetensors，不存在时自动生成")
+    parser.add_argument("--shm-dir", default="/dev/shm", help="共享内存目录，为空或空间不足时直接映射模型包文件（通过页缓存共享）")
+    parser.add_argument("--batch-output-root", default=None, help="批量合成接口的 output_dir 所在根目录，未设置时不允许写入服务器目录")
+    parser.add_argument("--cpu-topology", default=None, help="CPU推理的分阶段执行拓扑，如 'frontend:1,prompt:2,gpt:4,s2mel:6,vocoder:2x2'，或 'auto' 按核数自动分配")
     
     args = parser.parse_args()
     
-    # 更新全局变量
+    # 更新全局变量，并传递给工作进程
     model_dir = args.model_dir
     config_path = os.path.join(model_dir, "config.yaml")
     disable_cuda_kernel = args.disable_cuda_kernel
+    os.environ["INDEXTTS_MODEL_DIR"] = model_dir
+    if disable_cuda_kernel:
+        os.environ["DISABLE_CUDA_KERNEL"] = "1"
+    if args.batch_output_root:
+        os.environ[BATCH_OUTPUT_ROOT_ENV] = os.path.abspath(args.batch_output_root)
+    if args.cpu_topology:
+        parse_topology(args.cpu_topology)  # 启动工作进程前检查格式
+        os.environ[CPU_TOPOLOGY_ENV] = args.cpu_topology
+    if args.share_weights:
+        bundle_path = args.bundle or os.path.join(model_dir, "indextts2.bundle.safetensors")
+        if not os.path.exists(bundle_path):
+            from indextts.utils.bundle import write_indextts2_bundle
+            logger.info(f"生成模型包: {bundle_path}")
+            write_indextts2_bundle(model_dir, config_path, bundle_path)
+        os.environ[SHARED_BUNDLE_ENV] = publish_shared_bundle(bundle_path, args.shm_dir or None)
+        logger.info(f"模型权重共享内存: {os.environ[SHARED_BUNDLE_ENV]}，{args.workers} 个工作进程共享")
     
     # 启动服务器
     uvicorn.run(
@@ -4,9 +4,190 @@ import warnings
 # Suppress warnings from tensorflow and other libraries
 warnings.filterwarnings("ignore", category=UserWarning)
 warnings.filterwarnings("ignore", category=FutureWarning)
+
+def quantize_main(argv):
+    """
+    `indextts quantize`: write the weight-only quantized checkpoint loaded by `IndexTTS2(quantize=...)`.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="indextts quantize", description="Quantize the IndexTTS2 GPT and DiT weights")
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Path to the model directory. Default is 'checkpoints'")
+    parser.add_argument("-c", "--config", type=str, default=None, help="Path to the config file. Default is '<model_dir>/config.yaml'")
+    parser.add_argument("--mode", type=str, default="int8", choices=["int8", "int4"], help="Quantization mode")
+    parser.add_argument("--groupsize", type=int, default=128, help="Group size of the int4 quantization")
+    parser.add_argument("--conformer", action="store_true", default=False, help="Also quantize the conformer conditioning encoders")
+    parser.add_argument("-o", "--output_path", type=str, default=None, help="Path to the output checkpoint. Default is '<model_dir>/quantized_<mode>.pth'")
+    args = parser.parse_args(argv)
+    config_path = args.config or os.path.join(args.model_dir, "config.yaml")
+    if not os.path.exists(config_path):
+        print(f"Config file {config_path} does not exist.")
+        sys.exit(1)
+    output_path = args.output_path or os.path.join(args.model_dir, f"quantized_{args.mode}.pth")
+
+    import torch.nn as nn
+    from omegaconf import OmegaConf
+    from indextts.gpt.model_v2 import UnifiedVoice
+    from indextts.infer_v2 import CONFORMER_QUANTIZE_TARGETS, DIT_QUANTIZE_TARGETS, GPT_QUANTIZE_TARGETS
+    from indextts.s2mel.modules.commons import load_checkpoint2, MyModel
+    from indextts.utils.checkpoint import load_checkpoint
+    from indextts.utils.hashing import file_fingerprint
+    from indextts.utils.quantization import quantize_module, save_quantized
+
+    cfg = OmegaConf.load(config_path)
+    gpt = UnifiedVoice(**cfg.gpt)
+    load_checkpoint(gpt, os.path.join(args.model_dir, cfg.gpt_checkpoint))
+    s2mel, _, _, _ = load_checkpoint2(
+        MyModel(cfg.s2mel, use_gpt_latent=True),
+        None,
+        os.path.join(args.model_dir, cfg.s2mel_checkpoint),
+        load_only_params=True,
+        ignore_modules=[],
+        is_distributed=False,
+    )
+    root = nn.ModuleDict({"gpt": gpt.eval(), "s2mel": s2mel.eval()})
+    targets = GPT_QUANTIZE_TARGETS + DIT_QUANTIZE_TARGETS + (CONFORMER_QUANTIZE_TARGETS if args.conformer else ())
+    for path in targets:
+        count = quantize_module(root, path, args.mode, args.groupsize)
+        print(f">> {path}: {count} linear layers quantized to {args.mode}")
+    # checked at load, a checkpoint quantized from older weights is not used
+    sources = {name: file_fingerprint(os.path.join(args.model_dir, name)) for name in (cfg.gpt_checkpoint, cfg.s2mel_checkpoint)}
+    save_quantized(root, targets, args.mode, args.groupsize, output_path, sources=sources)
+    print(">> quantized checkpoint saved to:", output_path)
+
+
+def bundle_main(argv):
+    """
+    `indextts bundle`: pack all the IndexTTS2 weights and configs into one file loaded by `IndexTTS2(bundle_path=...)`.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="indextts bundle", description="Pack the IndexTTS2 models into a single safetensors bundle for offline loading")
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Path to the model directory. Default is 'checkpoints'")
+    parser.add_argument("-c", "--config", type=str, default=None, help="Path to the config file. Default is '<model_dir>/config.yaml'")
+    parser.add_argument("--bigvgan", type=str, default=None, help="BigVGAN model id or local directory. Default is the vocoder of the config")
+    parser.add_argument("--no_qwen_emo", action="store_true", default=False, help="Do not bundle the emotion text model, it is then loaded from the model directory")
+    parser.add_argument("-o", "--output_path", type=str, default=None, help="Path to the output bundle. Default is '<model_dir>/indextts2.bundle.safetensors'")
+    args = parser.parse_args(argv)
+    config_path = args.config or os.path.join(args.model_dir, "config.yaml")
+    if not os.path.exists(config_path):
+        print(f"Config file {config_path} does not exist.")
+        sys.exit(1)
+    output_path = args.output_path or os.path.join(args.model_dir, "indextts2.bundle.safetensors")
+
+    from indextts.utils.bundle import write_indextts2_bundle
+    write_indextts2_bundle(args.model_dir, config_path, output_path, include_qwen_emo=not args.no_qwen_emo,
+                           bigvgan_name=args.bigvgan)
+    print(">> bundle saved to:", output_path)
+
+
+def _add_indextts2_args(parser):
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Path to the model directory. Default is 'checkpoints'")
+    parser.add_argument("-c", "--config", type=str, default=None, help="Path to the config file. Default is '<model_dir>/config.yaml'")
+    parser.add_argument("--bundle", type=str, default=None, help="Load the models from a bundle written by `indextts bundle` instead of --model_dir")
+    parser.add_argument("-d", "--device", type=str, default=None, help="Device to run the model on (cpu, cuda, mps, xpu).")
+    parser.add_argument("--precision", type=str, default=None, choices=["fp32", "fp16", "bf16"], help="Inference precision")
+    parser.add_argument("--max_text_tokens_per_segment", type=int, default=120, help="Max text tokens per generation segment")
+    parser.add_argument("--segment_cache_mb", type=float, default=0, help="Memory of the cache of the synthesized segments, repeated sentences with the same voice and settings are synthesized once")
+    parser.add_argument("--segment_cache_dir", type=str, default=None, help="Directory of the on-disk tier of the segment cache")
+
+
+def _load_indextts2(args):
+    config_path = args.config or os.path.join(args.model_dir, "config.yaml")
+    if args.bundle is None and not os.path.exists(config_path):
+        print(f"Config file {config_path} does not exist.")
+        sys.exit(1)
+    from indextts.infer_v2 import IndexTTS2
+    return IndexTTS2(cfg_path=config_path, model_dir=args.model_dir, device=args.device, precision=args.precision,
+                     bundle_path=args.bundle, segment_cache_mb=args.segment_cache_mb,
+                     segment_cache_dir=args.segment_cache_dir)
+
+
+def longform_main(argv):
+    """
+    `indextts longform`: synthesize a long text file into per-chapter audio files, resumable after an interruption.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="indextts longform", description="Synthesize a long document with IndexTTS2, segment by segment to disk, resuming from the manifest of the output directory")
+    parser.add_argument("text_file", type=str, help="UTF-8 text file of the document")
+    parser.add_argument("-v", "--voice", type=str, required=True, help="Path to the speaker audio prompt")
+    parser.add_argument("-o", "--output_dir", type=str, required=True, help="Directory of the chapter files and of manifest.json, run again with the same directory to resume")
+    parser.add_argument("--format", type=str, default="wav", choices=["wav", "flac"], help="Audio format of the chapters")
+    parser.add_argument("--no_chapters", action="store_true", default=False, help="Write a single file instead of one per chapter heading")
+    parser.add_argument("--chapter_pattern", type=str, default=None, help="Regex of the chapter title lines, markdown headings and 第N章 by default")
+    parser.add_argument("--emo_audio", type=str, default=None, help="Path to the emotion audio prompt")
+    parser.add_argument("--emo_alpha", type=float, default=1.0, help="Weight of the emotion audio prompt")
+    parser.add_argument("--interval_silence", type=int, default=200, help="Silence between segments in ms")
+    _add_indextts2_args(parser)
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.text_file):
+        print(f"Text file {args.text_file} does not exist.")
+        sys.exit(1)
+    if not os.path.exists(args.voice):
+        print(f"Audio prompt file {args.voice} does not exist.")
+        sys.exit(1)
+    with open(args.text_file, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    from indextts.utils.longform import CHAPTER_PATTERN, LongFormJob
+    tts = _load_indextts2(args)
+    chapter_pattern = None if args.no_chapters else (args.chapter_pattern or CHAPTER_PATTERN)
+    job = LongFormJob(tts, args.voice, args.output_dir, text=text, chapter_pattern=chapter_pattern,
+                      audio_format=args.format, interval_silence=args.interval_silence,
+                      max_text_tokens_per_segment=args.max_text_tokens_per_segment,
+                      emo_audio_prompt=args.emo_audio, emo_alpha=args.emo_alpha)
+    job.run()
+
+
+def batch_main(argv):
+    """
+    `indextts batch`: synthesize the items of a JSONL manifest into an output directory, with a status file.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="indextts batch", description="Synthesize the items of a JSONL manifest with IndexTTS2, grouped by voice, one audio file per item")
+    parser.add_argument("manifest", type=str, help="JSONL manifest, one item per line with text and voice (or prompt_audio), relative audio paths are relative to the manifest")
+    parser.add_argument("-o", "--output_dir", type=str, required=True, help="Directory of the audio files and of status.jsonl, run again with the same directory to skip the items done")
+    parser.add_argument("--format", type=str, default="wav", choices=["wav", "flac"], help="Audio format of the items")
+    parser.add_argument("--no_pipelined", action="store_true", default=False, help="Do not overlap the GPT generation with the synthesis of the generated segments")
+    parser.add_argument("--no_resume", action="store_true", default=False, help="Synthesize the items already done again")
+    _add_indextts2_args(parser)
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.manifest):
+        print(f"Manifest file {args.manifest} does not exist.")
+        sys.exit(1)
+
+    from indextts.utils.batch import BatchRunner, parse_manifest
+    with open(args.manifest, "r", encoding="utf-8") as f:
+        items = parse_manifest(f, base_dir=os.path.dirname(os.path.abspath(args.manifest)))
+    tts = _load_indextts2(args)
+    runner = BatchRunner(tts, args.output_dir, audio_format=args.format, pipelined=not args.no_pipelined,
+                         defaults={"max_text_tokens_per_segment": args.max_text_tokens_per_segment},
+                         resume=not args.no_resume)
+    counts = {}
+    for record in runner.run(items):
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+        if record["status"] != "done":
+            print(f">> {record['id']}: {record['status']}, {record['error']}")
+    print(f">> batch of {len(items)} items: " + ", ".join(f"{count} {status}" for status, count in counts.items()))
+    print(">> status file:", runner.status_path)
+    if counts.get("failed") or counts.get("invalid"):
+        sys.exit(1)
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "longform":
+        longform_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "quantize":
+        quantize_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "bundle":
+        bundle_main(sys.argv[2:])
+        return
     import argparse
-    parser = argparse.ArgumentParser(description="IndexTTS Command Line")
+    parser = argparse.ArgumentParser(description="IndexTTS Command Line",
+                                     epilog="Run `indextts longform -h`, `indextts batch -h`, `indextts quantize -h` or `indextts bundle -h` for the long-form synthesis, batch synthesis, quantization and bundle commands.")
     parser.add_argument("text", type=str, help="Text to be synthesized")
     parser.add_argument("-v", "--voice", type=str, required=True, help="Path to the audio prompt file (wav format)")
     parser.add_argument("-o", "--output_path", type=str, default="gen.wav", help="Path to the output wav file")
@@ -15,6 +196,7 @@ def main():
     parser.add_argument("--fp16", action="store_true", default=False, help="Use FP16 for inference if available")
     parser.add_argument("-f", "--force", action="store_true", default=False, help="Force to overwrite the output file if it exists")
     parser.add_argument("-d", "--device", type=str, default=None, help="Device to run the model on (cpu, cuda, mps, xpu)." )
+    parser.add_argument("--attn_backend", type=str, default=None, choices=["eager", "sdpa", "flash"], help="GPT attention backend, the fastest available one if not set")
     args = parser.parse_args()
     if len(args.text.strip()) == 0:
         print("ERROR: Text is empty.")
@@ -58,7 +240,8 @@ def main():
 
     # TODO: Add CLI support for IndexTTS2.
     from indextts.infer import IndexTTS
-    tts = IndexTTS(cfg_path=args.config, model_dir=args.model_dir, use_fp16=args.fp16, device=args.device)
+    tts = IndexTTS(cfg_path=args.config, model_dir=args.model_dir, use_fp16=args.fp16, device=args.device,
+                   attn_backend=args.attn_backend)
     tts.infer(audio_prompt=args.voice, text=args.text.strip(), output_path=output_path)
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+import sys
+from typing import Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# user facing names -> `GPT2Config._attn_implementation`
+ATTN_BACKENDS = {
+    "eager": "eager",
+    "sdpa": "sdpa",
+    "flash": "flash_attention_2",
+    "flash_attention_2": "flash_attention_2",
+}
+
+
+def _attention_classes(gpt: nn.Module) -> Optional[dict]:
+    """
+    The `GPT2_ATTENTION_CLASSES` of the module defining ``gpt`` (the vendored `transformers_gpt2.py` or
+    `transformers.models.gpt2.modeling_gpt2`). ``None`` if the attention function is dispatched at runtime
+    from `config._attn_implementation` (transformers >= 4.48).
+    """
+    return getattr(sys.modules[type(gpt).__module__], "GPT2_ATTENTION_CLASSES", None)
+
+
+def is_attn_backend_available(gpt: nn.Module, attn_implementation: str, device, dtype) -> bool:
+    classes = _attention_classes(gpt)
+    if classes is not None and attn_implementation not in classes:
+        return False
+    if attn_implementation == "sdpa":
+        return hasattr(F, "scaled_dot_product_attention")
+    if attn_implementation == "flash_attention_2":
+        from transformers.utils import is_flash_attn_2_available
+        return (torch.device(device).type == "cuda" and dtype in (torch.float16, torch.bfloat16)
+                and is_flash_attn_2_available())
+    return attn_implementation == "eager"
+
+
+def resolve_attn_backend(gpt: nn.Module, attn_backend: Optional[str], device, dtype) -> str:
+    """
+    Args:
+        attn_backend: ``"eager"``, ``"sdpa"``, ``"flash"``, or ``None``/``"auto"`` to pick the fastest
+            backend available on ``device``: flash_attention_2 > sdpa > eager.
+    Returns:
+        the `GPT2Config._attn_implementation` value.
+    """
+    if attn_backend is None or attn_backend == "auto":
+        for candidate in ("flash_attention_2", "sdpa"):
+            if is_attn_backend_available(gpt, candidate, device, dtype):
+                return candidate
+        return "eager"
+    if attn_backend not in ATTN_BACKENDS:
+        raise ValueError(f"Unknown attention backend: {attn_backend}, expected one of {list(ATTN_BACKENDS)} or 'auto'")
+    attn_implementation = ATTN_BACKENDS[attn_backend]
+    if not is_attn_backend_available(gpt, attn_implementation, device, dtype):
+        raise ValueError(f"Attention backend '{attn_backend}' is not available on {device} with {dtype}")
+    return attn_implementation
+
+
+def set_attn_implementation(gpt: nn.Module, attn_implementation: str):
+    """
+    Switch the attention implementation of a (loaded) GPT2Model in place, the weights are kept.
+    """
+    gpt.config._attn_implementation = attn_implementation
+    if "_attn_implementation" in vars(gpt):
+        # cached on the model by the vendored GPT2Model and transformers < 4.48
+        gpt._attn_implementation = attn_implementation
+    classes = _attention_classes(gpt)
+    if classes is None:
+        return
+    attention_class = classes[attn_implementation]
+    for i, block in enumerate(gpt.h):
+        if type(block.attn) is attention_class:
+            continue
+        attn = attention_class(config=gpt.config, layer_idx=i)
+        # reuse the projections (possibly quantized) and buffers of the current attention module
+        for name, child in block.attn.named_children():
+            setattr(attn, name, child)
+        for name, buffer in block.attn.named_buffers(recurse=False):
+            setattr(attn, name, buffer)
+        block.attn = attn.train(block.attn.training)
@@ -13,9 +13,11 @@ from transformers.modeling_outputs import CausalLMOutputWithCrossAttentions
 from transformers.utils.model_parallel_utils import (assert_device_map,
                                                      get_device_map)
 
+from indextts.gpt.attention_backend import resolve_attn_backend, set_attn_implementation
 from indextts.gpt.conformer_encoder import ConformerEncoder
 from indextts.gpt.perceiver import PerceiverResampler
 from indextts.utils.arch_util import AttentionBlock
+from indextts.utils.early_stopping import build_early_stop_processor
 from indextts.utils.typical_sampling import TypicalLogitsWarper
 
 
@@ -390,8 +392,16 @@ class UnifiedVoice(nn.Module):
         for module in embeddings:
             module.weight.data.normal_(mean=0.0, std=.02)
 
-    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False):
+    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False, attn_backend=None):
+        """
+        Args:
+            attn_backend: attention of the GPT2 blocks, ``"eager"``, ``"sdpa"``, ``"flash"``,
+                or ``None``/``"auto"`` for the fastest one available on the current device.
+        """
         seq_length = self.max_mel_tokens + self.max_text_tokens + 2
+        param = self.text_embedding.weight
+        self.attn_implementation = resolve_attn_backend(self.gpt, attn_backend, param.device, param.dtype)
+        set_attn_implementation(self.gpt, self.attn_implementation)
         gpt_config = GPT2Config(
             vocab_size=self.number_mel_codes,
             n_positions=seq_length,
@@ -427,6 +437,10 @@ class UnifiedVoice(nn.Module):
             self.inference_model = self.ds_engine.module.eval()
         else:
             self.inference_model = self.inference_model.eval()
+        if use_deepspeed and torch.cuda.is_available():
+            print(">> GPT2 attention: DeepSpeed kernel injection")
+        else:
+            print(f">> GPT2 attention backend: {self.attn_implementation}")
 
         # self.inference_model = PrunedGPT2InferenceModel(gpt_config, self.gpt, self.mel_pos_embedding, self.mel_embedding, self.final_norm, self.mel_head)
         self.gpt.wte = self.mel_embedding
@@ -612,6 +626,56 @@ class UnifiedVoice(nn.Module):
         b, L = text_inputs.shape[:2]
         device = text_inputs.device
         single_cond = conditional_latents.ndim == 3 and conditional_latents.shape[0] == 1
+        if not single_cond:
+            assert conditional_latents.shape[0] == b, f"batch size mismatch: {conditional_latents.shape[0]} vs {b}"
+        target_len = conditional_latents.shape[1] + L + 2
+        # move the valid text tokens to the left, keeping their order: [t_1..t_n][stop...]
+        valid_mask = (text_inputs != self.stop_text_token) & (text_inputs != self.start_text_token)
+        text_lengths = valid_mask.sum(dim=-1)  # (b,)
+        dest = torch.where(valid_mask, valid_mask.long().cumsum(dim=-1) - 1, L)
+        text_packed = torch.full((b, L + 1), self.stop_text_token, dtype=text_inputs.dtype, device=device)
+        text_packed.scatter_(1, dest, text_inputs)
+        # [start][t_1..t_n][stop][stop...], (b, L+2)
+        text_packed = F.pad(text_packed[:, :L], (1, 0), value=self.start_text_token)
+        text_packed = F.pad(text_packed, (0, 1), value=self.stop_text_token)
+        text_input_pos = torch.arange(0, L + 2, device=device)
+        text_emb = self.text_embedding(text_packed) + self.text_pos_embedding.emb(text_input_pos)
+        # concatenate [conditional latents][text embeddings], (b, s, dim)
+        conds = conditional_latents.expand(b, -1, -1) if single_cond else conditional_latents
+        conds_text_emb = torch.cat([conds, text_emb], dim=1)
+        # right align each row: [cond][text][garbage] -> [pad][cond][text]
+        padding = (L - text_lengths).unsqueeze(-1)  # (b, 1)
+        positions = torch.arange(target_len + 1, device=device).unsqueeze(0)  # +1 for the start_mel_token
+        # [b, s+1]
+        attention_mask = (positions >= padding).long()
+        gather_index = (positions[:, :target_len] - padding).clamp(min=0)
+        gather_index = gather_index.unsqueeze(-1).expand(-1, -1, conds_text_emb.size(-1))
+        # [b, s, dim]
+        batched_mel_emb = conds_text_emb.gather(1, gather_index)
+        batched_mel_emb = batched_mel_emb.masked_fill(attention_mask[:, :target_len, None] == 0, 0)
+        # [b, s+1]
+        fake_inputs = torch.ones(
+            (
+                batched_mel_emb.shape[0],
+                batched_mel_emb.shape[1] + 1,  # +1 for the start_mel_token
+            ),
+            dtype=torch.long,
+            device=device,
+        )
+        fake_inputs[:, -1] = self.start_mel_token
+        return fake_inputs, batched_mel_emb, attention_mask
+
+    def prepare_gpt_inputs_loop(
+        self,
+        conditional_latents: torch.Tensor,
+        text_inputs: torch.Tensor,
+    ):
+        """
+        Reference per-row implementation of `prepare_gpt_inputs()`, kept to verify the batched version.
+        """
+        b, L = text_inputs.shape[:2]
+        device = text_inputs.device
+        single_cond = conditional_latents.ndim == 3 and conditional_latents.shape[0] == 1
         if not single_cond:
             assert conditional_latents.shape[0] == b, f"batch size mismatch: {conditional_latents.shape[0]} vs {b}"
         batched_mel_emb = []
@@ -658,7 +722,7 @@ class UnifiedVoice(nn.Module):
         fake_inputs[:, -1] = self.start_mel_token
         return fake_inputs, batched_mel_emb, attention_mask
     def inference_speech(self, speech_conditioning_mel, text_inputs, cond_mel_lengths=None, input_tokens=None, num_return_sequences=1,
-                         max_generate_length=None, typical_sampling=False, typical_mass=.9, **hf_generate_kwargs):
+                         max_generate_length=None, typical_sampling=False, typical_mass=.9, early_stop=False, **hf_generate_kwargs):
         """
         Args:
             speech_conditioning_mel: (b, n_mels, frames) or (n_mels, frames)
@@ -666,6 +730,8 @@ class UnifiedVoice(nn.Module):
             cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
             input_tokens: additional tokens for generation in shape (b, s) or (s,)
             max_generate_length: limit the number of generated tokens
+            early_stop: force `stop_mel_token` for degenerate rows (silence runs, loops, length budget),
+                ``True`` or a dict of kwargs, see `indextts.utils.early_stopping.build_early_stop_processor`
             hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
         """
         if speech_conditioning_mel.ndim == 2:
@@ -699,6 +765,10 @@ class UnifiedVoice(nn.Module):
                 raise ValueError(f"`typical_mass` has to be a float > 0 and < 1, but is {typical_mass}")
             min_tokens_to_keep = 2 if hf_generate_kwargs.get("num_beams", 1) > 1 else 1
             logits_processor.append(TypicalLogitsWarper(mass=typical_mass, min_tokens_to_keep=min_tokens_to_keep))
+        early_stop_processor = build_early_stop_processor(early_stop, self.stop_mel_token, trunc_index, text_inputs,
+                                                          self.start_text_token, self.stop_text_token)
+        if early_stop_processor is not None:
+            logits_processor.append(early_stop_processor)
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
         output = self.inference_model.generate(inputs, 
                                             bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
@@ -13,9 +13,12 @@ from transformers.modeling_outputs import CausalLMOutputWithCrossAttentions
 from transformers.utils.model_parallel_utils import (assert_device_map,
                                                      get_device_map)
 
+from indextts.gpt.attention_backend import resolve_attn_backend, set_attn_implementation
 from indextts.gpt.conformer_encoder import ConformerEncoder
 from indextts.gpt.perceiver import PerceiverResampler
+from indextts.gpt.static_kv import StaticGPT2Decoder, StaticKVCache, round_up
 from indextts.utils.arch_util import AttentionBlock
+from indextts.utils.early_stopping import build_early_stop_processor
 from indextts.utils.typical_sampling import TypicalLogitsWarper
 
 
@@ -57,6 +60,25 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         self.model_parallel = False
         self.device_map = None
         self.cached_mel_emb = None
+        # single token decode against a preallocated KV cache, see `enable_static_kv`
+        self.static_decoder = None
+        self.static_kv_multiple = 256
+        self.static_kv_length = None
+
+    def enable_static_kv(self, compile=False, multiple=256, **compile_kwargs):
+        """
+        Decode the tokens against a `StaticKVCache` instead of the growing legacy cache, so that the decode step
+        has the same shapes for all the tokens of a generation, and can be compiled.
+
+        Args:
+            compile: compile the decode step with `torch.compile(**compile_kwargs)`.
+            multiple: the cache capacity is the generation max length rounded up to this multiple, which bounds
+                the number of compiled variants.
+        """
+        self.static_decoder = StaticGPT2Decoder(self.transformer)
+        if compile:
+            self.static_decoder.compile(**compile_kwargs)
+        self.static_kv_multiple = multiple
 
     def parallelize(self, device_map=None):
         self.device_map = (
@@ -142,6 +164,18 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         )
         # Create embedding
         mel_len = self.cached_mel_emb.shape[1]
+        if isinstance(past_key_values, StaticKVCache):
+            emb = self.embeddings(input_ids)
+            emb = emb + self.text_pos_embedding.get_fixed_embedding(
+                attention_mask.shape[1] - mel_len, attention_mask.device
+            )
+            hidden_states = past_key_values.decode(self.static_decoder, emb, attention_mask)
+            lm_logits = self.lm_head(hidden_states)
+            if not return_dict:
+                return (lm_logits, past_key_values)
+            return CausalLMOutputWithCrossAttentions(loss=None, logits=lm_logits, past_key_values=past_key_values)
+        if use_cache is None:
+            use_cache = self.config.use_cache
         if input_ids.shape[1] != 1:
             text_inputs = input_ids[:, mel_len:]
             text_emb = self.embeddings(text_inputs)
@@ -173,6 +207,12 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             return_dict=return_dict,
         )
         hidden_states = transformer_outputs[0]
+        past_key_values = transformer_outputs[1] if use_cache else None
+        if (self.static_decoder is not None and past_key_values is not None and attention_mask is not None
+                and self.static_kv_length is not None):
+            # prefill done: move the legacy cache into a static one for the decode steps
+            capacity = round_up(max(self.static_kv_length, attention_mask.shape[1]), self.static_kv_multiple)
+            past_key_values = StaticKVCache(past_key_values, capacity)
 
         # Set device for model parallelism
         if self.model_parallel:
@@ -185,12 +225,14 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         lm_logits = self.lm_head(hidden_states)
 
         if not return_dict:
-            return (lm_logits,) + transformer_outputs[1:]
+            if use_cache:
+                return (lm_logits, past_key_values) + tuple(transformer_outputs[2:])
+            return (lm_logits,) + tuple(transformer_outputs[1:])
 
         return CausalLMOutputWithCrossAttentions(
             loss=None,
             logits=lm_logits,
-            past_key_values=transformer_outputs.past_key_values,
+            past_key_values=past_key_values,
             hidden_states=transformer_outputs.hidden_states,
             attentions=transformer_outputs.attentions,
             cross_attentions=transformer_outputs.cross_attentions,
@@ -203,6 +245,10 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         :meth:`~transformers.PreTrainedModel.beam_search` or :meth:`~transformers.PreTrainedModel.beam_sample` is
         called. This is required to match :obj:`past_key_values` with the correct beam_idx at every generation step.
         """
+        if isinstance(past, StaticKVCache):
+            # the static cache of the compiled decode step is reordered in place
+            past.reorder_cache(beam_idx)
+            return past
         return tuple(
             tuple(
                 past_state.index_select(0, beam_idx.to(past_state.device))
@@ -409,8 +455,16 @@ class UnifiedVoice(nn.Module):
         for module in embeddings:
             module.weight.data.normal_(mean=0.0, std=.02)
 
-    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False):
+    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False, attn_backend=None):
+        """
+        Args:
+            attn_backend: attention of the GPT2 blocks, ``"eager"``, ``"sdpa"``, ``"flash"``,
+                or ``None``/``"auto"`` for the fastest one available on the current device.
+        """
         seq_length = self.max_mel_tokens + self.max_text_tokens + 2
+        param = self.text_embedding.weight  # never quantized
+        self.attn_implementation = resolve_attn_backend(self.gpt, attn_backend, param.device, param.dtype)
+        set_attn_implementation(self.gpt, self.attn_implementation)
         gpt_config = GPT2Config(
             vocab_size=self.number_mel_codes,
             n_positions=seq_length,
@@ -446,6 +500,10 @@ class UnifiedVoice(nn.Module):
             self.inference_model = self.ds_engine.module.eval()
         else:
             self.inference_model = self.inference_model.eval()
+        if use_deepspeed and torch.cuda.is_available():
+            print(">> GPT2 attention: DeepSpeed kernel injection")
+        else:
+            print(f">> GPT2 attention backend: {self.attn_implementation}")
 
         # self.inference_model = PrunedGPT2InferenceModel(gpt_config, self.gpt, self.mel_pos_embedding, self.mel_embedding, self.final_norm, self.mel_head)
         self.gpt.wte = self.mel_embedding
@@ -614,6 +672,56 @@ class UnifiedVoice(nn.Module):
         b, L = text_inputs.shape[:2]
         device = text_inputs.device
         single_cond = conditional_latents.ndim == 3 and conditional_latents.shape[0] == 1
+        if not single_cond:
+            assert conditional_latents.shape[0] == b, f"batch size mismatch: {conditional_latents.shape[0]} vs {b}"
+        target_len = conditional_latents.shape[1] + L + 2
+        # move the valid text tokens to the left, keeping their order: [t_1..t_n][stop...]
+        valid_mask = (text_inputs != self.stop_text_token) & (text_inputs != self.start_text_token)
+        text_lengths = valid_mask.sum(dim=-1)  # (b,)
+        dest = torch.where(valid_mask, valid_mask.long().cumsum(dim=-1) - 1, L)
+        text_packed = torch.full((b, L + 1), self.stop_text_token, dtype=text_inputs.dtype, device=device)
+        text_packed.scatter_(1, dest, text_inputs)
+        # [start][t_1..t_n][stop][stop...], (b, L+2)
+        text_packed = F.pad(text_packed[:, :L], (1, 0), value=self.start_text_token)
+        text_packed = F.pad(text_packed, (0, 1), value=self.stop_text_token)
+        text_input_pos = torch.arange(0, L + 2, device=device)
+        text_emb = self.text_embedding(text_packed) + self.text_pos_embedding.emb(text_input_pos)
+        # concatenate [conditional latents][text embeddings], (b, s, dim)
+        conds = conditional_latents.expand(b, -1, -1) if single_cond else conditional_latents
+        conds_text_emb = torch.cat([conds, text_emb], dim=1)
+        # right align each row: [cond][text][garbage] -> [pad][cond][text]
+        padding = (L - text_lengths).unsqueeze(-1)  # (b, 1)
+        positions = torch.arange(target_len + 1, device=device).unsqueeze(0)  # +1 for the start_mel_token
+        # [b, s+1]
+        attention_mask = (positions >= padding).long()
+        gather_index = (positions[:, :target_len] - padding).clamp(min=0)
+        gather_index = gather_index.unsqueeze(-1).expand(-1, -1, conds_text_emb.size(-1))
+        # [b, s, dim]
+        batched_mel_emb = conds_text_emb.gather(1, gather_index)
+        batched_mel_emb = batched_mel_emb.masked_fill(attention_mask[:, :target_len, None] == 0, 0)
+        # [b, s+1]
+        fake_inputs = torch.ones(
+            (
+                batched_mel_emb.shape[0],
+                batched_mel_emb.shape[1] + 1,  # +1 for the start_mel_token
+            ),
+            dtype=torch.long,
+            device=device,
+        )
+        fake_inputs[:, -1] = self.start_mel_token
+        return fake_inputs, batched_mel_emb, attention_mask
+
+    def prepare_gpt_inputs_loop(
+        self,
+        conditional_latents: torch.Tensor,
+        text_inputs: torch.Tensor,
+    ):
+        """
+        Reference per-row implementation of `prepare_gpt_inputs()`, kept to verify the batched version.
+        """
+        b, L = text_inputs.shape[:2]
+        device = text_inputs.device
+        single_cond = conditional_latents.ndim == 3 and conditional_latents.shape[0] == 1
         if not single_cond:
             assert conditional_latents.shape[0] == b, f"batch size mismatch: {conditional_latents.shape[0]} vs {b}"
         batched_mel_emb = []
@@ -661,7 +769,7 @@ class UnifiedVoice(nn.Module):
         return fake_inputs, batched_mel_emb, attention_mask
 
     def inference_speech(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, use_speed=False, input_tokens=None, num_return_sequences=1,
-                         max_generate_length=None, typical_sampling=False, typical_mass=.9, **hf_generate_kwargs):
+                         max_generate_length=None, typical_sampling=False, typical_mass=.9, early_stop=False, **hf_generate_kwargs):
         """
         Args:
             speech_condition: (b, d, frames) or (d, frames)
@@ -669,6 +777,8 @@ class UnifiedVoice(nn.Module):
             cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
             input_tokens: additional tokens for generation in shape (b, s) or (s,)
             max_generate_length: limit the number of generated tokens
+            early_stop: force `stop_mel_token` for degenerate rows (silence runs, loops, length budget),
+                ``True`` or a dict of kwargs, see `indextts.utils.early_stopping.build_early_stop_processor`
             hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
         """
 
@@ -720,7 +830,12 @@ class UnifiedVoice(nn.Module):
                 raise ValueError(f"`typical_mass` has to be a float > 0 and < 1, but is {typical_mass}")
             min_tokens_to_keep = 2 if hf_generate_kwargs.get("num_beams", 1) > 1 else 1
             logits_processor.append(TypicalLogitsWarper(mass=typical_mass, min_tokens_to_keep=min_tokens_to_keep))
+        early_stop_processor = build_early_stop_processor(early_stop, self.stop_mel_token, trunc_index, text_inputs,
+                                                          self.start_text_token, self.stop_text_token)
+        if early_stop_processor is not None:
+            logits_processor.append(early_stop_processor)
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
+        self.inference_model.static_kv_length = max_length
         output = self.inference_model.generate(inputs, 
                                             bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
                                             eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
@@ -0,0 +1,88 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+def round_up(length: int, multiple: int) -> int:
+    return (length + multiple - 1) // multiple * multiple
+
+
+class StaticKVCache:
+    """
+    Preallocated keys and values of all the GPT2 layers for ``capacity`` positions, filled from the legacy
+    ``past_key_values`` of the prefill. The decode steps write their position in place, so the shapes seen by
+    the decode step never change during the generation and a compiled step is reused for every token.
+
+    Passed through `generate()` as ``past_key_values``: beam search reorders it by `reorder_cache`.
+    """
+
+    def __init__(self, legacy_past, capacity: int):
+        batch_size, num_heads, length, head_dim = legacy_past[0][0].shape
+        if capacity < length:
+            raise ValueError(f"static KV cache capacity {capacity} is smaller than the prefill length {length}")
+        self.keys = []
+        self.values = []
+        for key, value in legacy_past:
+            key_cache = key.new_zeros(batch_size, num_heads, capacity, head_dim)
+            value_cache = value.new_zeros(batch_size, num_heads, capacity, head_dim)
+            key_cache[:, :, :length] = key
+            value_cache[:, :, :length] = value
+            self.keys.append(key_cache)
+            self.values.append(value_cache)
+        self.capacity = capacity
+        self.length = length
+
+    def __bool__(self):
+        # `prepare_inputs_for_generation` only feeds the last token when the past is truthy
+        return True
+
+    def reorder_cache(self, beam_idx: torch.Tensor):
+        beam_idx = beam_idx.to(self.keys[0].device)
+        for cache in self.keys + self.values:
+            cache.copy_(cache.index_select(0, beam_idx))
+
+    def decode(self, decoder: "StaticGPT2Decoder", hidden_states: torch.Tensor,
+               attention_mask: torch.Tensor) -> torch.Tensor:
+        """
+        Run one decode step of ``hidden_states`` (b, 1, d), attending to the positions of ``attention_mask`` (b, s),
+        the last one being the current token.
+        """
+        length = attention_mask.shape[1]
+        if length > self.capacity:
+            raise RuntimeError(f"static KV cache overflow: {length} > {self.capacity}")
+        position = torch.full((1,), length - 1, dtype=torch.long, device=hidden_states.device)
+        mask = F.pad(attention_mask.bool(), (0, self.capacity - length), value=False)[:, None, None, :]
+        hidden_states = decoder(hidden_states, self.keys, self.values, position, mask)
+        self.length = length
+        return hidden_states
+
+
+class StaticGPT2Decoder(nn.Module):
+    """
+    Single token decode step of a `GPT2Model` against a `StaticKVCache`, numerically the same as the blocks of
+    ``gpt`` with a growing legacy cache. Calls the submodules of the blocks, so quantized projections are used as is.
+    Built to be compiled with static shapes: (batch, capacity) only changes between generations.
+    """
+
+    def __init__(self, gpt: nn.Module):
+        super().__init__()
+        self.blocks = gpt.h
+        self.ln_f = gpt.ln_f
+
+    def forward(self, hidden_states, keys, values, position, attention_mask):
+        batch_size = hidden_states.shape[0]
+        for block, key_cache, value_cache in zip(self.blocks, keys, values):
+            attn = block.attn
+            residual = hidden_states
+            query, key, value = attn.c_attn(block.ln_1(hidden_states)).split(attn.split_size, dim=2)
+            # (b, 1, d) -> (b, heads, 1, head_dim), `GPT2Attention` has no `_split_heads` since transformers 4.48
+            query, key, value = (tensor.view(batch_size, 1, attn.num_heads, attn.head_dim).transpose(1, 2)
+                                 for tensor in (query, key, value))
+            key_cache.index_copy_(2, position, key.to(key_cache.dtype))
+            value_cache.index_copy_(2, position, value.to(value_cache.dtype))
+            attn_output = F.scaled_dot_product_attention(query, key_cache.to(query.dtype),
+                                                         value_cache.to(query.dtype), attn_mask=attention_mask)
+            attn_output = attn.c_proj(attn_output.transpose(1, 2).reshape(batch_size, 1, -1))
+            hidden_states = residual + attn_output
+            hidden_states = hidden_states + block.mlp(block.ln_2(hidden_states))
+        return self.ln_f(hidden_states)
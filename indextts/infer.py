@@ -22,12 +22,14 @@ from indextts.utils.checkpoint import load_checkpoint
 from indextts.utils.feature_extractors import MelSpectrogramFeatures
 
 from indextts.utils.front import TextNormalizer, TextTokenizer
+from indextts.utils.mel_codes import postprocess_mel_codes
+from indextts.utils.mel_budget import MelBudgetEstimator
 
 
 class IndexTTS:
     def __init__(
             self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=True, device=None,
-            use_cuda_kernel=None,
+            use_cuda_kernel=None, attn_backend=None,
     ):
         """
         Args:
@@ -36,6 +38,7 @@ class IndexTTS:
             use_fp16 (bool): whether to use fp16.
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
+            attn_backend (None | str): attention backend of the GPT, 'eager', 'sdpa' or 'flash'. If None, the fastest one available on the device is used.
         """
         if device is not None:
             self.device = device
@@ -95,9 +98,11 @@ class IndexTTS:
                 use_deepspeed = False
                 print(f">> DeepSpeed加载失败，回退到标准推理: {e}")
 
-            self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=True)
+            self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=True,
+                                          attn_backend=attn_backend)
         else:
-            self.gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=False, half=False)
+            self.gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=False, half=False,
+                                          attn_backend=attn_backend)
 
         if self.use_cuda_kernel:
             # preload the CUDA kernel for BigVGAN
@@ -124,6 +129,9 @@ class IndexTTS:
         print(">> TextNormalizer loaded")
         self.tokenizer = TextTokenizer(self.bpe_path, self.normalizer)
         print(">> bpe model loaded from:", self.bpe_path)
+        # per-segment mel code budget, ~23 codes per second
+        code_rate = self.cfg.dataset["sample_rate"] / self.cfg.gpt.mel_length_compression
+        self.mel_budget = MelBudgetEstimator(code_rate, max_mel_tokens=self.cfg.gpt.max_mel_tokens)
         # 缓存参考音频mel：
         self.cache_audio_prompt = None
         self.cache_cond_mel = None
@@ -136,66 +144,20 @@ class IndexTTS:
         Shrink special tokens (silent_token and stop_mel_token) in codes
         codes: [B, T]
         """
-        code_lens = []
-        codes_list = []
-        device = codes.device
-        dtype = codes.dtype
-        isfix = False
-        for i in range(0, codes.shape[0]):
-            code = codes[i]
-            if not torch.any(code == self.stop_mel_token).item():
-                len_ = code.size(0)
-            else:
-                stop_mel_idx = (code == self.stop_mel_token).nonzero(as_tuple=False)
-                len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
-
-            count = torch.sum(code == silent_token).item()
-            if count > max_consecutive:
-                # code = code.cpu().tolist()
-                ncode_idx = []
-                n = 0
-                for k in range(len_):
-                    assert code[
-                               k] != self.stop_mel_token, f"stop_mel_token {self.stop_mel_token} should be shrinked here"
-                    if code[k] != silent_token:
-                        ncode_idx.append(k)
-                        n = 0
-                    elif code[k] == silent_token and n < 10:
-                        ncode_idx.append(k)
-                        n += 1
-                    # if (k == 0 and code[k] == 52) or (code[k] == 52 and code[k-1] == 52):
-                    #    n += 1
-                # new code
-                len_ = len(ncode_idx)
-                codes_list.append(code[ncode_idx])
-                isfix = True
-            else:
-                # shrink to len_
-                codes_list.append(code[:len_])
-            code_lens.append(len_)
-        if isfix:
-            if len(codes_list) > 1:
-                codes = pad_sequence(codes_list, batch_first=True, padding_value=self.stop_mel_token)
-            else:
-                codes = codes_list[0].unsqueeze(0)
-        else:
-            # unchanged
-            pass
-        # clip codes to max length
-        max_len = max(code_lens)
-        if max_len < codes.shape[1]:
-            codes = codes[:, :max_len]
-        code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
-        return codes, code_lens
-
-    def bucket_segments(self, segments, bucket_max_size=4) -> List[List[Dict]]:
+        return postprocess_mel_codes(codes, self.stop_mel_token, silent_token=silent_token,
+                                     max_consecutive=max_consecutive)
+
+    def bucket_segments(self, segments, bucket_max_size=4, costs=None) -> List[List[Dict]]:
         """
         Segment data bucketing.
         if ``bucket_max_size=1``, return all segments in one bucket.
+        ``costs``: optional estimated cost per segment (e.g. expected mel tokens) used for grouping
+            instead of the text token count.
         """
         outputs: List[Dict] = []
         for idx, sent in enumerate(segments):
-            outputs.append({"idx": idx, "sent": sent, "len": len(sent)})
+            outputs.append({"idx": idx, "sent": sent, "len": len(sent),
+                            "cost": len(sent) if costs is None else costs[idx]})
 
         if len(outputs) > bucket_max_size:
             # split segments into buckets by segment length
@@ -204,11 +166,11 @@ class IndexTTS:
             last_bucket = None
             last_bucket_sent_len_median = 0
 
-            for sent in sorted(outputs, key=lambda x: x["len"]):
-                current_sent_len = sent["len"]
-                if current_sent_len == 0:
+            for sent in sorted(outputs, key=lambda x: x["cost"]):
+                if sent["len"] == 0:
                     print(">> skip empty segment")
                     continue
+                current_sent_len = sent["cost"]
                 if last_bucket is None \
                         or current_sent_len >= int(last_bucket_sent_len_median * factor) \
                         or len(last_bucket) >= bucket_max_size:
@@ -220,7 +182,7 @@ class IndexTTS:
                     # current bucket can hold more segments
                     last_bucket.append(sent)  # sorted
                     mid = len(last_bucket) // 2
-                    last_bucket_sent_len_median = last_bucket[mid]["len"]
+                    last_bucket_sent_len_median = last_bucket[mid]["cost"]
             last_bucket = None
             # merge all buckets with size 1
             out_buckets: List[List[Dict]] = []
@@ -281,7 +243,7 @@ class IndexTTS:
 
     # 快速推理：对于“多句长文本”，可实现至少 2~10 倍以上的速度提升~ （First modified by sunnyboxs 2025-04-16）
     def infer_fast(self, audio_prompt, text, output_path, verbose=False, max_text_tokens_per_segment=100,
-                   segments_bucket_max_size=4, **generation_kwargs):
+                   segments_bucket_max_size=4, balanced_segments=False, **generation_kwargs):
         """
         Args:
             ``max_text_tokens_per_segment``: 分句的最大token数，默认``100``，可以根据GPU硬件情况调整
@@ -290,6 +252,7 @@ class IndexTTS:
             ``segments_bucket_max_size``: 分句分桶的最大容量，默认``4``，可以根据GPU内存调整
                 - 越大，bucket数量越少，batch越多，推理速度越*快*，占用内存更多，可能影响质量
                 - 越小，bucket数量越多，batch越少，推理速度越*慢*，占用内存和质量更接近于非快速推理
+            ``balanced_segments``: 在整段文本上选择分句位置，使各分句长度接近，减少分桶后batch中的填充
         """
         print(">> starting fast inference...")
 
@@ -333,7 +296,12 @@ class IndexTTS:
         text_tokens_list = self.tokenizer.tokenize(text)
 
         segments = self.tokenizer.split_segments(text_tokens_list,
-                                                   max_text_tokens_per_segment=max_text_tokens_per_segment)
+                                                   max_text_tokens_per_segment=max_text_tokens_per_segment,
+                                                   balanced=balanced_segments)
+        print(f">> segments: {len(segments)}, lengths {min(len(s) for s in segments) if segments else 0}"
+              f"-{max(len(s) for s in segments) if segments else 0}, expected padding waste "
+              f"{self.tokenizer.padding_waste(segments, segments_bucket_max_size):.1%} "
+              f"with buckets of {segments_bucket_max_size}")
         if verbose:
             print(">> text token count:", len(text_tokens_list))
             print("   segments count:", len(segments))
@@ -348,6 +316,11 @@ class IndexTTS:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        early_stop = generation_kwargs.pop("early_stop", True)
+        if early_stop is True:
+            # ~23 mel codes per second, the budget is far beyond the normal speaking rate
+            early_stop = {"max_tokens_per_text_token": 15, "min_length_budget": 30}
+        use_mel_budget = generation_kwargs.pop("mel_budget", True)
         sampling_rate = 24000
         # lang = "EN"
         # lang = "ZH"
@@ -360,7 +333,13 @@ class IndexTTS:
         all_text_tokens: List[List[torch.Tensor]] = []
         self._set_gr_progress(0.1, "text processing...")
         bucket_max_size = segments_bucket_max_size if self.device != "cpu" else 1
-        all_segments = self.bucket_segments(segments, bucket_max_size=bucket_max_size)
+        if use_mel_budget:
+            # (expected, budget) mel tokens of each segment, the expected length is the bucketing cost
+            mel_estimates = [self.mel_budget.estimate(sent) for sent in segments]
+            all_segments = self.bucket_segments(segments, bucket_max_size=bucket_max_size,
+                                                costs=[expected for expected, _ in mel_estimates])
+        else:
+            all_segments = self.bucket_segments(segments, bucket_max_size=bucket_max_size)
         bucket_count = len(all_segments)
         if verbose:
             print(">> segments bucket_count:", bucket_count,
@@ -385,13 +364,25 @@ class IndexTTS:
         all_batch_num = sum(len(s) for s in all_segments)
         all_batch_codes = []
         processed_num = 0
-        for item_tokens in all_text_tokens:
+        all_batch_budgets = []
+        for item_tokens, item_segments in zip(all_text_tokens, all_segments):
             batch_num = len(item_tokens)
             if batch_num > 1:
                 batch_text_tokens = self.pad_tokens_cat(item_tokens)
             else:
                 batch_text_tokens = item_tokens[0]
             processed_num += batch_num
+            batch_early_stop = early_stop
+            if use_mel_budget:
+                budgets = [min(mel_estimates[item["idx"]][1], max_mel_tokens) for item in item_segments]
+                max_generate_length = max(budgets)
+                if isinstance(early_stop, dict):
+                    # per-row budgets, shorter rows of the bucket stop at their own budget
+                    batch_early_stop = dict(early_stop, length_budget=torch.tensor(budgets, device=self.device))
+            else:
+                budgets = [max_mel_tokens] * batch_num
+                max_generate_length = max_mel_tokens
+            all_batch_budgets.append(budgets)
             # gpt speech
             self._set_gr_progress(0.2 + 0.3 * processed_num / all_batch_num,
                                   f"gpt speech inference {processed_num}/{all_batch_num}...")
@@ -410,7 +401,8 @@ class IndexTTS:
                                                            length_penalty=length_penalty,
                                                            num_beams=num_beams,
                                                            repetition_penalty=repetition_penalty,
-                                                           max_generate_length=max_mel_tokens,
+                                                           max_generate_length=max_generate_length,
+                                                           early_stop=batch_early_stop,
                                                            **generation_kwargs)
                     all_batch_codes.append(temp_codes)
             gpt_gen_time += time.perf_counter() - m_start_time
@@ -420,9 +412,16 @@ class IndexTTS:
         all_idxs = []
         all_latents = []
         has_warned = False
-        for batch_codes, batch_tokens, batch_segments in zip(all_batch_codes, all_text_tokens, all_segments):
+        for batch_codes, batch_tokens, batch_segments, batch_budgets in zip(all_batch_codes, all_text_tokens,
+                                                                            all_segments, all_batch_budgets):
+            # remove ultra-long silence of the whole batch at once, then cut each row to its own length
+            batch_fixed_codes, batch_code_lens = self.remove_long_silence(batch_codes, silent_token=52, max_consecutive=30)
+            batch_code_lens_list = batch_code_lens.tolist()
             for i in range(batch_codes.shape[0]):
                 codes = batch_codes[i]  # [x]
+                if use_mel_budget:
+                    self.mel_budget.record(mel_estimates[batch_segments[i]["idx"]][0],
+                                           (codes != self.stop_mel_token).sum().item(), batch_budgets[i])
                 if not has_warned and codes[-1] != self.stop_mel_token:
                     warnings.warn(
                         f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
@@ -430,11 +429,11 @@ class IndexTTS:
                         category=RuntimeWarning
                     )
                     has_warned = True
-                codes = codes.unsqueeze(0)  # [x] -> [1, x]
                 if verbose:
                     print("codes:", codes.shape)
                     print(codes)
-                codes, code_lens = self.remove_long_silence(codes, silent_token=52, max_consecutive=30)
+                codes = batch_fixed_codes[i:i + 1, :batch_code_lens_list[i]]  # [1, x]
+                code_lens = batch_code_lens[i:i + 1]
                 if verbose:
                     print("fix codes:", codes.shape)
                     print(codes)
@@ -561,6 +560,10 @@ class IndexTTS:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        early_stop = generation_kwargs.pop("early_stop", True)
+        if early_stop is True:
+            # ~23 mel codes per second, the budget is far beyond the normal speaking rate
+            early_stop = {"max_tokens_per_text_token": 15, "min_length_budget": 30}
         sampling_rate = 24000
         # lang = "EN"
         # lang = "ZH"
@@ -604,6 +607,7 @@ class IndexTTS:
                                                       num_beams=num_beams,
                                                       repetition_penalty=repetition_penalty,
                                                       max_generate_length=max_mel_tokens,
+                                                      early_stop=early_stop,
                                                       **generation_kwargs)
                 gpt_gen_time += time.perf_counter() - m_start_time
                 if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
@@ -2,13 +2,16 @@ import os
 from subprocess import CalledProcessError
 
 os.environ['HF_HUB_CACHE'] = './checkpoints/hf_cache'
+import functools
+import gc
+import itertools
 import json
 import re
+import threading
 import time
-import librosa
+from collections import OrderedDict
 import torch
 import torchaudio
-from torch.nn.utils.rnn import pad_sequence
 
 import warnings
 
@@ -18,12 +21,33 @@ warnings.filterwarnings("ignore", category=UserWarning)
 from omegaconf import OmegaConf
 
 from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.gpt.static_kv import round_up
+from indextts.utils.audio_prep import PromptAudio, PromptAudioLoader, load_audio_head
 from indextts.utils.maskgct_utils import build_semantic_model, build_semantic_codec
 from indextts.utils.checkpoint import load_checkpoint
+from indextts.utils.compilation import (
+    DEFAULT_LENGTH_BUCKETS, SILENCE_LOG_MEL, CompileStats, bucket_length, setup_compile_cache,
+)
+from indextts.utils.feature_extractors import SeamlessM4TFbankFeatures
+from indextts.utils.document_frontend import DocumentFrontend
 from indextts.utils.front import TextNormalizer, TextTokenizer
+from indextts.utils.bundle import ModelBundle, load_causal_lm
+from indextts.utils.mel_codes import postprocess_mel_codes
+from indextts.utils.mel_budget import MelBudgetEstimator
+from indextts.utils.model_loader import (
+    ParallelLoader, init_empty_weights, load_state_dict_mmap, materialize_meta_parameters, module_construction,
+    module_nbytes,
+)
+from indextts.utils.prompt_compaction import PromptCompactor
+from indextts.utils.precision import cast_module, cpu_has_native_bf16, precision_dtype
+from indextts.utils.quantization import QUANTIZE_MODES, check_quantized_sources, load_quantized, quantize_module
+from indextts.utils.hashing import file_fingerprint
+from indextts.utils.segment_cache import SegmentAudioCache, segment_key, segment_seed
+from indextts.utils.segment_pipeline import SegmentPipeline
 
 from indextts.s2mel.modules.commons import load_checkpoint2, MyModel
 from indextts.s2mel.modules.bigvgan import bigvgan
+from indextts.s2mel.modules.bigvgan.env import AttrDict
 from indextts.s2mel.modules.campplus.DTDNN import CAMPPlus
 from indextts.s2mel.modules.audio import mel_spectrogram
 
@@ -31,14 +55,27 @@ from transformers import AutoTokenizer
 from modelscope import AutoModelForCausalLM
 from huggingface_hub import hf_hub_download
 import safetensors
-from transformers import SeamlessM4TFeatureExtractor
+from transformers import SeamlessM4TFeatureExtractor, Wav2Vec2BertConfig, Wav2Vec2BertModel
 import random
+import torch.nn as nn
 import torch.nn.functional as F
 
+# submodules quantized by `IndexTTS2(quantize=...)` and `indextts quantize`
+GPT_QUANTIZE_TARGETS = ("gpt.gpt.h", "gpt.mel_head")
+CONFORMER_QUANTIZE_TARGETS = ("gpt.conditioning_encoder", "gpt.emo_conditioning_encoder")
+DIT_QUANTIZE_TARGETS = ("s2mel.models.cfm.estimator.transformer.layers",)
+
+
 class IndexTTS2:
     def __init__(
             self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=False, device=None,
-            use_cuda_kernel=None,use_deepspeed=False
+            use_cuda_kernel=None,use_deepspeed=False, attn_backend=None, quantize=None, quantize_conformer=False,
+            precision=None, parallel_load=True, load_workers=None,
+            qwen_emo_lazy=True, qwen_emo_device=None, qwen_emo_idle_timeout=None,
+            bundle_path=None, share_weights=False,
+            use_torch_compile=False, compile_mode=None, compile_cache_dir=None,
+            prompt_compaction=False, gpt_prompt_seconds=15, s2mel_prompt_seconds=15, frontend_workers=0,
+            segment_cache_mb=0, segment_cache_dir=None,
     ):
         """
         Args:
@@ -48,6 +85,38 @@ class IndexTTS2:
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
             use_deepspeed (bool): whether to use DeepSpeed or not.
+            attn_backend (None | str): attention backend of the GPT, 'eager', 'sdpa' or 'flash'. If None, the fastest one available on the device is used.
+            quantize (None | str): weight-only quantization of the GPT2 blocks, mel_head and the DiT transformer, 'int8' or 'int4'.
+                The checkpoint written by `indextts quantize` is loaded from `model_dir` if it exists.
+            quantize_conformer (bool): also quantize the conformer conditioning encoders.
+            precision (None | str): 'fp32', 'fp16' or 'bf16', overrides `use_fp16`. 'bf16' runs the GPT (with the conditioning
+                encoders), the DiT and BigVGAN in bf16, also on CPU; the normalization layers and the final tanh stay in fp32.
+            parallel_load (bool): load the independent model components concurrently, the GPT and s2mel checkpoints are
+                memory-mapped in any case. The per-component load times are kept in `self.load_timings`.
+            load_workers (None | int): threads used by `parallel_load`, defaults to min(8, cpu_count + 2).
+            qwen_emo_lazy (bool): load the Qwen emotion model on the first `use_emo_text` request instead of at startup.
+            qwen_emo_device (None | str): device of the Qwen emotion model, e.g. 'cpu' to keep the accelerator memory
+                for the TTS models. If None, it is placed by `device_map="auto"`.
+            qwen_emo_idle_timeout (None | float): unload the Qwen emotion model after this many idle seconds.
+            bundle_path (None | str): load all the models and configs from the single-file bundle written by
+                `indextts bundle` instead of `cfg_path`, `model_dir` and the Hugging Face hub.
+            share_weights (bool): with `bundle_path` on CPU, the fp32 weights are views of a copy-on-write mapping of the
+                bundle instead of copies, processes loading the same bundle file share its memory.
+            use_torch_compile (bool): compile the DiT, BigVGAN and the GPT decode step with `torch.compile` (also with the
+                CPU inductor backend). The DiT sequences and vocoder mels are padded to length buckets and the GPT decodes
+                against a static KV cache, so that only a few shapes are compiled. The first segment of each bucket is slow.
+            compile_mode (None | str): `torch.compile` mode, e.g. 'max-autotune'.
+            compile_cache_dir (None | str): directory of the compiled artifacts reused between runs,
+                defaults to ~/.cache/indextts/inductor.
+            prompt_compaction (bool): trim the silence of the reference audios and use their windows with the most
+                speech as prompts, see `PromptCompactor`. Shorter prompts speed up the conditioning and the DiT.
+            gpt_prompt_seconds (float): length cap of the speaker and emotion prompts of the GPT conditioning.
+            s2mel_prompt_seconds (float): length cap of the reference mel prompt of s2mel.
+            frontend_workers (int): processes normalizing and tokenizing the long texts by chunks, see
+                `DocumentFrontend`. The synthesis of the first segments starts before the whole text is normalized.
+            segment_cache_mb (float): size of the in-memory cache of the synthesized segments, see `SegmentAudioCache`.
+                The segments repeated with the same voice, emotion and generation options are not synthesized again.
+            segment_cache_dir (None | str): directory of the on-disk tier of the segment cache.
         """
         if device is not None:
             self.device = device
@@ -71,34 +140,159 @@ class IndexTTS2:
             self.use_cuda_kernel = False
             print(">> Be patient, it may take a while to run in CPU mode.")
 
-        self.cfg = OmegaConf.load(cfg_path)
+        if share_weights and bundle_path is None:
+            raise ValueError("share_weights requires a model bundle, see `indextts bundle`")
+        self.bundle = ModelBundle(bundle_path, zero_copy=share_weights) if bundle_path is not None else None
+        if self.bundle is not None:
+            print(f">> 从模型包加载: {bundle_path}")
+            self.cfg = OmegaConf.create(self.bundle.asset_text("config.yaml"))
+        else:
+            self.cfg = OmegaConf.load(cfg_path)
         self.model_dir = model_dir
-        self.dtype = torch.float16 if self.use_fp16 else None
+        if precision is None:
+            precision = "fp16" if self.use_fp16 else "fp32"
+        elif precision == "fp16" and self.device in ("cpu", "mps"):
+            print(f">> fp16 is not supported on {self.device}, fallback to fp32")
+            precision = "fp32"
+        self.precision = precision
+        self.use_fp16 = precision == "fp16"
+        self.dtype = precision_dtype(precision)
+        # the s2mel/BigVGAN block keeps fp32 in fp16 mode, bf16 has the fp32 exponent range
+        self.s2mel_dtype = self.dtype if precision == "bf16" else None
+        if precision == "bf16" and self.device == "cpu" and not cpu_has_native_bf16():
+            print(">> WARNING: the CPU has no native bf16 support (AVX512-BF16/AMX), bf16 may be slower than fp32.")
         self.stop_mel_token = self.cfg.gpt.stop_mel_token
+        if quantize is not None and quantize not in QUANTIZE_MODES:
+            raise ValueError(f"Unknown quantization mode: {quantize}, expected one of {QUANTIZE_MODES}")
+        self.quantize = quantize
+        self.quantized_checkpoint = None
+        if quantize is not None:
+            quantized_path = os.path.join(self.model_dir, f"quantized_{quantize}.pth")
+            if os.path.exists(quantized_path):
+                print(f">> 加载量化权重: {quantized_path}")
+                self.quantized_checkpoint = torch.load(quantized_path, map_location="cpu")
+                try:
+                    check_quantized_sources(self.quantized_checkpoint, self._quantize_sources())
+                except ValueError as e:
+                    # 量化权重与当前模型权重不一致，丢弃并在启动时重新量化
+                    print(f">> {e}，启动时量化")
+                    self.quantized_checkpoint = None
+            else:
+                print(f">> 未找到量化权重 {quantized_path}，启动时量化（可用 `indextts quantize` 预先生成）")
+
+        print(">> 加载模型组件...")
+        loader = ParallelLoader(max_workers=load_workers if parallel_load else 1)
+        loader.submit("qwen_emo", self._load_qwen_emo, qwen_emo_lazy, qwen_emo_device, qwen_emo_idle_timeout)
+        loader.submit("gpt", self._load_gpt, use_deepspeed, attn_backend, quantize_conformer)
+        loader.submit("feature_extractor", self._load_feature_extractor)
+        loader.submit("semantic_model", self._load_semantic_model)
+        loader.submit("semantic_codec", self._load_semantic_codec)
+        loader.submit("s2mel", self._load_s2mel)
+        loader.submit("campplus", self._load_campplus)
+        loader.submit("bigvgan", self._load_bigvgan)
+        loader.submit("text_frontend", self._load_text_frontend)
+        loader.submit("emo_spk_matrix", self._load_emo_spk_matrix)
+        loader.wait()
+        self.quantized_checkpoint = None
+        self.load_timings = dict(loader.timings)
+        print(loader.report())
+        tts_bytes = module_nbytes(self.gpt, self.semantic_model, self.semantic_codec, self.s2mel, self.campplus_model,
+                                  self.bigvgan)
+        qwen_emo_state = f"{self.qwen_emo.memory_footprint() / 1024 ** 2:.0f} MB" if self.qwen_emo.is_loaded \
+            else "not loaded, loads on first use"
+        print(f">> model memory: TTS {tts_bytes / 1024 ** 2:.0f} MB on {self.device}, QwenEmotion {qwen_emo_state}")
+
+        self.document_frontend = None
+        if frontend_workers > 0:
+            self.document_frontend = DocumentFrontend(
+                vocab_file=self.bpe_path if self.bundle is None else None,
+                model_proto=self.bundle.asset("bpe.model") if self.bundle is not None else None,
+                workers=frontend_workers)
+
+        self.length_buckets = None
+        self.compile_stats = None
+        if use_torch_compile:
+            self._setup_torch_compile(compile_mode, compile_cache_dir, use_deepspeed)
+
+        mel_fn_args = {
+            "n_fft": self.cfg.s2mel['preprocess_params']['spect_params']['n_fft'],
+            "win_size": self.cfg.s2mel['preprocess_params']['spect_params']['win_length'],
+            "hop_size": self.cfg.s2mel['preprocess_params']['spect_params']['hop_length'],
+            "num_mels": self.cfg.s2mel['preprocess_params']['spect_params']['n_mels'],
+            "sampling_rate": self.cfg.s2mel["preprocess_params"]["sr"],
+            "fmin": self.cfg.s2mel['preprocess_params']['spect_params'].get('fmin', 0),
+            "fmax": None if self.cfg.s2mel['preprocess_params']['spect_params'].get('fmax', "None") == "None" else 8000,
+            "center": False
+        }
+        self.mel_fn = lambda x: mel_spectrogram(x, **mel_fn_args)
+
+        # per-segment mel code budget, ~50 codes per second (1.72 mel frames per code)
+        code_rate = mel_fn_args["sampling_rate"] / mel_fn_args["hop_size"] / 1.72
+        self.mel_budget = MelBudgetEstimator(code_rate, max_mel_tokens=self.cfg.gpt.max_mel_tokens)
+
+        # 缓存参考音频：
+        self._prompt_lock = threading.RLock()
+        self.prompt_compactor = PromptCompactor(gpt_prompt_seconds, s2mel_prompt_seconds, enabled=prompt_compaction)
+        # 参考音频只读取需要的开头部分, 同一文件的说话人/情感参考共享解码结果
+        self.prompt_audio_loader = PromptAudioLoader(max_seconds=self.prompt_compactor.decode_seconds)
+        self.cache_prompt_windows = None
+        self.cache_spk_cond = None
+        self.cache_s2mel_style = None
+        self.cache_s2mel_prompt = None
+        self.cache_spk_audio_prompt = None
+        self.cache_emo_cond = None
+        self.cache_emo_audio_prompt = None
+        self.cache_mel = None
+
+        # 分段音频缓存: 相同音色/情感/生成参数下重复的句子直接复用
+        self.segment_cache = None
+        if segment_cache_mb > 0 or segment_cache_dir is not None:
+            self.segment_cache = SegmentAudioCache(int(segment_cache_mb * 1024 ** 2), segment_cache_dir)
+        # 模型权重的哈希, 首次计算分段的键时计算, 见 `model_fingerprint`
+        self._model_fingerprint = None
+
+        # 进度引用显示（可选）
+        self.gr_progress = None
+        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
 
+    def _load_qwen_emo(self, lazy, device, idle_timeout):
         print(">> 初始化Qwen情感模型...")
         try:
             qwen_emo_path = os.path.join(self.model_dir, self.cfg.qwen_emo_path)
             print(f">> Qwen模型路径: {qwen_emo_path}")
-            self.qwen_emo = QwenEmotion(qwen_emo_path)
-            print(">> ✓ Qwen情感模型初始化成功")
+            bundle = self.bundle if self.bundle is not None and self.bundle.has_component("qwen_emo") else None
+            self.qwen_emo = QwenEmotion(qwen_emo_path, device=device, lazy=lazy, idle_timeout=idle_timeout,
+                                        bundle=bundle)
+            if lazy:
+                print(">> ✓ Qwen情感模型将在首次使用时加载")
+            else:
+                print(">> ✓ Qwen情感模型初始化成功")
         except Exception as e:
             print(f">> ✗ Qwen情感模型初始化失败: {e}")
             import traceback
             print(f">> Qwen错误详情: {traceback.format_exc()}")
             raise
 
+    def _load_gpt(self, use_deepspeed, attn_backend, quantize_conformer):
         print(">> 初始化GPT模型...")
         try:
             print(">> 创建UnifiedVoice实例...")
-            self.gpt = UnifiedVoice(**self.cfg.gpt)
+            # the parameters are created on the meta device and assigned from the memory-mapped checkpoint
+            with init_empty_weights():
+                self.gpt = UnifiedVoice(**self.cfg.gpt)
             print(">> ✓ UnifiedVoice实例创建成功")
             
-            self.gpt_path = os.path.join(self.model_dir, self.cfg.gpt_checkpoint)
+            if self.bundle is not None:
+                self.gpt_path = self.bundle.path
+            else:
+                self.gpt_path = os.path.join(self.model_dir, self.cfg.gpt_checkpoint)
             print(f">> GPT模型权重路径: {self.gpt_path}")
             
             print(">> 加载GPT模型权重...")
-            load_checkpoint(self.gpt, self.gpt_path)
+            if self.bundle is not None:
+                self.gpt.load_state_dict(self.bundle.state_dict("gpt"), strict=True, assign=True)
+            else:
+                load_checkpoint(self.gpt, self.gpt_path, mmap=True, assign=True)
             print(">> ✓ GPT模型权重加载成功")
             
             print(f">> 将GPT模型移动到设备: {self.device}")
@@ -109,6 +303,10 @@ class IndexTTS2:
                 print(">> 设置GPT模型为FP16模式...")
                 self.gpt.eval().half()
                 print(">> ✓ GPT模型FP16设置成功")
+            elif self.precision == "bf16":
+                print(">> 设置GPT模型为BF16模式...")
+                cast_module(self.gpt.eval(), torch.bfloat16)
+                print(">> ✓ GPT模型BF16设置成功")
             else:
                 print(">> 设置GPT模型为FP32模式...")
                 self.gpt.eval()
@@ -121,6 +319,12 @@ class IndexTTS2:
             print(f">> GPT错误详情: {traceback.format_exc()}")
             raise
 
+        if use_deepspeed and self.quantize is not None:
+            use_deepspeed = False
+            print(">> DeepSpeed kernel injection does not support quantized weights, disabled.")
+        if use_deepspeed and self.precision == "bf16":
+            use_deepspeed = False
+            print(">> DeepSpeed inference is only set up for fp16/fp32, disabled in bf16 mode.")
         if use_deepspeed:
             try:
                 import deepspeed
@@ -128,24 +332,21 @@ class IndexTTS2:
                 use_deepspeed = False
                 print(f">> Failed to load DeepSpeed. Falling back to normal inference. Error: {e}")
 
-        self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=self.use_fp16)
-
-        if self.use_cuda_kernel:
-            # preload the CUDA kernel for BigVGAN
-            print(">> 尝试预加载BigVGAN的CUDA内核...")
-            try:
-                from indextts.s2mel.modules.bigvgan.alias_free_activation.cuda import activation1d
-                print(">> ✓ BigVGAN CUDA内核预加载成功", activation1d.anti_alias_activation_cuda)
-            except Exception as e:
-                print(">> ✗ BigVGAN CUDA内核加载失败，回退到PyTorch模式")
-                print(f">> CUDA内核错误详情: {e!r}")
-                print(">> 这通常是由于GCC版本过低或CUDA环境配置问题引起的")
-                print(">> 将使用PyTorch原生实现，性能可能稍有下降但功能正常")
-                self.use_cuda_kernel = False
+        if self.quantize is not None:
+            self._quantize(GPT_QUANTIZE_TARGETS + (CONFORMER_QUANTIZE_TARGETS if quantize_conformer else ()))
+        self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=self.use_fp16,
+                                      attn_backend=attn_backend)
 
+    def _load_feature_extractor(self):
         print(">> 初始化SeamlessM4T特征提取器...")
         try:
-            self.extract_features = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
+            if self.bundle is not None:
+                self.extract_features = SeamlessM4TFeatureExtractor.from_dict(
+                    json.loads(self.bundle.asset_text("w2v-bert-2.0/preprocessor_config.json")))
+            else:
+                self.extract_features = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
+            # 同样的特征在 torch 中计算, 直接在模型设备上批量提取
+            self.fbank_features = SeamlessM4TFbankFeatures.from_hf(self.extract_features).to(self.device)
             print(">> ✓ SeamlessM4T特征提取器初始化成功")
         except Exception as e:
             print(f">> ✗ SeamlessM4T特征提取器初始化失败: {e}")
@@ -153,11 +354,23 @@ class IndexTTS2:
             print(f">> SeamlessM4T错误详情: {traceback.format_exc()}")
             raise
 
+    def _load_semantic_model(self):
         print(">> 初始化语义模型...")
         try:
-            w2v_stat_path = os.path.join(self.model_dir, self.cfg.w2v_stat)
-            print(f">> W2V统计文件路径: {w2v_stat_path}")
-            self.semantic_model, self.semantic_mean, self.semantic_std = build_semantic_model(w2v_stat_path)
+            if self.bundle is not None:
+                config = Wav2Vec2BertConfig.from_dict(json.loads(self.bundle.asset_text("w2v-bert-2.0/config.json")))
+                with init_empty_weights():
+                    self.semantic_model = Wav2Vec2BertModel(config)
+                self.semantic_model.load_state_dict(self.bundle.state_dict("semantic_model"), assign=True)
+                self.semantic_model.eval()
+                stat_mean_var = self.bundle.state_dict("w2v_stat")
+                self.semantic_mean = stat_mean_var["mean"]
+                self.semantic_std = torch.sqrt(stat_mean_var["var"])
+            else:
+                w2v_stat_path = os.path.join(self.model_dir, self.cfg.w2v_stat)
+                print(f">> W2V统计文件路径: {w2v_stat_path}")
+                with module_construction():
+                    self.semantic_model, self.semantic_mean, self.semantic_std = build_semantic_model(w2v_stat_path)
             
             print(f">> 将语义模型移动到设备: {self.device}")
             self.semantic_model = self.semantic_model.to(self.device)
@@ -171,14 +384,19 @@ class IndexTTS2:
             print(f">> 语义模型错误详情: {traceback.format_exc()}")
             raise
 
+    def _load_semantic_codec(self):
         print(">> 初始化语义编码器...")
         try:
-            semantic_codec = build_semantic_codec(self.cfg.semantic_codec)
-            print(">> 下载语义编码器权重...")
-            semantic_code_ckpt = hf_hub_download("amphion/MaskGCT", filename="semantic_codec/model.safetensors")
-            print(f">> 语义编码器权重路径: {semantic_code_ckpt}")
-            
-            safetensors.torch.load_model(semantic_codec, semantic_code_ckpt)
+            with module_construction():
+                semantic_codec = build_semantic_codec(self.cfg.semantic_codec)
+            if self.bundle is not None:
+                semantic_code_ckpt = self.bundle.path
+                semantic_codec.load_state_dict(self.bundle.state_dict("semantic_codec"), assign=True)
+            else:
+                print(">> 下载语义编码器权重...")
+                semantic_code_ckpt = hf_hub_download("amphion/MaskGCT", filename="semantic_codec/model.safetensors")
+                print(f">> 语义编码器权重路径: {semantic_code_ckpt}")
+                safetensors.torch.load_model(semantic_codec, semantic_code_ckpt)
             self.semantic_codec = semantic_codec.to(self.device)
             self.semantic_codec.eval()
             print('>> ✓ 语义编码器加载成功: {}'.format(semantic_code_ckpt))
@@ -188,24 +406,41 @@ class IndexTTS2:
             print(f">> 语义编码器错误详情: {traceback.format_exc()}")
             raise
 
+    def _load_s2mel(self):
         print(">> 初始化S2Mel模型...")
         try:
-            s2mel_path = os.path.join(self.model_dir, self.cfg.s2mel_checkpoint)
+            s2mel_path = self.bundle.path if self.bundle is not None else os.path.join(self.model_dir, self.cfg.s2mel_checkpoint)
+            self.s2mel_path = s2mel_path
             print(f">> S2Mel模型权重路径: {s2mel_path}")
             
             print(">> 创建S2Mel模型实例...")
-            s2mel = MyModel(self.cfg.s2mel, use_gpt_latent=True)
+            with init_empty_weights():
+                s2mel = MyModel(self.cfg.s2mel, use_gpt_latent=True)
             print(">> ✓ S2Mel模型实例创建成功")
             
             print(">> 加载S2Mel模型权重...")
-            s2mel, _, _, _ = load_checkpoint2(
-                s2mel,
-                None,
-                s2mel_path,
-                load_only_params=True,
-                ignore_modules=[],
-                is_distributed=False,
-            )
+            if self.bundle is not None:
+                # bundled with the module prefixes stripped and the keys filtered as `load_checkpoint2` does
+                params = self.bundle.state_dict("s2mel")
+                for key, module in s2mel.models.items():
+                    prefix = key + "."
+                    module.load_state_dict({k[len(prefix):]: v for k, v in params.items() if k.startswith(prefix)},
+                                           strict=False, assign=True)
+                s2mel.eval()
+            else:
+                s2mel, _, _, _ = load_checkpoint2(
+                    s2mel,
+                    None,
+                    s2mel_path,
+                    load_only_params=True,
+                    ignore_modules=[],
+                    is_distributed=False,
+                    mmap=True,
+                    assign=True,
+                )
+            missing = materialize_meta_parameters(s2mel, "cpu")
+            if missing:
+                print(f">> S2Mel权重中缺少以下参数，已重新初始化: {missing}")
             print(">> ✓ S2Mel模型权重加载成功")
             
             print(f">> 将S2Mel模型移动到设备: {self.device}")
@@ -217,6 +452,12 @@ class IndexTTS2:
             print(">> ✓ S2Mel模型缓存设置成功")
             
             self.s2mel.eval()
+            if self.precision == "bf16":
+                # only the DiT: the length regulator also runs outside of autocast for the prompt
+                cast_module(self.s2mel.models['cfm'], torch.bfloat16)
+                print(">> ✓ S2Mel DiT设置为BF16模式")
+            if self.quantize is not None:
+                self._quantize(DIT_QUANTIZE_TARGETS)
             print(">> ✓ S2Mel模型完全加载成功:", s2mel_path)
         except Exception as e:
             print(f">> ✗ S2Mel模型加载失败: {e}")
@@ -224,15 +465,21 @@ class IndexTTS2:
             print(f">> S2Mel错误详情: {traceback.format_exc()}")
             raise
 
+    def _load_campplus(self):
         # load campplus_model
         print(">> 开始加载CAMPPlus模型...")
         try:
-            campplus_ckpt_path = hf_hub_download(
-                "funasr/campplus", filename="campplus_cn_common.bin"
-            )
-            print(f">> CAMPPlus模型文件下载路径: {campplus_ckpt_path}")
-            campplus_model = CAMPPlus(feat_dim=80, embedding_size=192)
-            campplus_model.load_state_dict(torch.load(campplus_ckpt_path, map_location="cpu"))
+            with module_construction():
+                campplus_model = CAMPPlus(feat_dim=80, embedding_size=192)
+            if self.bundle is not None:
+                campplus_ckpt_path = self.bundle.path
+                campplus_model.load_state_dict(self.bundle.state_dict("campplus"), assign=True)
+            else:
+                campplus_ckpt_path = hf_hub_download(
+                    "funasr/campplus", filename="campplus_cn_common.bin"
+                )
+                print(f">> CAMPPlus模型文件下载路径: {campplus_ckpt_path}")
+                campplus_model.load_state_dict(load_state_dict_mmap(campplus_ckpt_path))
             self.campplus_model = campplus_model.to(self.device)
             self.campplus_model.eval()
             print(">> ✓ CAMPPlus模型加载成功:", campplus_ckpt_path)
@@ -242,6 +489,20 @@ class IndexTTS2:
             print(f">> CAMPPlus错误详情: {traceback.format_exc()}")
             raise
 
+    def _load_bigvgan(self):
+        if self.use_cuda_kernel:
+            # preload the CUDA kernel for BigVGAN
+            print(">> 尝试预加载BigVGAN的CUDA内核...")
+            try:
+                from indextts.s2mel.modules.bigvgan.alias_free_activation.cuda import activation1d
+                print(">> ✓ BigVGAN CUDA内核预加载成功", activation1d.anti_alias_activation_cuda)
+            except Exception as e:
+                print(">> ✗ BigVGAN CUDA内核加载失败，回退到PyTorch模式")
+                print(f">> CUDA内核错误详情: {e!r}")
+                print(">> 这通常是由于GCC版本过低或CUDA环境配置问题引起的")
+                print(">> 将使用PyTorch原生实现，性能可能稍有下降但功能正常")
+                self.use_cuda_kernel = False
+
         # load bigvgan_model
         print(">> 开始加载BigVGAN模型...")
         try:
@@ -249,9 +510,23 @@ class IndexTTS2:
             print(f">> BigVGAN模型名称: {bigvgan_name}")
             print(f">> 使用CUDA内核: {self.use_cuda_kernel}")
             
-            # 检查BigVGAN from_pretrained方法
-            print(">> 调用BigVGAN.from_pretrained...")
-            self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel)
+            if self.bundle is not None:
+                h = AttrDict(json.loads(self.bundle.asset_text("bigvgan/config.json")))
+                with module_construction():
+                    self.bigvgan = bigvgan.BigVGAN(h, use_cuda_kernel=self.use_cuda_kernel)
+                state_dict = self.bundle.state_dict("bigvgan")
+                try:
+                    self.bigvgan.load_state_dict(state_dict, assign=True)
+                except RuntimeError:
+                    # the checkpoint does not contain weight norm
+                    self.bigvgan.remove_weight_norm()
+                    self.bigvgan.load_state_dict(state_dict, assign=True)
+            else:
+                # 检查BigVGAN from_pretrained方法
+                print(">> 调用BigVGAN.from_pretrained...")
+                with module_construction():
+                    self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel)
+                self.bigvgan_path = bigvgan.bigvgan_weights_path(bigvgan_name) or bigvgan_name
             print(">> ✓ BigVGAN模型实例创建成功")
             
             print(f">> 将BigVGAN模型移动到设备: {self.device}")
@@ -264,6 +539,9 @@ class IndexTTS2:
             
             print(">> 设置BigVGAN为评估模式...")
             self.bigvgan.eval()
+            if self.precision == "bf16":
+                cast_module(self.bigvgan, torch.bfloat16)
+                print(">> ✓ BigVGAN设置为BF16模式")
             print(">> ✓ BigVGAN模型加载完全成功:", bigvgan_name)
             
         except Exception as e:
@@ -273,48 +551,33 @@ class IndexTTS2:
             print(f">> BigVGAN错误详情: {traceback.format_exc()}")
             raise
 
-        self.bpe_path = os.path.join(self.model_dir, self.cfg.dataset["bpe_model"])
+    def _load_text_frontend(self):
         self.normalizer = TextNormalizer()
         self.normalizer.load()
         print(">> TextNormalizer loaded")
-        self.tokenizer = TextTokenizer(self.bpe_path, self.normalizer)
+        if self.bundle is not None:
+            self.bpe_path = self.bundle.path
+            self.tokenizer = TextTokenizer(None, self.normalizer, model_proto=self.bundle.asset("bpe.model"))
+        else:
+            self.bpe_path = os.path.join(self.model_dir, self.cfg.dataset["bpe_model"])
+            self.tokenizer = TextTokenizer(self.bpe_path, self.normalizer)
         print(">> bpe model loaded from:", self.bpe_path)
 
-        emo_matrix = torch.load(os.path.join(self.model_dir, self.cfg.emo_matrix))
+    def _load_emo_spk_matrix(self):
+        if self.bundle is not None:
+            matrices = self.bundle.state_dict("matrices")
+            emo_matrix, spk_matrix = matrices["emo_matrix"], matrices["spk_matrix"]
+        else:
+            emo_matrix = torch.load(os.path.join(self.model_dir, self.cfg.emo_matrix))
+            spk_matrix = torch.load(os.path.join(self.model_dir, self.cfg.spk_matrix))
         self.emo_matrix = emo_matrix.to(self.device)
         self.emo_num = list(self.cfg.emo_num)
 
-        spk_matrix = torch.load(os.path.join(self.model_dir, self.cfg.spk_matrix))
         self.spk_matrix = spk_matrix.to(self.device)
 
         self.emo_matrix = torch.split(self.emo_matrix, self.emo_num)
         self.spk_matrix = torch.split(self.spk_matrix, self.emo_num)
 
-        mel_fn_args = {
-            "n_fft": self.cfg.s2mel['preprocess_params']['spect_params']['n_fft'],
-            "win_size": self.cfg.s2mel['preprocess_params']['spect_params']['win_length'],
-            "hop_size": self.cfg.s2mel['preprocess_params']['spect_params']['hop_length'],
-            "num_mels": self.cfg.s2mel['preprocess_params']['spect_params']['n_mels'],
-            "sampling_rate": self.cfg.s2mel["preprocess_params"]["sr"],
-            "fmin": self.cfg.s2mel['preprocess_params']['spect_params'].get('fmin', 0),
-            "fmax": None if self.cfg.s2mel['preprocess_params']['spect_params'].get('fmax', "None") == "None" else 8000,
-            "center": False
-        }
-        self.mel_fn = lambda x: mel_spectrogram(x, **mel_fn_args)
-
-        # 缓存参考音频：
-        self.cache_spk_cond = None
-        self.cache_s2mel_style = None
-        self.cache_s2mel_prompt = None
-        self.cache_spk_audio_prompt = None
-        self.cache_emo_cond = None
-        self.cache_emo_audio_prompt = None
-        self.cache_mel = None
-
-        # 进度引用显示（可选）
-        self.gr_progress = None
-        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
-
     @torch.no_grad()
     def get_emb(self, input_features, attention_mask):
         vq_emb = self.semantic_model(
@@ -326,62 +589,35 @@ class IndexTTS2:
         feat = (feat - self.semantic_mean) / self.semantic_std
         return feat
 
+    def _quantize_sources(self):
+        """
+        The hashes of the checkpoints quantized by `indextts quantize`, see `check_quantized_sources`. With a bundle,
+        those of `model_dir` it was made from, if they are there.
+        """
+        paths = {name: os.path.join(self.model_dir, name) for name in (self.cfg.gpt_checkpoint, self.cfg.s2mel_checkpoint)}
+        return {name: file_fingerprint(path) for name, path in paths.items()
+                if self.bundle is None or os.path.exists(path)}
+
+    def _quantize(self, targets):
+        """
+        Apply the weight-only quantization to `targets`, loaded from the pre-quantized checkpoint when possible.
+        """
+        root = nn.ModuleDict({name: getattr(self, name) for name in {path.split(".")[0] for path in targets}})
+        counts = {}
+        if self.quantized_checkpoint is not None:
+            counts = load_quantized(root, self.quantized_checkpoint, self.quantize, paths=targets)
+        for path in targets:
+            if path not in counts:
+                counts[path] = quantize_module(root, path, self.quantize)
+            print(f">> {path}: {counts[path]} linear layers quantized to {self.quantize}")
+
     def remove_long_silence(self, codes: torch.Tensor, silent_token=52, max_consecutive=30):
         """
         Shrink special tokens (silent_token and stop_mel_token) in codes
         codes: [B, T]
         """
-        code_lens = []
-        codes_list = []
-        device = codes.device
-        dtype = codes.dtype
-        isfix = False
-        for i in range(0, codes.shape[0]):
-            code = codes[i]
-            if not torch.any(code == self.stop_mel_token).item():
-                len_ = code.size(0)
-            else:
-                stop_mel_idx = (code == self.stop_mel_token).nonzero(as_tuple=False)
-                len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
-
-            count = torch.sum(code == silent_token).item()
-            if count > max_consecutive:
-                # code = code.cpu().tolist()
-                ncode_idx = []
-                n = 0
-                for k in range(len_):
-                    assert code[
-                               k] != self.stop_mel_token, f"stop_mel_token {self.stop_mel_token} should be shrinked here"
-                    if code[k] != silent_token:
-                        ncode_idx.append(k)
-                        n = 0
-                    elif code[k] == silent_token and n < 10:
-                        ncode_idx.append(k)
-                        n += 1
-                    # if (k == 0 and code[k] == 52) or (code[k] == 52 and code[k-1] == 52):
-                    #    n += 1
-                # new code
-                len_ = len(ncode_idx)
-                codes_list.append(code[ncode_idx])
-                isfix = True
-            else:
-                # shrink to len_
-                codes_list.append(code[:len_])
-            code_lens.append(len_)
-        if isfix:
-            if len(codes_list) > 1:
-                codes = pad_sequence(codes_list, batch_first=True, padding_value=self.stop_mel_token)
-            else:
-                codes = codes_list[0].unsqueeze(0)
-        else:
-            # unchanged
-            pass
-        # clip codes to max length
-        max_len = max(code_lens)
-        if max_len < codes.shape[1]:
-            codes = codes[:, :max_len]
-        code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
-        return codes, code_lens
+        return postprocess_mel_codes(codes, self.stop_mel_token, silent_token=silent_token,
+                                     max_consecutive=max_consecutive)
 
     def insert_interval_silence(self, wavs, sampling_rate=22050, interval_silence=200):
         """
@@ -406,23 +642,42 @@ class IndexTTS2:
 
         return wavs_list
 
+    def _setup_torch_compile(self, compile_mode, compile_cache_dir, use_deepspeed):
+        cache_dir = setup_compile_cache(compile_cache_dir)
+        compile_kwargs = {"dynamic": False, "mode": compile_mode}
+        self.length_buckets = DEFAULT_LENGTH_BUCKETS
+        self.compile_stats = CompileStats()
+        cfm = self.s2mel.models['cfm']
+        cfm.length_buckets = self.length_buckets
+        cfm.estimator.compile(**compile_kwargs)
+        self.bigvgan.compile(**compile_kwargs)
+        if use_deepspeed and torch.cuda.is_available():
+            print(">> torch.compile: the GPT decode step is not compiled with DeepSpeed")
+        else:
+            self.gpt.inference_model.enable_static_kv(compile=True, **compile_kwargs)
+        print(f">> torch.compile enabled (mode={compile_mode or 'default'}), {len(self.length_buckets)} length buckets, "
+              f"cache: {cache_dir}")
+
     def _set_gr_progress(self, value, desc):
         if self.gr_progress is not None:
             self.gr_progress(value, desc=desc)
 
-    def _load_and_cut_audio(self,audio_path,max_audio_length_seconds,verbose=False,sr=None):
-        if not sr:
-            audio, sr = librosa.load(audio_path)
+    def _set_segment_progress(self, seg_idx, segments_count=None):
+        if segments_count is None:
+            # 分段仍在生成中, 总数未知
+            self._set_gr_progress(0.2, f"speech synthesis {seg_idx + 1}...")
         else:
-            audio, _ = librosa.load(audio_path,sr=sr)
-        audio = torch.tensor(audio).unsqueeze(0)
-        max_audio_samples = int(max_audio_length_seconds * sr)
+            self._set_gr_progress(0.2 + 0.7 * seg_idx / segments_count,
+                                  f"speech synthesis {seg_idx + 1}/{segments_count}...")
 
-        if audio.shape[1] > max_audio_samples:
-            if verbose:
-                print(f"Audio too long ({audio.shape[1]} samples), truncating to {max_audio_samples} samples")
-            audio = audio[:, :max_audio_samples]
-        return audio, sr
+    def _load_and_cut_audio(self,audio_path,max_audio_length_seconds,verbose=False,sr=None):
+        prompt_audio = self.prompt_audio_loader.load(audio_path, verbose)
+        if max_audio_length_seconds != self.prompt_audio_loader.max_seconds:
+            audio, orig_sr = load_audio_head(audio_path, max_audio_length_seconds)
+            prompt_audio = PromptAudio(audio, orig_sr, max_audio_length_seconds)
+        # 未指定采样率时与之前的 librosa.load 一致, 重采样到 22050
+        sr = sr or 22050
+        return prompt_audio.at(sr), sr
     
     def normalize_emo_vec(self, emo_vector, apply_bias=True):
         # apply biased emotion factors for better user experience,
@@ -440,21 +695,14 @@ class IndexTTS2:
 
         return emo_vector
 
-    # 原始推理模式
-    def infer(self, spk_audio_prompt, text, output_path,
-              emo_audio_prompt=None, emo_alpha=1.0,
-              emo_vector=None,
-              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
-              verbose=False, max_text_tokens_per_segment=120, **generation_kwargs):
-        print(">> starting inference...")
-        self._set_gr_progress(0, "starting inference...")
-        if verbose:
-            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
-                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
-                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
-                  f"emo_text:{emo_text}")
-        start_time = time.perf_counter()
+    def prepare_emotion(self, text, spk_audio_prompt, emo_audio_prompt=None, emo_alpha=1.0, emo_vector=None,
+                        use_emo_text=False, emo_text=None):
+        """
+        Resolve the emotion guidance of a request.
 
+        Returns:
+            (emo_audio_prompt, emo_alpha, emo_vector) to pass to `encode_prompts`.
+        """
         if use_emo_text or emo_vector is not None:
             # we're using a text or emotion vector guidance; so we must remove
             # "emotion reference voice", to ensure we use correct emotion mixing!
@@ -485,52 +733,87 @@ class IndexTTS2:
             emo_audio_prompt = spk_audio_prompt
             # must always use alpha=1.0 when we don't have an external reference voice
             emo_alpha = 1.0
+        return emo_audio_prompt, emo_alpha, emo_vector
 
-        # 如果参考音频改变了，才需要重新生成, 提升速度
-        if self.cache_spk_cond is None or self.cache_spk_audio_prompt != spk_audio_prompt:
-            if self.cache_spk_cond is not None:
-                self.cache_spk_cond = None
-                self.cache_s2mel_style = None
-                self.cache_s2mel_prompt = None
-                self.cache_mel = None
-                torch.cuda.empty_cache()
-            audio,sr = self._load_and_cut_audio(spk_audio_prompt,15,verbose)
-            audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
-            audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
-
-            inputs = self.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
-            input_features = inputs["input_features"]
-            attention_mask = inputs["attention_mask"]
-            input_features = input_features.to(self.device)
-            attention_mask = attention_mask.to(self.device)
-            spk_cond_emb = self.get_emb(input_features, attention_mask)
-
-            _, S_ref = self.semantic_codec.quantize(spk_cond_emb)
-            ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
-            ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
-            feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
-                                                     num_mel_bins=80,
-                                                     dither=0,
-                                                     sample_frequency=16000)
-            feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
-            style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
-
-            prompt_condition = self.s2mel.models['length_regulator'](S_ref,
-                                                                     ylens=ref_target_lengths,
-                                                                     n_quantizers=3,
-                                                                     f0=None)[0]
-
-            self.cache_spk_cond = spk_cond_emb
-            self.cache_s2mel_style = style
-            self.cache_s2mel_prompt = prompt_condition
-            self.cache_spk_audio_prompt = spk_audio_prompt
-            self.cache_mel = ref_mel
-        else:
-            style = self.cache_s2mel_style
-            prompt_condition = self.cache_s2mel_prompt
-            spk_cond_emb = self.cache_spk_cond
-            ref_mel = self.cache_mel
+    def encode_prompts(self, spk_audio_prompt, emo_audio_prompt, emo_alpha=1.0, emo_vector=None, use_random=False,
+                       verbose=False):
+        """
+        Speaker and emotion conditions of a request, the conditions of the last prompts are cached.
+
+        Returns:
+            the conditions dict used by `generate_segment` and `synthesize_mel`.
+        """
+        with self._prompt_lock:
+            # 如果参考音频改变了，才需要重新生成, 提升速度
+            if self.cache_spk_cond is None or self.cache_spk_audio_prompt != spk_audio_prompt:
+                if self.cache_spk_cond is not None:
+                    self.cache_spk_cond = None
+                    self.cache_s2mel_style = None
+                    self.cache_s2mel_prompt = None
+                    self.cache_mel = None
+                    torch.cuda.empty_cache()
+                # 只解码一次, 直接从原始采样率重采样到 22050 和 16000
+                prompt_audio = self.prompt_audio_loader.load(spk_audio_prompt, verbose)
+                prompt_windows = self.prompt_compactor.compact(prompt_audio.audio, prompt_audio.sr)
+                if self.prompt_compactor.enabled or verbose:
+                    print(self.prompt_compactor.report(prompt_windows))
+                audio_16k = self.prompt_compactor.cut(prompt_audio.at(16000), 16000, prompt_windows["gpt"])
+                s2mel_audio_16k = self.prompt_compactor.cut(prompt_audio.at(16000), 16000, prompt_windows["s2mel"])
+                audio_22k = self.prompt_compactor.cut(prompt_audio.at(22050), 22050, prompt_windows["s2mel"])
+
+                input_features, attention_mask = self.fbank_features(audio_16k)
+                spk_cond_emb = self.get_emb(input_features, attention_mask)
+                if prompt_windows["s2mel"] == prompt_windows["gpt"]:
+                    s2mel_cond_emb = spk_cond_emb
+                else:
+                    # s2mel 的语义 token 需要与参考 mel 对齐
+                    s2mel_cond_emb = self.get_emb(*self.fbank_features(s2mel_audio_16k))
+
+                _, S_ref = self.semantic_codec.quantize(s2mel_cond_emb)
+                ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
+                ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
+                feat = torchaudio.compliance.kaldi.fbank(s2mel_audio_16k.to(ref_mel.device),
+                                                         num_mel_bins=80,
+                                                         dither=0,
+                                                         sample_frequency=16000)
+                feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
+                style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
+
+                prompt_condition = self.s2mel.models['length_regulator'](S_ref,
+                                                                         ylens=ref_target_lengths,
+                                                                         n_quantizers=3,
+                                                                         f0=None)[0]
+
+                self.cache_spk_cond = spk_cond_emb
+                self.cache_s2mel_style = style
+                self.cache_s2mel_prompt = prompt_condition
+                self.cache_spk_audio_prompt = spk_audio_prompt
+                self.cache_mel = ref_mel
+                self.cache_prompt_windows = prompt_windows
+            else:
+                style = self.cache_s2mel_style
+                prompt_condition = self.cache_s2mel_prompt
+                spk_cond_emb = self.cache_spk_cond
+                ref_mel = self.cache_mel
+
+            if self.cache_emo_cond is None or self.cache_emo_audio_prompt != emo_audio_prompt:
+                if self.cache_emo_cond is not None:
+                    self.cache_emo_cond = None
+                    torch.cuda.empty_cache()
+                # 与说话人参考音频是同一文件时复用已解码的音频
+                emo_prompt_audio = self.prompt_audio_loader.load(emo_audio_prompt, verbose)
+                emo_windows = self.prompt_compactor.compact(emo_prompt_audio.audio, emo_prompt_audio.sr)
+                emo_audio = self.prompt_compactor.cut(emo_prompt_audio.at(16000), 16000, emo_windows["gpt"])
+                emo_input_features, emo_attention_mask = self.fbank_features(emo_audio)
+                emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
+
+                self.cache_emo_cond = emo_cond_emb
+                self.cache_emo_audio_prompt = emo_audio_prompt
+            else:
+                emo_cond_emb = self.cache_emo_cond
 
+        weight_vector = None
+        emovec_mat = None
         if emo_vector is not None:
             weight_vector = torch.tensor(emo_vector).to(self.device)
             if use_random:
@@ -544,194 +827,342 @@ class IndexTTS2:
             emovec_mat = torch.sum(emovec_mat, 0)
             emovec_mat = emovec_mat.unsqueeze(0)
 
-        if self.cache_emo_cond is None or self.cache_emo_audio_prompt != emo_audio_prompt:
-            if self.cache_emo_cond is not None:
-                self.cache_emo_cond = None
-                torch.cuda.empty_cache()
-            emo_audio, _ = self._load_and_cut_audio(emo_audio_prompt,15,verbose,sr=16000)
-            emo_inputs = self.extract_features(emo_audio, sampling_rate=16000, return_tensors="pt")
-            emo_input_features = emo_inputs["input_features"]
-            emo_attention_mask = emo_inputs["attention_mask"]
-            emo_input_features = emo_input_features.to(self.device)
-            emo_attention_mask = emo_attention_mask.to(self.device)
-            emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
-
-            self.cache_emo_cond = emo_cond_emb
-            self.cache_emo_audio_prompt = emo_audio_prompt
-        else:
-            emo_cond_emb = self.cache_emo_cond
+        fingerprint = None
+        if not (use_random and emo_vector is not None):
+            # 随机选取的情感矩阵无法复现, 不参与分段缓存
+            fingerprint = {
+                "voice": file_fingerprint(spk_audio_prompt),
+                "emotion": file_fingerprint(emo_audio_prompt),
+                "emo_alpha": emo_alpha,
+                "emo_vector": emo_vector,
+                "prompts": [self.prompt_compactor.enabled, self.prompt_compactor.gpt_max_seconds,
+                            self.prompt_compactor.s2mel_max_seconds],
+            }
 
-        self._set_gr_progress(0.1, "text processing...")
+        return {
+            "spk_cond_emb": spk_cond_emb,
+            "emo_cond_emb": emo_cond_emb,
+            "style": style,
+            "prompt_condition": prompt_condition,
+            "ref_mel": ref_mel,
+            "emo_alpha": emo_alpha,
+            "weight_vector": weight_vector,
+            "emovec_mat": emovec_mat,
+            "prompt_windows": self.cache_prompt_windows,
+            "fingerprint": fingerprint,
+        }
+
+    def text_frontend(self, text, max_text_tokens_per_segment=120, verbose=False, stream=False, balanced=False):
+        """
+        Normalize and tokenize ``text``, then split it into segments of sentencepiece tokens.
+
+        Args:
+            stream: with `frontend_workers`, return an iterator of the segments of the long texts, produced while
+                the rest of the text is normalized.
+            balanced: split into segments of similar lengths, see `TextTokenizer.split_segments_balanced`.
+        """
+        split_segments = functools.partial(self.tokenizer.split_segments, balanced=balanced)
+        if stream and self.document_frontend is not None and self.document_frontend.accepts(text):
+            return self.document_frontend.segments(text, split_segments, max_text_tokens_per_segment)
         text_tokens_list = self.tokenizer.tokenize(text)
-        segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment)
-        segments_count = len(segments)
+        segments = split_segments(text_tokens_list, max_text_tokens_per_segment)
         if verbose:
             print("text_tokens_list:", text_tokens_list)
-            print("segments count:", segments_count)
+            print("segments count:", len(segments))
             print("max_text_tokens_per_segment:", max_text_tokens_per_segment)
+            print("segment lengths:", [len(segment) for segment in segments])
             print(*segments, sep="\n")
-        do_sample = generation_kwargs.pop("do_sample", True)
-        top_p = generation_kwargs.pop("top_p", 0.8)
-        top_k = generation_kwargs.pop("top_k", 30)
-        temperature = generation_kwargs.pop("temperature", 0.8)
-        autoregressive_batch_size = 1
-        length_penalty = generation_kwargs.pop("length_penalty", 0.0)
-        num_beams = generation_kwargs.pop("num_beams", 3)
-        repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
-        max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
-        sampling_rate = 22050
+        return segments
 
-        wavs = []
-        gpt_gen_time = 0
-        gpt_forward_time = 0
-        s2mel_time = 0
-        bigvgan_time = 0
-        has_warned = False
-        for seg_idx, sent in enumerate(segments):
-            self._set_gr_progress(0.2 + 0.7 * seg_idx / segments_count,
-                                  f"speech synthesis {seg_idx + 1}/{segments_count}...")
+    @staticmethod
+    def generation_options(max_text_tokens_per_segment=120, **generation_kwargs):
+        """
+        The GPT generation options of `infer`, with their defaults. The unknown keyword arguments are passed to
+        `inference_speech` as `generation_kwargs`.
+        """
+        early_stop = generation_kwargs.pop("early_stop", True)
+        if early_stop is True:
+            # ~50 mel codes per second, the budget is far beyond the normal speaking rate
+            early_stop = {"max_tokens_per_text_token": 30, "min_length_budget": 50}
+        return {
+            "do_sample": generation_kwargs.pop("do_sample", True),
+            "top_p": generation_kwargs.pop("top_p", 0.8),
+            "top_k": generation_kwargs.pop("top_k", 30),
+            "temperature": generation_kwargs.pop("temperature", 0.8),
+            "autoregressive_batch_size": 1,
+            "length_penalty": generation_kwargs.pop("length_penalty", 0.0),
+            "num_beams": generation_kwargs.pop("num_beams", 3),
+            "repetition_penalty": generation_kwargs.pop("repetition_penalty", 10.0),
+            "max_mel_tokens": generation_kwargs.pop("max_mel_tokens", 1500),
+            "early_stop": early_stop,
+            "use_mel_budget": generation_kwargs.pop("mel_budget", True),
+            "max_text_tokens_per_segment": max_text_tokens_per_segment,
+            "generation_kwargs": generation_kwargs,
+        }
+
+    @staticmethod
+    def new_stats():
+        return {"gpt_gen_time": 0.0, "gpt_forward_time": 0.0, "s2mel_time": 0.0, "bigvgan_time": 0.0,
+                "has_warned": False, "cached_segments": 0}
+
+    def model_fingerprint(self):
+        """
+        The version, precision and quantization of the model with the hashes of the loaded GPT, s2mel and vocoder
+        checkpoints (or of the bundle), so that the segments cached on disk are not reused after the weights are
+        updated. Hashed once, at the first call.
+        """
+        if self._model_fingerprint is None:
+            paths = [self.bundle.path] if self.bundle is not None else [self.gpt_path, self.s2mel_path,
+                                                                         self.bigvgan_path]
+            # the name of the vocoder if its weights are not found in the Hugging Face cache
+            self._model_fingerprint = [str(self.model_version), self.precision, self.quantize] + \
+                [file_fingerprint(path) if os.path.isfile(path) else path for path in paths]
+        return self._model_fingerprint
+
+    def segment_key(self, sent, conditions, options):
+        """
+        The key of the audio of a segment in `segment_cache`, from which its seed is derived, see `segment_key`.
+        None if the request is not reproducible (``use_random`` with an emotion vector).
+        """
+        if conditions["fingerprint"] is None:
+            return None
+        return segment_key(dict(conditions["fingerprint"], model=self.model_fingerprint()), sent, options)
+
+    def _uncached_segments(self, segments, conditions, options, seeded, wavs, stats):
+        """
+        Args:
+            segments: (seg_idx, sent) of the segments of the request.
+
+        Yields (seg_idx, sent, key, seed) of the segments to synthesize, the waveforms of the cached segments are
+        put in ``wavs`` instead. ``seed`` is None unless ``seeded``.
+        """
+        keyed = seeded or self.segment_cache is not None
+        for seg_idx, sent in segments:
+            key = self.segment_key(sent, conditions, options) if keyed else None
+            wav = self.segment_cache.get(key) if self.segment_cache is not None and key is not None else None
+            if wav is not None:
+                wavs[seg_idx] = wav
+                stats["cached_segments"] += 1
+                continue
+            yield seg_idx, sent, key, segment_seed(key) if seeded and key is not None else None
+
+    def _store_segment(self, key, wav):
+        if self.segment_cache is not None and key is not None:
+            self.segment_cache.put(key, wav)
+
+    @torch.no_grad()
+    def generate_segment(self, sent, conditions, options, stats, verbose=False, seed=None):
+        """
+        GPT stage of one segment: decode the mel codes, then the GPT latent of the codes.
 
-            text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
-            text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
+        Args:
+            seed: seed of the sampling, the global torch RNG is seeded with it.
+
+        Returns:
+            (codes, code_lens, latent)
+        """
+        spk_cond_emb = conditions["spk_cond_emb"]
+        emo_cond_emb = conditions["emo_cond_emb"]
+        max_mel_tokens = options["max_mel_tokens"]
+        text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
+        text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
+        if verbose:
+            print(text_tokens)
+            print(f"text_tokens shape: {text_tokens.shape}, text_tokens type: {text_tokens.dtype}")
+            # debug tokenizer
+            text_token_syms = self.tokenizer.convert_ids_to_tokens(text_tokens[0].tolist())
+            print("text_token_syms is same as segment tokens", text_token_syms == sent)
+
+        if options["use_mel_budget"]:
+            # cap the generation by the text-length-aware budget instead of the fixed max_mel_tokens
+            expected_mel_tokens, mel_budget = self.mel_budget.estimate(sent)
+            max_generate_length = min(mel_budget, max_mel_tokens)
             if verbose:
-                print(text_tokens)
-                print(f"text_tokens shape: {text_tokens.shape}, text_tokens type: {text_tokens.dtype}")
-                # debug tokenizer
-                text_token_syms = self.tokenizer.convert_ids_to_tokens(text_tokens[0].tolist())
-                print("text_token_syms is same as segment tokens", text_token_syms == sent)
+                print(f"expected mel tokens: {expected_mel_tokens}, mel budget: {max_generate_length}")
+        else:
+            max_generate_length = max_mel_tokens
+
+        m_start_time = time.perf_counter()
+        with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+            emovec = self.gpt.merge_emovec(
+                spk_cond_emb,
+                emo_cond_emb,
+                torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                alpha=conditions["emo_alpha"]
+            )
+
+            if conditions["weight_vector"] is not None:
+                emovec = conditions["emovec_mat"] + (1 - torch.sum(conditions["weight_vector"])) * emovec
+                # emovec = emovec_mat
+
+            if seed is not None:
+                # 采样使用全局随机数生成器, 固定种子使同一分段的结果可复现
+                torch.manual_seed(seed)
+            codes, speech_conditioning_latent = self.gpt.inference_speech(
+                spk_cond_emb,
+                text_tokens,
+                emo_cond_emb,
+                cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                emo_vec=emovec,
+                do_sample=True,
+                top_p=options["top_p"],
+                top_k=options["top_k"],
+                temperature=options["temperature"],
+                num_return_sequences=options["autoregressive_batch_size"],
+                length_penalty=options["length_penalty"],
+                num_beams=options["num_beams"],
+                repetition_penalty=options["repetition_penalty"],
+                max_generate_length=max_generate_length,
+                early_stop=options["early_stop"],
+                **options["generation_kwargs"]
+            )
+
+        stats["gpt_gen_time"] += time.perf_counter() - m_start_time
+        if self.compile_stats is not None and self.gpt.inference_model.static_decoder is not None:
+            inference_model = self.gpt.inference_model
+            self.compile_stats.record("gpt_decode", round_up(inference_model.static_kv_length,
+                                                             inference_model.static_kv_multiple),
+                                      time.perf_counter() - m_start_time)
+        if not stats["has_warned"] and (codes[:, -1] != self.stop_mel_token).any():
+            if max_generate_length < max_mel_tokens:
+                warnings.warn(
+                    f"WARN: generation stopped due to exceeding the estimated mel budget ({max_generate_length}). "
+                    f"Input text tokens: {text_tokens.shape[1]}. "
+                    f"Consider increasing `MelBudgetEstimator.safety_factor` or disabling it by `mel_budget=False`.",
+                    category=RuntimeWarning
+                )
+            else:
+                warnings.warn(
+                    f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
+                    f"Input text tokens: {text_tokens.shape[1]}. "
+                    f"Consider reducing `max_text_tokens_per_segment`({options['max_text_tokens_per_segment']}) or increasing `max_mel_tokens`.",
+                    category=RuntimeWarning
+                )
+            stats["has_warned"] = True
+
+        # cut at stop_mel_token, batch-aware and without per-row host syncs
+        codes, code_lens = postprocess_mel_codes(codes, self.stop_mel_token, max_consecutive=None)
+        if options["use_mel_budget"]:
+            self.mel_budget.record(expected_mel_tokens, codes.shape[-1], max_generate_length)
+        if verbose:
+            print(codes, type(codes))
+            print(f"fix codes shape: {codes.shape}, codes type: {codes.dtype}")
+            print(f"code len: {code_lens}")
+
+        m_start_time = time.perf_counter()
+        use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
+        with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+            latent = self.gpt(
+                speech_conditioning_latent,
+                text_tokens,
+                torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
+                codes,
+                code_lens,
+                emo_cond_emb,
+                cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                emo_vec=emovec,
+                use_speed=use_speed,
+            )
+            stats["gpt_forward_time"] += time.perf_counter() - m_start_time
+        return codes, code_lens, latent
+
+    @torch.no_grad()
+    def synthesize_mel(self, codes, code_lens, latent, conditions, stats, seed=None):
+        """
+        s2mel stage of one segment: the mel spectrogram of the GPT codes and latent, by the DiT diffusion.
 
+        Args:
+            seed: seed of the diffusion noise, drawn from a generator of its own so that the GPT stage of the
+                other segments, running at the same time in `SegmentPipeline`, is not affected.
+        """
+        generator = torch.Generator(device=latent.device).manual_seed(seed) if seed is not None else None
+        prompt_condition = conditions["prompt_condition"]
+        ref_mel = conditions["ref_mel"]
+        dtype = self.s2mel_dtype
+        with torch.amp.autocast(latent.device.type, enabled=dtype is not None, dtype=dtype):
             m_start_time = time.perf_counter()
-            with torch.no_grad():
-                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    emovec = self.gpt.merge_emovec(
-                        spk_cond_emb,
-                        emo_cond_emb,
-                        torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        alpha=emo_alpha
-                    )
-
-                    if emo_vector is not None:
-                        emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
-                        # emovec = emovec_mat
-
-                    codes, speech_conditioning_latent = self.gpt.inference_speech(
-                        spk_cond_emb,
-                        text_tokens,
-                        emo_cond_emb,
-                        cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_vec=emovec,
-                        do_sample=True,
-                        top_p=top_p,
-                        top_k=top_k,
-                        temperature=temperature,
-                        num_return_sequences=autoregressive_batch_size,
-                        length_penalty=length_penalty,
-                        num_beams=num_beams,
-                        repetition_penalty=repetition_penalty,
-                        max_generate_length=max_mel_tokens,
-                        **generation_kwargs
-                    )
-
-                gpt_gen_time += time.perf_counter() - m_start_time
-                if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
-                    warnings.warn(
-                        f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
-                        f"Input text tokens: {text_tokens.shape[1]}. "
-                        f"Consider reducing `max_text_tokens_per_segment`({max_text_tokens_per_segment}) or increasing `max_mel_tokens`.",
-                        category=RuntimeWarning
-                    )
-                    has_warned = True
-
-                code_lens = torch.tensor([codes.shape[-1]], device=codes.device, dtype=codes.dtype)
-                #                 if verbose:
-                #                     print(codes, type(codes))
-                #                     print(f"codes shape: {codes.shape}, codes type: {codes.dtype}")
-                #                     print(f"code len: {code_lens}")
-
-                code_lens = []
-                for code in codes:
-                    if self.stop_mel_token not in code:
-                        code_lens.append(len(code))
-                        code_len = len(code)
-                    else:
-                        len_ = (code == self.stop_mel_token).nonzero(as_tuple=False)[0] + 1
-                        code_len = len_ - 1
-                    code_lens.append(code_len)
-                codes = codes[:, :code_len]
-                code_lens = torch.LongTensor(code_lens)
-                code_lens = code_lens.to(self.device)
-                if verbose:
-                    print(codes, type(codes))
-                    print(f"fix codes shape: {codes.shape}, codes type: {codes.dtype}")
-                    print(f"code len: {code_lens}")
-
-                m_start_time = time.perf_counter()
-                use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
-                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    latent = self.gpt(
-                        speech_conditioning_latent,
-                        text_tokens,
-                        torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
-                        codes,
-                        torch.tensor([codes.shape[-1]], device=text_tokens.device),
-                        emo_cond_emb,
-                        cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_vec=emovec,
-                        use_speed=use_speed,
-                    )
-                    gpt_forward_time += time.perf_counter() - m_start_time
-
-                dtype = None
-                with torch.amp.autocast(text_tokens.device.type, enabled=dtype is not None, dtype=dtype):
-                    m_start_time = time.perf_counter()
-                    diffusion_steps = 25
-                    inference_cfg_rate = 0.7
-                    latent = self.s2mel.models['gpt_layer'](latent)
-                    S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
-                    S_infer = S_infer.transpose(1, 2)
-                    S_infer = S_infer + latent
-                    target_lengths = (code_lens * 1.72).long()
-
-                    cond = self.s2mel.models['length_regulator'](S_infer,
-                                                                 ylens=target_lengths,
-                                                                 n_quantizers=3,
-                                                                 f0=None)[0]
-                    cat_condition = torch.cat([prompt_condition, cond], dim=1)
-                    vc_target = self.s2mel.models['cfm'].inference(cat_condition,
-                                                                   torch.LongTensor([cat_condition.size(1)]).to(
-                                                                       cond.device),
-                                                                   ref_mel, style, None, diffusion_steps,
-                                                                   inference_cfg_rate=inference_cfg_rate)
-                    vc_target = vc_target[:, :, ref_mel.size(-1):]
-                    s2mel_time += time.perf_counter() - m_start_time
-
-                    m_start_time = time.perf_counter()
-                    wav = self.bigvgan(vc_target.float()).squeeze().unsqueeze(0)
-                    print(wav.shape)
-                    bigvgan_time += time.perf_counter() - m_start_time
-                    wav = wav.squeeze(1)
-
-                wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
-                if verbose:
-                    print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
-                # wavs.append(wav[:, :-512])
-                wavs.append(wav.cpu())  # to cpu before saving
-        end_time = time.perf_counter()
+            diffusion_steps = 25
+            inference_cfg_rate = 0.7
+            latent = self.s2mel.models['gpt_layer'](latent)
+            S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
+            S_infer = S_infer.transpose(1, 2)
+            S_infer = S_infer + latent
+            target_lengths = (code_lens * 1.72).long()
+
+            cond = self.s2mel.models['length_regulator'](S_infer,
+                                                         ylens=target_lengths,
+                                                         n_quantizers=3,
+                                                         f0=None)[0]
+            cat_condition = torch.cat([prompt_condition, cond], dim=1)
+            vc_target = self.s2mel.models['cfm'].inference(cat_condition,
+                                                           torch.LongTensor([cat_condition.size(1)]).to(
+                                                               cond.device),
+                                                           ref_mel, conditions["style"], None, diffusion_steps,
+                                                           inference_cfg_rate=inference_cfg_rate,
+                                                           generator=generator)
+            vc_target = vc_target[:, :, ref_mel.size(-1):]
+            stats["s2mel_time"] += time.perf_counter() - m_start_time
+            if self.compile_stats is not None:
+                self.compile_stats.record("dit", bucket_length(cat_condition.size(1), self.length_buckets),
+                                          time.perf_counter() - m_start_time)
+        return vc_target
 
+    @torch.no_grad()
+    def vocode(self, vc_target, stats, verbose=False):
+        """
+        BigVGAN stage of one segment: the int16-range waveform of the mel spectrogram, on CPU.
+        """
+        dtype = self.s2mel_dtype
+        with torch.amp.autocast(vc_target.device.type, enabled=dtype is not None, dtype=dtype):
+            m_start_time = time.perf_counter()
+            mel = vc_target.float()
+            if self.length_buckets:
+                # pad with silence to the bucket length for the compiled vocoder, then cut the padded samples
+                frames = mel.size(-1)
+                mel = F.pad(mel, (0, bucket_length(frames, self.length_buckets) - frames), value=SILENCE_LOG_MEL)
+                wav = self.bigvgan(mel)[..., :frames * self.bigvgan.h.hop_size].squeeze().unsqueeze(0)
+            else:
+                wav = self.bigvgan(mel).squeeze().unsqueeze(0)
+            print(wav.shape)
+            stats["bigvgan_time"] += time.perf_counter() - m_start_time
+            if self.compile_stats is not None:
+                self.compile_stats.record("bigvgan", mel.size(-1), time.perf_counter() - m_start_time)
+            wav = wav.squeeze(1)
+
+        wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
+        if verbose:
+            print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
+        # wavs.append(wav[:, :-512])
+        return wav.cpu()  # to cpu before saving
+
+    def save_output(self, wavs, output_path, stats, start_time, end_time, interval_silence=200, use_mel_budget=True):
+        """
+        Join the segment waveforms, print the timings, then save them to ``output_path``, or return them in the
+        Gradio format if ``output_path`` is empty.
+        """
+        sampling_rate = 22050
         self._set_gr_progress(0.9, "saving audio...")
         wavs = self.insert_interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
         wav = torch.cat(wavs, dim=1)
         wav_length = wav.shape[-1] / sampling_rate
-        print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
-        print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
-        print(f">> s2mel_time: {s2mel_time:.2f} seconds")
-        print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
+        print(f">> gpt_gen_time: {stats['gpt_gen_time']:.2f} seconds")
+        print(f">> gpt_forward_time: {stats['gpt_forward_time']:.2f} seconds")
+        print(f">> s2mel_time: {stats['s2mel_time']:.2f} seconds")
+        print(f">> bigvgan_time: {stats['bigvgan_time']:.2f} seconds")
         print(f">> Total inference time: {end_time - start_time:.2f} seconds")
         print(f">> Generated audio length: {wav_length:.2f} seconds")
         print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
+        mel_budget_metrics = self.mel_budget.metrics() if use_mel_budget else {}
+        # no segment was generated when all of them come from the segment cache
+        if mel_budget_metrics.get("segments"):
+            print(f">> mel budget: actual/expected {mel_budget_metrics['actual_to_expected']:.2f}, "
+                  f"budget usage {mel_budget_metrics['budget_usage']:.2f}, "
+                  f"exhausted {mel_budget_metrics['budget_exhausted']}/{mel_budget_metrics['segments']} segments")
+        if self.compile_stats is not None:
+            print(self.compile_stats.report())
 
         # save audio
         wav = wav.cpu()  # to cpu
@@ -751,6 +1182,101 @@ class IndexTTS2:
             wav_data = wav_data.numpy().T
             return (sampling_rate, wav_data)
 
+    # 原始推理模式
+    def infer(self, spk_audio_prompt, text, output_path,
+              emo_audio_prompt=None, emo_alpha=1.0,
+              emo_vector=None,
+              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+              verbose=False, max_text_tokens_per_segment=120, pipelined=False, balanced_segments=False,
+              deterministic=None, session=None, **generation_kwargs):
+        """
+        Args:
+            pipelined: overlap the GPT generation of the next segments with the s2mel and BigVGAN of the generated
+                ones, see `SegmentPipeline`. Speeds up the requests of several segments.
+            balanced_segments: split the text into segments of similar lengths instead of greedily at the
+                sentence ends, see `TextTokenizer.split_segments_balanced`.
+            deterministic: seed the GPT sampling and the DiT noise of each segment from the hash of its tokens, the
+                voice, the emotion and the generation options, see `segment_key`: the same segment is synthesized the
+                same in every request. Defaults to True with the segment cache, whose segments are then synthesized
+                only once, and with ``session``.
+            session: an `IncrementalSession` of the document. The segments unchanged since the last run with the
+                session are reused, with their seeds, only the edited ones are synthesized.
+        """
+        print(">> starting inference...")
+        self._set_gr_progress(0, "starting inference...")
+        if verbose:
+            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
+                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
+                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
+                  f"emo_text:{emo_text}")
+        start_time = time.perf_counter()
+
+        emo_audio_prompt, emo_alpha, emo_vector = self.prepare_emotion(
+            text, spk_audio_prompt, emo_audio_prompt, emo_alpha, emo_vector, use_emo_text, emo_text
+        )
+        conditions = self.encode_prompts(spk_audio_prompt, emo_audio_prompt, emo_alpha, emo_vector, use_random, verbose)
+
+        self._set_gr_progress(0.1, "text processing...")
+        options = self.generation_options(max_text_tokens_per_segment, **generation_kwargs)
+        wavs = {}
+        seeds = {}
+        if session is not None:
+            # 增量合成: 与上次结果对齐, 未改动的分段直接复用
+            settings = None
+            if conditions["fingerprint"] is not None:
+                settings = [self.segment_key([], conditions, options), max_text_tokens_per_segment, balanced_segments]
+            split_segments = functools.partial(self.tokenizer.split_segments,
+                                               max_text_tokens_per_segment=max_text_tokens_per_segment,
+                                               balanced=balanced_segments)
+            plan = session.plan(self.tokenizer.tokenize(text), settings, split_segments)
+            segments = [sent for sent, _ in plan]
+            for seg_idx, (_, old_idx) in enumerate(plan):
+                if old_idx is not None:
+                    wavs[seg_idx] = session.wav(old_idx)
+                    seeds[seg_idx] = session.seeds[old_idx]
+            todo = [(seg_idx, sent) for seg_idx, (sent, old_idx) in enumerate(plan) if old_idx is None]
+            print(f">> incremental: {len(wavs)}/{len(plan)} segments unchanged, {len(todo)} to synthesize")
+        else:
+            segments = self.text_frontend(text, max_text_tokens_per_segment, verbose, stream=True,
+                                          balanced=balanced_segments)
+            todo = enumerate(segments)
+        segments_count = len(segments) if isinstance(segments, list) else None
+
+        if deterministic is None:
+            deterministic = self.segment_cache is not None or session is not None
+        stats = self.new_stats()
+        # 缓存中已有的分段直接取出, 只合成缺失的分段
+        pending = self._uncached_segments(todo, conditions, options, deterministic, wavs, stats)
+        if pipelined and (segments_count is None or segments_count > 1):
+            pending, pending_seeds, pending_keys = itertools.tee(pending, 3)
+            synthesized = SegmentPipeline(self).run((sent for _, sent, _, _ in pending), conditions, options, stats,
+                                                    verbose, seeds=(seed for _, _, _, seed in pending_seeds))
+            for (seg_idx, _, key, seed), wav in zip(pending_keys, synthesized):
+                wavs[seg_idx] = wav
+                seeds[seg_idx] = seed
+                self._store_segment(key, wav)
+        else:
+            for seg_idx, sent, key, seed in pending:
+                self._set_segment_progress(seg_idx, segments_count)
+                codes, code_lens, latent = self.generate_segment(sent, conditions, options, stats, verbose, seed)
+                vc_target = self.synthesize_mel(codes, code_lens, latent, conditions, stats, seed)
+                wavs[seg_idx] = self.vocode(vc_target, stats, verbose)
+                seeds[seg_idx] = seed
+                self._store_segment(key, wavs[seg_idx])
+        wavs = [wavs[seg_idx] for seg_idx in range(len(wavs))]
+        if session is not None:
+            session.update(settings, segments, wavs, [seeds.get(seg_idx) for seg_idx in range(len(wavs))])
+        end_time = time.perf_counter()
+        if self.segment_cache is not None:
+            print(f">> segment cache: {stats['cached_segments']}/{len(wavs)} segments of the request cached, "
+                  f"{self.segment_cache.report()}")
+        if self.prompt_compactor.enabled:
+            print(self.prompt_compactor.request_report(conditions["prompt_windows"], conditions["ref_mel"].size(-1),
+                                                       len(wavs)))
+
+        return self.save_output(wavs, output_path, stats, start_time, end_time, interval_silence,
+                                options["use_mel_budget"])
+
 
 def find_most_similar_cosine(query_vector, matrix):
     query_vector = query_vector.float()
@@ -761,14 +1287,31 @@ def find_most_similar_cosine(query_vector, matrix):
     return most_similar_index
 
 class QwenEmotion:
-    def __init__(self, model_dir):
+    def __init__(self, model_dir, device=None, lazy=False, idle_timeout=None, cache_size=256,
+                 max_new_tokens=128, bundle=None):
+        """
+        Args:
+            model_dir (str): path to the Qwen emotion model.
+            device (None | str): device of the model, None to let `device_map="auto"` place it. Runs in fp32 on CPU.
+            lazy (bool): load the model on the first `inference` call instead of now.
+            idle_timeout (None | float): unload the model after this many seconds without `inference` calls,
+                it is loaded again on the next call.
+            cache_size (int): LRU cache size of the results by whitespace-normalized text, 0 to disable.
+            max_new_tokens (int): decoding bound of the generation, the 8-key JSON takes ~70 tokens.
+            bundle (None | ModelBundle): load the model from its 'qwen_emo' component instead of `model_dir`.
+        """
         self.model_dir = model_dir
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_dir,
-            torch_dtype="float16",  # "auto"
-            device_map="auto"
-        )
+        self.bundle = bundle
+        self.device = device
+        self.idle_timeout = idle_timeout
+        self.cache_size = cache_size
+        self.max_new_tokens = max_new_tokens
+        self._cache = OrderedDict()
+        self.tokenizer = None
+        self.model = None
+        self._lock = threading.RLock()
+        self._idle_timer = None
+        self._last_used = time.monotonic()
         self.prompt = "文本情感分类"
         self.cn_key_to_en = {
             "高兴": "happy",
@@ -797,6 +1340,83 @@ class QwenEmotion:
         }
         self.max_score = 1.2
         self.min_score = 0.0
+        if not lazy:
+            self.load()
+
+    @property
+    def is_loaded(self):
+        return self.model is not None
+
+    def load(self):
+        with self._lock:
+            if self.model is not None:
+                return self.model
+            start = time.perf_counter()
+            if self.bundle is not None:
+                device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+                dtype = torch.float32 if torch.device(device).type == "cpu" else torch.float16
+                # left padding for the batched generation
+                self.tokenizer, self.model = load_causal_lm(self.bundle, "qwen_emo", dtype, device, padding_side="left")
+            else:
+                if self.tokenizer is None:
+                    # left padding for the batched generation
+                    self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir, padding_side="left")
+                if self.device is None:
+                    kwargs = {"torch_dtype": "float16", "device_map": "auto"}
+                elif torch.device(self.device).type == "cpu":
+                    kwargs = {"torch_dtype": "float32", "device_map": "cpu"}
+                else:
+                    kwargs = {"torch_dtype": "float16", "device_map": self.device}
+                # may be loaded by a `ParallelLoader` thread, see `module_construction`
+                with module_construction():
+                    self.model = AutoModelForCausalLM.from_pretrained(self.model_dir, **kwargs)
+            print(f">> QwenEmotion loaded in {time.perf_counter() - start:.2f}s: "
+                  f"{self.memory_footprint() / 1024 ** 2:.0f} MB on {self.model.device}")
+            return self.model
+
+    def unload(self):
+        """
+        Release the model, the tokenizer is kept.
+        """
+        with self._lock:
+            self._cancel_idle_timer()
+            if self.model is None:
+                return
+            device = self.model.device
+            footprint = self.memory_footprint()
+            self.model = None
+            gc.collect()
+            if device.type == "cuda":
+                torch.cuda.empty_cache()
+            print(f">> QwenEmotion unloaded, {footprint / 1024 ** 2:.0f} MB released on {device}")
+
+    def memory_footprint(self):
+        """
+        Bytes of the model parameters and buffers, 0 if not loaded.
+        """
+        model = self.model
+        if model is None:
+            return 0
+        return module_nbytes(model)
+
+    def _cancel_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _schedule_unload(self):
+        if self.idle_timeout is None:
+            return
+        self._cancel_idle_timer()
+        self._idle_timer = threading.Timer(self.idle_timeout, self._unload_if_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _unload_if_idle(self):
+        with self._lock:
+            # a call may have started while the timer fired
+            if time.monotonic() - self._last_used >= self.idle_timeout:
+                self.unload()
 
     def clamp_score(self, value):
         return max(self.min_score, min(self.max_score, value))
@@ -820,60 +1440,109 @@ class QwenEmotion:
         return emotion_dict
 
     def inference(self, text_input):
-        start = time.time()
+        """
+        Args:
+            text_input (str | list[str]): the emotion text, or a list of texts analyzed in one batch.
+        Returns:
+            the emotion dict, or the list of emotion dicts of a list input.
+        """
+        texts = [text_input] if isinstance(text_input, str) else list(text_input)
+        keys = [self._cache_key(text) for text in texts]
+        with self._lock:
+            results = {key: self._cache_get(key) for key in keys}
+            pending = [key for key, result in results.items() if result is None]
+            if len(pending) > 0:
+                self._cancel_idle_timer()
+                self.load()
+                try:
+                    contents = self._generate(pending)
+                finally:
+                    self._last_used = time.monotonic()
+                    self._schedule_unload()
+                for key, content in zip(pending, contents):
+                    results[key] = self._postprocess(key, content)
+                    self._cache_put(key, results[key])
+        emotion_dicts = [dict(results[key]) for key in keys]
+        return emotion_dicts[0] if isinstance(text_input, str) else emotion_dicts
+
+    @staticmethod
+    def _cache_key(text):
+        return " ".join(text.split())
+
+    def _cache_get(self, key):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        return None
+
+    def _cache_put(self, key, emotion_dict):
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = emotion_dict
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _chat_text(self, text_input):
         messages = [
             {"role": "system", "content": f"{self.prompt}"},
             {"role": "user", "content": f"{text_input}"}
         ]
-        text = self.tokenizer.apply_chat_template(
+        return self.tokenizer.apply_chat_template(
             messages,
             tokenize=False,
             add_generation_prompt=True,
             enable_thinking=False,
         )
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
 
-        # conduct text completion
+    def _generate(self, texts):
+        model_inputs = self.tokenizer([self._chat_text(text) for text in texts], return_tensors="pt",
+                                      padding=True).to(self.model.device)
+
+        # conduct text completion, bounded to the length of the emotion JSON
         generated_ids = self.model.generate(
             **model_inputs,
-            max_new_tokens=32768,
+            max_new_tokens=self.max_new_tokens,
             pad_token_id=self.tokenizer.eos_token_id
         )
-        output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
-
-        # parsing thinking content
-        try:
-            # rindex finding 151668 (</think>)
-            index = len(output_ids) - output_ids[::-1].index(151668)
-        except ValueError:
-            index = 0
+        contents = []
+        for output_ids in generated_ids[:, model_inputs.input_ids.shape[1]:].tolist():
+            # parsing thinking content
+            try:
+                # rindex finding 151668 (</think>)
+                index = len(output_ids) - output_ids[::-1].index(151668)
+            except ValueError:
+                index = 0
 
-        content = self.tokenizer.decode(output_ids[index:], skip_special_tokens=True)
+            content = self.tokenizer.decode(output_ids[index:], skip_special_tokens=True)
+            contents.append(self._parse_content(content))
+        return contents
 
+    @staticmethod
+    def _parse_content(content):
         # decode the JSON emotion detections as a dictionary
         try:
-            content = json.loads(content)
+            parsed = json.loads(content)
         except json.decoder.JSONDecodeError:
-            # invalid JSON; fallback to manual string parsing
-            # print(">> parsing QwenEmotion response", content)
-            content = {
-                m.group(1): float(m.group(2))
-                for m in re.finditer(r'([^\s":.,]+?)"?\s*:\s*([\d.]+)', content)
-            }
-            # print(">> dict result", content)
+            parsed = None
+        if isinstance(parsed, dict):
+            return parsed
+        # invalid (or truncated) JSON; fallback to manual string parsing
+        return {
+            m.group(1): float(m.group(2))
+            for m in re.finditer(r'([^\s":.,]+?)"?\s*:\s*([\d.]+)', content)
+        }
 
+    def _postprocess(self, text_input, content):
         # workaround for QwenEmotion's inability to distinguish "悲伤" (sad) vs "低落" (melancholic).
         # if we detect any of the IndexTTS "melancholic" words, we swap those vectors
         # to encode the "sad" emotion as "melancholic" (instead of sadness).
         text_input_lower = text_input.lower()
         if any(word in text_input_lower for word in self.melancholic_words):
-            # print(">> before vec swap", content)
             content["悲伤"], content["低落"] = content.get("低落", 0.0), content.get("悲伤", 0.0)
-            # print(">>  after vec swap", content)
 
         return self.convert(content)
 
-
 if __name__ == "__main__":
     prompt_wav = "examples/voice_01.wav"
     text = '欢迎大家来体验indextts2，并给予我们意见与反馈，谢谢大家。'
@@ -19,7 +19,7 @@ from .utils import init_weights, get_padding
 from .alias_free_activation.torch.act import Activation1d as TorchActivation1d
 from .env import AttrDict
 
-from huggingface_hub import PyTorchModelHubMixin, hf_hub_download
+from huggingface_hub import PyTorchModelHubMixin, hf_hub_download, try_to_load_from_cache
 
 
 def load_hparams_from_json(path) -> AttrDict:
@@ -28,6 +28,17 @@ def load_hparams_from_json(path) -> AttrDict:
     return AttrDict(json.loads(data))
 
 
+def bigvgan_weights_path(model_id: str) -> Optional[str]:
+    """
+    The local file of the generator weights loaded by `BigVGAN.from_pretrained(model_id)`, None if it is not in the
+    Hugging Face cache.
+    """
+    if os.path.isdir(model_id):
+        return os.path.join(model_id, "bigvgan_generator.pt")
+    path = try_to_load_from_cache(model_id, "bigvgan_generator.pt")
+    return path if isinstance(path, str) else None
+
+
 class AMPBlock1(torch.nn.Module):
     """
     AMPBlock applies Snake / SnakeBeta activation functions with trainable parameters that control periodicity, defined for each layer.
@@ -379,9 +390,9 @@ class BigVGAN(
         x = self.conv_post(x)
         # Final tanh activation
         if self.use_tanh_at_final:
-            x = torch.tanh(x)
+            x = torch.tanh(x.float())
         else:
-            x = torch.clamp(x, min=-1.0, max=1.0)  # Bound the output to [-1, 1]
+            x = torch.clamp(x.float(), min=-1.0, max=1.0)  # Bound the output to [-1, 1]
 
         return x
 
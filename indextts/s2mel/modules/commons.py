@@ -516,8 +516,14 @@ def load_checkpoint(
     ignore_modules=[],
     is_distributed=False,
     load_ema=False,
+    mmap=False,
+    assign=False,
 ):
-    state = torch.load(path, map_location="cpu")
+    if mmap:
+        from indextts.utils.model_loader import load_state_dict_mmap
+        state = load_state_dict_mmap(path)
+    else:
+        state = torch.load(path, map_location="cpu")
     params = state["net"]
     if load_ema and "ema" in state:
         print("Loading EMA")
@@ -550,7 +556,7 @@ def load_checkpoint(
                     f"Warning: Skipped loading some keys due to shape mismatch: {skipped_keys}"
                 )
             print("%s loaded" % key)
-            model[key].load_state_dict(filtered_state_dict, strict=False)
+            model[key].load_state_dict(filtered_state_dict, strict=False, assign=assign)
     _ = [model[key].eval() for key in model]
 
     if not load_only_params:
@@ -573,8 +579,14 @@ def load_checkpoint2(
     ignore_modules=[],
     is_distributed=False,
     load_ema=False,
+    mmap=False,
+    assign=False,
 ):
-    state = torch.load(path, map_location="cpu")
+    if mmap:
+        from indextts.utils.model_loader import load_state_dict_mmap
+        state = load_state_dict_mmap(path)
+    else:
+        state = torch.load(path, map_location="cpu")
     params = state["net"]
     if load_ema and "ema" in state:
         print("Loading EMA")
@@ -607,7 +619,7 @@ def load_checkpoint2(
                     f"Warning: Skipped loading some keys due to shape mismatch: {skipped_keys}"
                 )
             print("%s loaded" % key)
-            model.models[key].load_state_dict(filtered_state_dict, strict=False)
+            model.models[key].load_state_dict(filtered_state_dict, strict=False, assign=assign)
     model.eval()
 #     _ = [model[key].eval() for key in model]
 
@@ -5,6 +5,7 @@ import torch.nn.functional as F
 
 from indextts.s2mel.modules.diffusion_transformer import DiT
 from indextts.s2mel.modules.commons import sequence_mask
+from indextts.utils.compilation import bucket_length
 
 from tqdm import tqdm
 
@@ -17,6 +18,8 @@ class BASECFM(torch.nn.Module, ABC):
         self.sigma_min = 1e-6
 
         self.estimator = None
+        # pad the sequences to these lengths at inference, so that a compiled estimator sees a few shapes only
+        self.length_buckets = None
 
         self.in_channels = args.DiT.in_channels
 
@@ -28,7 +31,8 @@ class BASECFM(torch.nn.Module, ABC):
             self.zero_prompt_speech_token = False
 
     @torch.inference_mode()
-    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5):
+    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5,
+                  generator=None):
         """Forward diffusion
 
         Args:
@@ -43,15 +47,22 @@ class BASECFM(torch.nn.Module, ABC):
             f0: None
             n_timesteps (int): number of diffusion steps
             temperature (float, optional): temperature for scaling noise. Defaults to 1.0.
+            generator (torch.Generator, optional): generator of the noise, defaults to the global one.
 
         Returns:
             sample: generated mel-spectrogram
                 shape: (batch_size, 80, mel_timesteps)
         """
         B, T = mu.size(0), mu.size(1)
-        z = torch.randn([B, self.in_channels, T], device=mu.device) * temperature
+        z = torch.randn([B, self.in_channels, T], device=mu.device, generator=generator) * temperature
         t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device)
         # t_span = t_span + (-1) * (torch.cos(torch.pi / 2 * t_span) - 1 + t_span)
+        if self.length_buckets:
+            # the padded frames are masked out by `x_lens` in the estimator, and kept at zero by `solve_euler`
+            padding = bucket_length(T, self.length_buckets) - T
+            z = F.pad(z, (0, padding))
+            mu = F.pad(mu, (0, 0, 0, padding))
+            return self.solve_euler(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate)[..., :T]
         return self.solve_euler(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate)
 
     def solve_euler(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
@@ -80,6 +91,8 @@ class BASECFM(torch.nn.Module, ABC):
         prompt_x = torch.zeros_like(x)
         prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
         x[..., :prompt_len] = 0
+        # the frames after x_lens, those padded to a length bucket
+        x_mask = sequence_mask(x_lens, x.size(-1)).unsqueeze(1).to(x.dtype)
         if self.zero_prompt_speech_token:
             mu[..., :prompt_len] = 0
         for step in tqdm(range(1, len(t_span))):
@@ -105,7 +118,7 @@ class BASECFM(torch.nn.Module, ABC):
             else:
                 dphi_dt = self.estimator(x, prompt_x, x_lens, t.unsqueeze(0), style, mu)
 
-            x = x + dt * dphi_dt
+            x = (x + dt * dphi_dt) * x_mask
             t = t + dt
             sol.append(x)
             if step < len(t_span) - 1:
@@ -0,0 +1,109 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import torch
+import torchaudio
+
+_resamplers: Dict[Tuple[int, int], torchaudio.transforms.Resample] = {}
+_resamplers_lock = threading.Lock()
+
+
+def get_resampler(orig_sr: int, new_sr: int) -> torchaudio.transforms.Resample:
+    """
+    The `Resample` transform from ``orig_sr`` to ``new_sr``, its filter kernel is built once per pair of rates.
+    """
+    key = (int(orig_sr), int(new_sr))
+    with _resamplers_lock:
+        resampler = _resamplers.get(key)
+        if resampler is None:
+            resampler = torchaudio.transforms.Resample(*key)
+            _resamplers[key] = resampler
+    return resampler
+
+
+def resample(audio: torch.Tensor, orig_sr: int, new_sr: int) -> torch.Tensor:
+    if orig_sr == new_sr:
+        return audio
+    return get_resampler(orig_sr, new_sr)(audio)
+
+
+def load_audio_head(path: str, max_seconds: Optional[float] = None) -> Tuple[torch.Tensor, int]:
+    """
+    Decode the first ``max_seconds`` of an audio file at its own sample rate, mixed down to mono: only these frames
+    are read from disk. Formats not supported by soundfile are decoded by librosa, with the same duration limit.
+
+    Returns:
+        (audio, sr): float32 tensor of shape (1, samples) and its sample rate.
+    """
+    try:
+        import soundfile as sf
+        with sf.SoundFile(path) as f:
+            sr = f.samplerate
+            frames = -1 if max_seconds is None else min(f.frames, int(max_seconds * sr))
+            audio = f.read(frames=frames, dtype="float32", always_2d=True)
+        audio = torch.from_numpy(audio).mean(dim=1) if audio.shape[1] > 1 else torch.from_numpy(audio[:, 0])
+    except (ImportError, RuntimeError):
+        # e.g. mp3 with an old libsndfile, m4a
+        import librosa
+        audio, sr = librosa.load(path, sr=None, mono=True, duration=max_seconds)
+        audio = torch.from_numpy(audio)
+    return audio.unsqueeze(0), sr
+
+
+class PromptAudio:
+    """
+    A reference audio decoded once, with its resampled versions computed on demand and kept.
+    """
+
+    def __init__(self, audio: torch.Tensor, sr: int, max_seconds: Optional[float] = None):
+        self.audio = audio
+        self.sr = sr
+        self.max_seconds = max_seconds
+        self._resampled: Dict[int, torch.Tensor] = {sr: audio}
+        self._lock = threading.Lock()
+
+    def at(self, sr: int) -> torch.Tensor:
+        """
+        The audio at ``sr``, of at most ``max_seconds * sr`` samples.
+        """
+        with self._lock:
+            audio = self._resampled.get(sr)
+            if audio is None:
+                audio = resample(self.audio, self.sr, sr)
+                self._resampled[sr] = audio
+        if self.max_seconds is not None:
+            audio = audio[:, :int(self.max_seconds * sr)]
+        return audio
+
+
+class PromptAudioLoader:
+    """
+    Load reference audios as `PromptAudio`, the last ``capacity`` ones are kept, so that the speaker and emotion
+    prompts share the decode when they are the same file, and a modified file is decoded again.
+    """
+
+    def __init__(self, max_seconds: Optional[float] = 15, capacity: int = 8):
+        self.max_seconds = max_seconds
+        self.capacity = capacity
+        self._cache: "OrderedDict[tuple, PromptAudio]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path: str, verbose: bool = False) -> PromptAudio:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, self.max_seconds)
+        with self._lock:
+            prompt_audio = self._cache.get(key)
+            if prompt_audio is not None:
+                self._cache.move_to_end(key)
+                return prompt_audio
+        audio, sr = load_audio_head(path, self.max_seconds)
+        if verbose:
+            print(f">> decoded {path}: {audio.shape[1] / sr:.2f}s at {sr} Hz (max {self.max_seconds}s)")
+        prompt_audio = PromptAudio(audio, sr, self.max_seconds)
+        with self._lock:
+            self._cache[key] = prompt_audio
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return prompt_audio
@@ -0,0 +1,304 @@
+import io
+import json
+import os
+import re
+import time
+import zipfile
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from indextts.utils.longform import wav_to_flac
+
+STATUS_FILE = "status.jsonl"
+# root directory of the output directories of the batches of the HTTP server, not set: no output directory
+BATCH_OUTPUT_ROOT_ENV = "INDEXTTS_BATCH_OUTPUT_ROOT"
+# keyword arguments of `IndexTTS2.infer` that an item can set
+GENERATION_KEYS = ("do_sample", "top_p", "top_k", "temperature", "length_penalty", "num_beams", "repetition_penalty",
+                   "max_mel_tokens", "max_text_tokens_per_segment", "interval_silence", "balanced_segments")
+EMO_VECTOR_KEYS = tuple(f"emo_vec_{i}" for i in range(1, 9))
+# alternative names of the fields, those of examples/cases.jsonl and of the HTTP API
+_ALIASES = {"prompt_audio": "voice", "spk_audio_prompt": "voice", "emo_audio_prompt": "emo_audio",
+            "emo_weight": "emo_alpha"}
+_ITEM_KEYS = ("id", "text", "voice", "emo_audio", "emo_alpha", "emo_vector", "emo_mode", "use_emo_text", "emo_text",
+              "use_random") + GENERATION_KEYS + EMO_VECTOR_KEYS
+_ID_RE = re.compile(r"[^\w.-]")
+
+
+def parse_item(record: dict, index: int, base_dir: Optional[str] = None) -> dict:
+    """
+    Args:
+        record: an item of a manifest, see `parse_manifest`.
+        index: line number of the item, its default id.
+        base_dir: directory of the relative audio paths.
+
+    Returns:
+        {"id", "index", "text", "infer"}, "infer" being the keyword arguments of `IndexTTS2.infer` without the
+        output path.
+    """
+    record = {_ALIASES.get(key, key): value for key, value in record.items()}
+    unknown = sorted(set(record) - set(_ITEM_KEYS))
+    if unknown:
+        raise ValueError(f"unknown fields {unknown}")
+    if not record.get("text"):
+        raise ValueError("missing text")
+    if not record.get("voice"):
+        raise ValueError("missing voice")
+
+    def audio_path(path):
+        if path is None or base_dir is None or os.path.isabs(path):
+            return path
+        return os.path.join(base_dir, path)
+
+    kwargs = {
+        "spk_audio_prompt": audio_path(record["voice"]),
+        "emo_audio_prompt": audio_path(record.get("emo_audio")),
+        "emo_alpha": float(record.get("emo_alpha", 1.0)),
+        "emo_vector": record.get("emo_vector"),
+        "use_emo_text": bool(record.get("use_emo_text", False)),
+        "emo_text": record.get("emo_text") or None,
+        "use_random": bool(record.get("use_random", False)),
+    }
+    # emo_mode as in the web UI: 0 speaker, 1 emotion audio, 2 emotion vector, 3 emotion text
+    emo_mode = record.get("emo_mode")
+    if emo_mode is not None:
+        if emo_mode not in (0, 1, 2, 3):
+            raise ValueError(f"unknown emo_mode {emo_mode}")
+        if emo_mode != 1:
+            kwargs["emo_audio_prompt"] = None
+        if emo_mode == 2:
+            kwargs["emo_vector"] = kwargs["emo_vector"] or [float(record.get(key, 0)) for key in EMO_VECTOR_KEYS]
+            # the sliders of the web UI are normalized with the emotion bias, see `IndexTTS2.normalize_emo_vec`
+            kwargs["normalize_emo_vector"] = True
+        else:
+            kwargs["emo_vector"] = None
+        kwargs["use_emo_text"] = emo_mode == 3
+    if kwargs["emo_vector"] is not None and len(kwargs["emo_vector"]) != 8:
+        raise ValueError("emo_vector must have 8 values")
+    for path in (kwargs["spk_audio_prompt"], kwargs["emo_audio_prompt"]):
+        if path is not None and not os.path.exists(path):
+            raise ValueError(f"audio file {path} does not exist")
+    kwargs.update({key: record[key] for key in GENERATION_KEYS if key in record})
+    item_id = _ID_RE.sub("_", str(record.get("id", f"{index:05d}")))
+    return {"id": item_id, "index": index, "text": record["text"], "infer": kwargs}
+
+
+def parse_manifest(lines: Iterable[str], base_dir: Optional[str] = None) -> List[dict]:
+    """
+    Parse a JSONL manifest, one item per line: ``text`` and ``voice`` (or ``prompt_audio``), optionally ``id``,
+    ``emo_audio``, ``emo_alpha``, ``emo_vector``, ``emo_mode`` with ``emo_vec_1``..``emo_vec_8``, ``use_emo_text``,
+    ``emo_text``, ``use_random`` and the generation options of `GENERATION_KEYS`.
+
+    Returns:
+        the items of `parse_item`, in order. The invalid lines are items with an ``error`` instead of ``infer``, they
+        are reported in the status file and do not stop the batch.
+    """
+    items = []
+    ids = set()
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            item = parse_item(json.loads(line), index, base_dir)
+            if item["id"] in ids:
+                raise ValueError(f"duplicate id {item['id']}")
+        except (ValueError, TypeError) as e:
+            # json.JSONDecodeError is a ValueError
+            item = {"id": f"{index:05d}", "index": index, "error": str(e)}
+        ids.add(item["id"])
+        items.append(item)
+    return items
+
+
+def group_by_voice(items: List[dict]) -> List[dict]:
+    """
+    Order the items by voice and emotion audio, in the order of their first item, so that the consecutive items
+    reuse the prompt conditions cached by `IndexTTS2.encode_prompts`.
+    """
+    groups: Dict[tuple, List[dict]] = {}
+    for item in items:
+        kwargs = item["infer"]
+        groups.setdefault((kwargs["spk_audio_prompt"], kwargs["emo_audio_prompt"]), []).append(item)
+    return [item for group in groups.values() for item in group]
+
+
+def read_status(output_dir: str) -> Dict[str, dict]:
+    """
+    The last status of each item of the status file of ``output_dir``.
+    """
+    path = os.path.join(output_dir, STATUS_FILE)
+    status = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut by a crash
+                    continue
+                status[record["id"]] = record
+    return status
+
+
+def resolve_output_dir(root: str, output_dir: str) -> str:
+    """
+    The directory ``output_dir`` of a request, relative to ``root``.
+
+    Raises:
+        ValueError: if it is not inside ``root``, e.g. an absolute path or with '..'.
+    """
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, output_dir))
+    if os.path.isabs(output_dir) or path == root or os.path.commonpath([root, path]) != root:
+        raise ValueError(f"output directory {output_dir} is not a directory of the output root")
+    return path
+
+
+class BatchRunner:
+    """
+    Synthesize the items of a manifest into ``output_dir``, one audio file per item named after its id. The items
+    are run grouped by voice, and the status of every finished item is appended to ``status.jsonl``. Running the
+    same manifest again skips the items already done.
+    """
+
+    def __init__(self, tts, output_dir: str, audio_format: str = "wav", pipelined: bool = True,
+                 defaults: Optional[dict] = None, resume: bool = True):
+        """
+        Args:
+            tts: the `IndexTTS2` model.
+            audio_format: 'wav' or 'flac'.
+            pipelined: overlap the stages of the segments of the items, see `SegmentPipeline`.
+            defaults: keyword arguments of `IndexTTS2.infer` of the items that do not set them.
+            resume: skip the items done according to the status file.
+        """
+        if audio_format not in ("wav", "flac"):
+            raise ValueError(f"unknown audio format '{audio_format}', expected 'wav' or 'flac'")
+        self.tts = tts
+        self.output_dir = output_dir
+        self.audio_format = audio_format
+        self.pipelined = pipelined
+        self.defaults = defaults or {}
+        self.resume = resume
+        os.makedirs(output_dir, exist_ok=True)
+        self.status_path = os.path.join(output_dir, STATUS_FILE)
+
+    def _record(self, record: dict) -> dict:
+        with open(self.status_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return record
+
+    def _prepare(self, item: dict) -> dict:
+        # the keyword arguments of `IndexTTS2.infer` of an item, the audio is first written as wav
+        kwargs = dict(self.defaults, **item["infer"])
+        if kwargs.pop("normalize_emo_vector", False):
+            kwargs["emo_vector"] = self.tts.normalize_emo_vec(kwargs["emo_vector"], apply_bias=True)
+        return dict(kwargs, text=item["text"], output_path=os.path.join(self.output_dir, f"{item['id']}.wav"),
+                    pipelined=self.pipelined)
+
+    def _finish(self, item: dict, wav_path: str, start: float) -> dict:
+        import soundfile as sf
+        output = f"{item['id']}.{self.audio_format}"
+        audio_seconds = sf.info(wav_path).duration
+        if self.audio_format == "flac":
+            wav_to_flac(wav_path, os.path.join(self.output_dir, output))
+            os.remove(wav_path)
+        return {"id": item["id"], "index": item["index"], "status": "done", "output": output,
+                "seconds": round(time.perf_counter() - start, 3), "audio_seconds": round(audio_seconds, 3)}
+
+    def _failed(self, item: dict, error: Exception) -> dict:
+        print(f">> batch item {item['id']} failed: {error}")
+        return self._record({"id": item["id"], "index": item["index"], "status": "failed", "error": str(error)})
+
+    def _plan(self, items: List[dict]) -> Tuple[List[dict], List[dict]]:
+        # the records of the invalid items and of the items done by a previous run, and the items to synthesize
+        done = read_status(self.output_dir) if self.resume else {}
+        records, pending = [], []
+        for item in items:
+            previous = done.get(item["id"])
+            if "error" in item:
+                records.append(self._record({"id": item["id"], "index": item["index"], "status": "invalid",
+                                             "error": item["error"]}))
+            elif previous is not None and previous["status"] == "done" and \
+                    os.path.exists(os.path.join(self.output_dir, previous["output"])):
+                records.append(previous)
+            else:
+                pending.append(item)
+        return records, group_by_voice(pending)
+
+    def run(self, items: List[dict]) -> Iterator[dict]:
+        """
+        Yields:
+            the status record of each item as soon as it is finished: ``status`` is 'done', 'failed' or 'invalid',
+            with the ``output`` file name or the ``error``. The items done by a previous run are yielded first.
+        """
+        records, pending = self._plan(items)
+        yield from records
+        for item in pending:
+            print(f">> batch item {item['id']}: {item['text'][:50]}")
+            start = time.perf_counter()
+            try:
+                kwargs = self._prepare(item)
+                self.tts.infer(**kwargs)
+                record = self._record(self._finish(item, kwargs["output_path"], start))
+            except Exception as e:
+                record = self._failed(item, e)
+            yield record
+
+    async def arun(self, items: List[dict], infer: Callable[..., Awaitable]) -> AsyncIterator[dict]:
+        """
+        `run` for an event loop, each item being synthesized by ``infer``, a coroutine function with the arguments of
+        `IndexTTS2.infer`, e.g. the one of the HTTP server that goes through its CPU pipeline executor.
+        """
+        records, pending = self._plan(items)
+        for record in records:
+            yield record
+        for item in pending:
+            print(f">> batch item {item['id']}: {item['text'][:50]}")
+            start = time.perf_counter()
+            try:
+                kwargs = self._prepare(item)
+                await infer(**kwargs)
+                record = self._record(self._finish(item, kwargs["output_path"], start))
+            except Exception as e:
+                record = self._failed(item, e)
+            yield record
+
+
+class _ChunkBuffer(io.RawIOBase):
+    # a non-seekable file, zipfile then writes the sizes after the data of each member
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ZipStream:
+    """
+    A zip archive produced as a stream of chunks, one member after another, for a streamed HTTP response.
+    """
+
+    def __init__(self):
+        self._buffer = _ChunkBuffer()
+        # the audio files do not compress
+        self._zip = zipfile.ZipFile(self._buffer, "w", zipfile.ZIP_STORED)
+
+    def add_file(self, path: str, arcname: str) -> bytes:
+        self._zip.write(path, arcname)
+        return self._buffer.take()
+
+    def add_bytes(self, arcname: str, data: bytes) -> bytes:
+        self._zip.writestr(arcname, data)
+        return self._buffer.take()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._buffer.take()
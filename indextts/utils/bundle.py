@@ -0,0 +1,303 @@
+import json
+import os
+import struct
+import tempfile
+import threading
+from typing import Dict, List, Optional, Union
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+BUNDLE_VERSION = 1
+# safetensors header key of the bundle index
+INDEX_KEY = "indextts_bundle"
+# configs, tokenizers and other files are stored as uint8 tensors
+ASSET_PREFIX = "__asset__."
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+class BundleWriter:
+    """
+    Collect the state dicts (components) and files (assets) of a model bundle, then write them into one safetensors file.
+
+    Tensors are named ``<component>.<key>`` and assets ``__asset__.<name>``, the JSON index is stored in the
+    header metadata. Tensors sharing their memory (tied weights) are stored once.
+    """
+
+    def __init__(self):
+        self.tensors: Dict[str, torch.Tensor] = {}
+        self.components: Dict[str, int] = {}
+        self.assets: List[str] = []
+
+    def add_state_dict(self, component: str, state_dict: Dict[str, torch.Tensor]):
+        if component in self.components:
+            raise ValueError(f"Duplicate bundle component: {component}")
+        self.components[component] = len(state_dict)
+        for key, tensor in state_dict.items():
+            self.tensors[f"{component}.{key}"] = tensor
+
+    def add_asset(self, name: str, data: Union[bytes, str]):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.assets.append(name)
+        self.tensors[ASSET_PREFIX + name] = torch.frombuffer(bytearray(data), dtype=torch.uint8) if len(data) > 0 \
+            else torch.zeros(0, dtype=torch.uint8)
+
+    def add_asset_file(self, name: str, path: str):
+        with open(path, "rb") as f:
+            self.add_asset(name, f.read())
+
+    def save(self, output_path: str):
+        tensors, aliases, storages = {}, {}, {}
+        for name, tensor in self.tensors.items():
+            tensor = tensor.detach().cpu().contiguous()
+            if tensor.numel() > 0:
+                key = tensor.untyped_storage().data_ptr()
+                if key in storages:
+                    other = storages[key]
+                    if (tensor.data_ptr(), tensor.shape, tensor.dtype) == \
+                            (tensors[other].data_ptr(), tensors[other].shape, tensors[other].dtype):
+                        aliases[name] = other
+                        continue
+                    # overlapping views of one storage: safetensors requires separate buffers
+                    tensor = tensor.clone()
+                else:
+                    storages[key] = name
+            tensors[name] = tensor
+        index = {
+            "version": BUNDLE_VERSION,
+            "components": self.components,
+            "assets": self.assets,
+            "aliases": aliases,
+        }
+        save_file(tensors, output_path, metadata={"format": "pt", INDEX_KEY: json.dumps(index, ensure_ascii=False)})
+
+
+class ModelBundle:
+    """
+    Read-only access to a bundle written by `BundleWriter`. The file is memory-mapped, tensors are only read when
+    requested.
+    """
+
+    def __init__(self, path: str, zero_copy: bool = False):
+        """
+        Args:
+            zero_copy: return tensors viewing a private (copy-on-write) mapping of the whole file instead of copies.
+                Processes mapping the same file share its pages as long as the tensors are not written, so the
+                weights assigned to modules (`load_state_dict(assign=True)`) are in memory once for all processes.
+        """
+        self.path = path
+        self.zero_copy = zero_copy
+        self._file = safe_open(path, framework="pt", device="cpu")
+        metadata = self._file.metadata() or {}
+        if INDEX_KEY not in metadata:
+            raise ValueError(f"{path} is not an IndexTTS model bundle")
+        self.index = json.loads(metadata[INDEX_KEY])
+        if self.index["version"] != BUNDLE_VERSION:
+            raise ValueError(f"Unsupported bundle version {self.index['version']}, expected {BUNDLE_VERSION}")
+        self._keys = set(self._file.keys())
+        # the components are read by concurrent loader threads
+        self._lock = threading.Lock()
+        if zero_copy:
+            with open(path, "rb") as f:
+                header_size = struct.unpack("<Q", f.read(8))[0]
+                self._header = json.loads(f.read(header_size))
+            self._data_start = 8 + header_size
+            self._storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+
+    @property
+    def components(self) -> List[str]:
+        return list(self.index["components"])
+
+    @property
+    def assets(self) -> List[str]:
+        return list(self.index["assets"])
+
+    def has_component(self, component: str) -> bool:
+        return component in self.index["components"]
+
+    def tensor(self, name: str) -> torch.Tensor:
+        name = self.index["aliases"].get(name, name)
+        if self.zero_copy:
+            tensor = self._mapped_tensor(name)
+            if tensor is not None:
+                return tensor
+        with self._lock:
+            return self._file.get_tensor(name)
+
+    def _mapped_tensor(self, name: str) -> Optional[torch.Tensor]:
+        info = self._header[name]
+        dtype = SAFETENSORS_DTYPES.get(info["dtype"])
+        if dtype is None:
+            return None
+        tensor = torch.empty(0, dtype=dtype)
+        offset = self._data_start + info["data_offsets"][0]
+        # safetensors sorts the tensors by decreasing alignment, so the offsets are multiples of the element size
+        if offset % tensor.element_size() != 0:
+            return None
+        shape = info["shape"]
+        stride = [1] * len(shape)
+        for i in range(len(shape) - 2, -1, -1):
+            stride[i] = stride[i + 1] * shape[i + 1]
+        return tensor.set_(self._storage, offset // tensor.element_size(), shape, stride)
+
+    @property
+    def nbytes(self) -> int:
+        return os.path.getsize(self.path)
+
+    def state_dict(self, component: str) -> Dict[str, torch.Tensor]:
+        if not self.has_component(component):
+            raise KeyError(f"Component '{component}' is not in the bundle {self.path}, available: {self.components}")
+        prefix = component + "."
+        names = [name for name in self._keys if name.startswith(prefix)]
+        names += [name for name in self.index["aliases"] if name.startswith(prefix)]
+        return {name[len(prefix):]: self.tensor(name) for name in names}
+
+    def asset(self, name: str) -> bytes:
+        if name not in self.index["assets"]:
+            raise KeyError(f"Asset '{name}' is not in the bundle {self.path}")
+        return self.tensor(ASSET_PREFIX + name).numpy().tobytes()
+
+    def asset_text(self, name: str) -> str:
+        return self.asset(name).decode("utf-8")
+
+    def extract_assets(self, prefix: str, directory: str) -> List[str]:
+        """
+        Write the assets named ``<prefix><relative path>`` into ``directory``, for the loaders which only read files.
+        """
+        paths = []
+        for name in self.index["assets"]:
+            if not name.startswith(prefix):
+                continue
+            path = os.path.join(directory, name[len(prefix):])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(self.asset(name))
+            paths.append(path)
+        return paths
+
+
+def load_causal_lm(bundle: ModelBundle, component: str, dtype: torch.dtype, device, **tokenizer_kwargs):
+    """
+    Build the tokenizer and the causal LM bundled from a `transformers` model directory.
+
+    Returns:
+        the tokenizer and the model in eval mode.
+    """
+    from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+    from indextts.utils.model_loader import init_empty_weights
+
+    with tempfile.TemporaryDirectory() as directory:
+        bundle.extract_assets(component + "/", directory)
+        tokenizer = AutoTokenizer.from_pretrained(directory, **tokenizer_kwargs)
+        config = AutoConfig.from_pretrained(directory)
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+    model.load_state_dict(bundle.state_dict(component), strict=False, assign=True)
+    model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise RuntimeError(f"Missing weights of '{component}' in the bundle {bundle.path}: {missing}")
+    return tokenizer, model.to(device=device, dtype=dtype).eval()
+
+
+def write_indextts2_bundle(model_dir: str, cfg_path: str, output_path: str, include_qwen_emo: bool = True,
+                           bigvgan_name: Optional[str] = None):
+    """
+    Pack the IndexTTS2 checkpoints of ``model_dir`` and the Hugging Face hub dependencies (w2v-bert-2.0, the MaskGCT
+    semantic codec, CAMPPlus and BigVGAN) with their configs into one bundle, loaded by
+    `IndexTTS2(bundle_path=...)` without any other file or network access.
+    """
+    from huggingface_hub import hf_hub_download
+    from omegaconf import OmegaConf
+    from safetensors.torch import load_file
+    from transformers import SeamlessM4TFeatureExtractor, Wav2Vec2BertModel
+
+    from indextts.s2mel.modules.commons import MyModel
+    from indextts.utils.model_loader import init_empty_weights, load_state_dict_mmap
+
+    cfg = OmegaConf.load(cfg_path)
+    writer = BundleWriter()
+    writer.add_asset_file("config.yaml", cfg_path)
+    writer.add_asset_file("bpe.model", os.path.join(model_dir, cfg.dataset["bpe_model"]))
+
+    print(">> bundle: gpt")
+    checkpoint = load_state_dict_mmap(os.path.join(model_dir, cfg.gpt_checkpoint))
+    writer.add_state_dict("gpt", checkpoint["model"] if "model" in checkpoint else checkpoint)
+
+    print(">> bundle: s2mel")
+    # the same key filtering as `load_checkpoint2`, against the shapes of the model built on the meta device
+    with init_empty_weights():
+        s2mel = MyModel(cfg.s2mel, use_gpt_latent=True)
+    params = load_state_dict_mmap(os.path.join(model_dir, cfg.s2mel_checkpoint))["net"]
+    s2mel_state = {}
+    for key, module in s2mel.models.items():
+        if key not in params:
+            continue
+        model_state_dict = module.state_dict()
+        for k, v in params[key].items():
+            k = k[len("module."):] if k.startswith("module.") else k
+            if k in model_state_dict and v.shape == model_state_dict[k].shape:
+                s2mel_state[f"{key}.{k}"] = v
+    writer.add_state_dict("s2mel", s2mel_state)
+
+    print(">> bundle: w2v-bert-2.0")
+    feature_extractor = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
+    writer.add_asset("w2v-bert-2.0/preprocessor_config.json", feature_extractor.to_json_string())
+    semantic_model = Wav2Vec2BertModel.from_pretrained("facebook/w2v-bert-2.0")
+    writer.add_asset("w2v-bert-2.0/config.json", semantic_model.config.to_json_string())
+    writer.add_state_dict("semantic_model", semantic_model.state_dict())
+    stat_mean_var = torch.load(os.path.join(model_dir, cfg.w2v_stat), map_location="cpu")
+    writer.add_state_dict("w2v_stat", {"mean": stat_mean_var["mean"], "var": stat_mean_var["var"]})
+
+    print(">> bundle: semantic_codec")
+    writer.add_state_dict("semantic_codec", load_file(
+        hf_hub_download("amphion/MaskGCT", filename="semantic_codec/model.safetensors")))
+
+    print(">> bundle: campplus")
+    writer.add_state_dict("campplus", load_state_dict_mmap(
+        hf_hub_download("funasr/campplus", filename="campplus_cn_common.bin")))
+
+    print(">> bundle: bigvgan")
+    bigvgan_name = bigvgan_name or cfg.vocoder.name
+    if os.path.isdir(bigvgan_name):
+        bigvgan_config = os.path.join(bigvgan_name, "config.json")
+        bigvgan_generator = os.path.join(bigvgan_name, "bigvgan_generator.pt")
+    else:
+        bigvgan_config = hf_hub_download(bigvgan_name, filename="config.json")
+        bigvgan_generator = hf_hub_download(bigvgan_name, filename="bigvgan_generator.pt")
+    writer.add_asset_file("bigvgan/config.json", bigvgan_config)
+    writer.add_state_dict("bigvgan", torch.load(bigvgan_generator, map_location="cpu")["generator"])
+
+    print(">> bundle: emotion/speaker matrices")
+    writer.add_state_dict("matrices", {
+        "emo_matrix": torch.load(os.path.join(model_dir, cfg.emo_matrix), map_location="cpu"),
+        "spk_matrix": torch.load(os.path.join(model_dir, cfg.spk_matrix), map_location="cpu"),
+    })
+
+    if include_qwen_emo:
+        print(">> bundle: qwen_emo")
+        qwen_emo_dir = os.path.join(model_dir, cfg.qwen_emo_path)
+        qwen_state = {}
+        for root, _, files in os.walk(qwen_emo_dir):
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                if filename.startswith("."):
+                    continue
+                if filename.endswith(".safetensors"):
+                    qwen_state.update(load_file(path))
+                elif filename.endswith(".bin") and filename.startswith("pytorch_model"):
+                    qwen_state.update(torch.load(path, map_location="cpu"))
+                elif not filename.endswith((".pth", ".pt", ".index.json")):
+                    writer.add_asset_file("qwen_emo/" + os.path.relpath(path, qwen_emo_dir).replace(os.sep, "/"),
+                                          path)
+        writer.add_state_dict("qwen_emo", qwen_state)
+
+    print(f">> writing {len(writer.components)} components and {len(writer.assets)} assets to {output_path}")
+    writer.save(output_path)
+    return writer
@@ -22,10 +22,20 @@ import torch
 import yaml
 
 
-def load_checkpoint(model: torch.nn.Module, model_pth: str) -> dict:
-    checkpoint = torch.load(model_pth, map_location='cpu')
+def load_checkpoint(model: torch.nn.Module, model_pth: str, mmap: bool = False, assign: bool = False) -> dict:
+    """
+    Args:
+        mmap: memory-map the checkpoint instead of reading it into memory.
+        assign: assign the checkpoint tensors to the model instead of copying them, required for a model
+            built on the meta device (see `indextts.utils.model_loader.init_empty_weights`).
+    """
+    if mmap:
+        from indextts.utils.model_loader import load_state_dict_mmap
+        checkpoint = load_state_dict_mmap(model_pth)
+    else:
+        checkpoint = torch.load(model_pth, map_location='cpu')
     checkpoint = checkpoint['model'] if 'model' in checkpoint else checkpoint
-    model.load_state_dict(checkpoint, strict=True)
+    model.load_state_dict(checkpoint, strict=True, assign=assign)
     info_path = re.sub('.pth$', '.yaml', model_pth)
     configs = {}
     if os.path.exists(info_path):
@@ -0,0 +1,112 @@
+import math
+import os
+from typing import Dict, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+
+# padded lengths of the DiT sequences and of the vocoder mels, ~1.25x apart: at most ~25% of padding, and ~20
+# compiled variants of a model over the whole range of segment lengths
+DEFAULT_LENGTH_BUCKETS = (256, 320, 384, 448, 512, 640, 768, 896, 1024, 1280, 1536, 1792, 2048, 2560, 3072, 3584,
+                          4096, 5120, 6144, 7168, 8192)
+# log-mel value of silence (log of the BigVGAN mel clip value), padding the vocoder input with it only appends
+# silence after the end of the segment
+SILENCE_LOG_MEL = math.log(1e-5)
+
+
+def bucket_length(length: int, buckets: Sequence[int] = DEFAULT_LENGTH_BUCKETS) -> int:
+    """
+    The smallest bucket >= ``length``, or ``length`` itself beyond the largest bucket.
+    """
+    for bucket in buckets:
+        if bucket >= length:
+            return bucket
+    return length
+
+
+def pad_to_bucket(x: torch.Tensor, buckets: Sequence[int] = DEFAULT_LENGTH_BUCKETS, dim: int = -1,
+                  value: float = 0.0) -> Tuple[torch.Tensor, int]:
+    """
+    Pad ``x`` at the end of ``dim`` to its bucket length.
+
+    Returns:
+        (padded, length): the padded tensor and the original length of ``dim``.
+    """
+    length = x.size(dim)
+    padding = bucket_length(length, buckets) - length
+    if padding == 0:
+        return x, length
+    dim = dim % x.dim()
+    pad = [0, 0] * (x.dim() - dim - 1) + [0, padding]
+    return F.pad(x, pad, value=value), length
+
+
+def setup_compile_cache(cache_dir: Optional[str] = None, cache_size_limit: int = 64) -> str:
+    """
+    Persist the compiled artifacts of inductor (FX graph and AOT autograd caches) in ``cache_dir``, so that the
+    next runs load them instead of compiling again, and allow enough compiled variants per function for the buckets.
+
+    Returns:
+        the cache directory.
+    """
+    cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "indextts", "inductor")
+    os.makedirs(cache_dir, exist_ok=True)
+    # read by inductor when it first resolves its cache directory
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    import torch._dynamo
+    import torch._inductor.config
+    torch._inductor.config.fx_graph_cache = True
+    try:
+        import torch._functorch.config
+        if hasattr(torch._functorch.config, "enable_autograd_cache"):
+            torch._functorch.config.enable_autograd_cache = True
+    except ImportError:
+        pass
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, cache_size_limit)
+    if hasattr(torch._dynamo.config, "accumulated_cache_size_limit"):
+        torch._dynamo.config.accumulated_cache_size_limit = max(torch._dynamo.config.accumulated_cache_size_limit,
+                                                                cache_size_limit * 4)
+    return cache_dir
+
+
+class CompileStats:
+    """
+    Timings of the compiled stages by shape bucket: the first call of a bucket compiles it (or loads it from the
+    cache), the following calls are the steady state.
+    """
+
+    def __init__(self):
+        self.compile_time: Dict[str, float] = {}
+        self.steady_time: Dict[str, float] = {}
+        self.steady_calls: Dict[str, int] = {}
+        self.buckets: Dict[str, set] = {}
+
+    def record(self, stage: str, bucket, seconds: float):
+        buckets = self.buckets.setdefault(stage, set())
+        if bucket not in buckets:
+            buckets.add(bucket)
+            self.compile_time[stage] = self.compile_time.get(stage, 0.0) + seconds
+        else:
+            self.steady_time[stage] = self.steady_time.get(stage, 0.0) + seconds
+            self.steady_calls[stage] = self.steady_calls.get(stage, 0) + 1
+
+    def metrics(self) -> Dict[str, dict]:
+        return {
+            stage: {
+                "buckets": sorted(self.buckets[stage]),
+                "first_call_seconds": round(self.compile_time.get(stage, 0.0), 3),
+                "steady_calls": self.steady_calls.get(stage, 0),
+                "steady_mean_seconds": round(self.steady_time.get(stage, 0.0) / max(1, self.steady_calls.get(stage, 0)), 4),
+            }
+            for stage in self.buckets
+        }
+
+    def report(self) -> str:
+        lines = []
+        for stage, metrics in self.metrics().items():
+            lines.append(f">> compiled {stage}: {len(metrics['buckets'])} buckets, "
+                         f"{metrics['first_call_seconds']:.2f}s in first calls (compile or cache load), "
+                         f"{metrics['steady_calls']} steady calls of {metrics['steady_mean_seconds']:.3f}s")
+        return "\n".join(lines)
+
@@ -0,0 +1,285 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import torch
+
+# topology spec passed from the server parent process to its workers
+CPU_TOPOLOGY_ENV = "INDEXTTS_CPU_TOPOLOGY"
+
+# the stages of a request, in execution order
+STAGES = ("frontend", "prompt", "gpt", "s2mel", "vocoder")
+# stages without state shared between requests, the others must run one request at a time:
+# the GPT keeps the conditioning of the running request, the DiT its KV caches, and the prompt stage the prompt cache
+REENTRANT_STAGES = ("frontend", "vocoder")
+# share of the cores of each stage for the "auto" topology, roughly their share of the CPU time of a request
+AUTO_SHARES = {"prompt": 0.1, "gpt": 0.3, "s2mel": 0.4, "vocoder": 0.2}
+
+
+class StageSpec:
+    """
+    Thread budget of a stage: ``workers`` requests run concurrently in the stage, each on ``threads`` intra-op threads,
+    optionally pinned to ``cpus``.
+    """
+
+    def __init__(self, name: str, threads: int = 1, workers: int = 1, cpus: Optional[List[int]] = None):
+        if name not in STAGES:
+            raise ValueError(f"unknown stage '{name}', expected one of {STAGES}")
+        if threads < 1 or workers < 1:
+            raise ValueError(f"stage '{name}': threads and workers must be >= 1")
+        if workers > 1 and name not in REENTRANT_STAGES:
+            raise ValueError(f"stage '{name}' is not reentrant, only {REENTRANT_STAGES} can have several workers")
+        self.name = name
+        self.threads = threads
+        self.workers = workers
+        self.cpus = cpus
+
+    def __repr__(self):
+        spec = f"{self.name}:{self.threads}"
+        if self.workers > 1:
+            spec += f"x{self.workers}"
+        if self.cpus:
+            spec += "@" + "+".join(str(cpu) for cpu in self.cpus)
+        return spec
+
+
+def _parse_cpus(cpulist: str) -> List[int]:
+    cpus = []
+    for part in cpulist.split("+"):
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def auto_topology(num_cpus: Optional[int] = None) -> Dict[str, StageSpec]:
+    """
+    Split the cores between the stages by `AUTO_SHARES`, the text front end runs on one thread.
+    """
+    num_cpus = num_cpus or available_cpus()
+    topology = {"frontend": StageSpec("frontend", 1)}
+    for name, share in AUTO_SHARES.items():
+        topology[name] = StageSpec(name, max(1, int(num_cpus * share)))
+    return topology
+
+
+def parse_topology(spec: Optional[str]) -> Dict[str, StageSpec]:
+    """
+    Parse a topology spec, comma separated ``stage:threads[xworkers][@cpus]`` items, e.g.::
+
+        frontend:1,prompt:2,gpt:4,s2mel:6,vocoder:2x2@12-15
+
+    ``cpus`` is a list of cores joined by ``+``, with ranges, e.g. ``0-3+8``. The stages not in the spec get one
+    thread, ``auto`` (or an empty spec) splits the available cores by `auto_topology`.
+    """
+    if not spec or spec.strip() == "auto":
+        return auto_topology()
+    topology = {name: StageSpec(name) for name in STAGES}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            name, budget = item.split(":", 1)
+            cpus = None
+            if "@" in budget:
+                budget, cpulist = budget.split("@", 1)
+                cpus = _parse_cpus(cpulist)
+            threads, _, workers = budget.partition("x")
+            topology[name.strip()] = StageSpec(name.strip(), int(threads), int(workers or 1), cpus)
+        except ValueError as e:
+            raise ValueError(f"invalid topology item '{item}': {e}") from e
+    return topology
+
+
+def set_thread_budget(threads: int, cpus: Optional[List[int]] = None):
+    """
+    Set the intra-op thread count of the calling thread, and optionally pin it to ``cpus``.
+    """
+    # the OpenMP/MKL thread count is per calling thread; query it first so that the lazy per-thread
+    # initialization (from the process-wide value last set by any thread) does not overwrite the budget later
+    torch.get_num_threads()
+    torch.set_num_threads(threads)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        # pid 0 is the calling thread, the OpenMP threads it spawns inherit its affinity
+        os.sched_setaffinity(0, cpus)
+
+
+class _Request:
+    def __init__(self, kwargs: dict):
+        self.kwargs = kwargs
+        self.future = Future()
+        self.start_time = time.perf_counter()
+        self.stats = None
+        self.segments = None
+        self.options = None
+        self.conditions = None
+        # (seg_idx, sent, key, seed) of the segments not found in the segment cache, and the waveforms of the others
+        self.pending = None
+        self.wavs = {}
+        self.outputs = None
+
+
+class CPUPipelineExecutor:
+    """
+    Run `IndexTTS2.infer` requests through per-stage thread pools: each stage has its own intra-op thread budget,
+    and different requests run in different stages at the same time, e.g. the vocoder of a request runs while the
+    GPT decodes the next one. The throughput is bounded by the slowest stage instead of the sum of the stages.
+
+    Usage::
+
+        executor = CPUPipelineExecutor(tts, "gpt:4,s2mel:8,vocoder:4")
+        future = executor.submit(spk_audio_prompt="voice.wav", text="...", output_path="out.wav")
+        future.result()
+    """
+
+    def __init__(self, tts, topology=None):
+        """
+        Args:
+            tts: the `IndexTTS2` model.
+            topology: a spec for `parse_topology`, or a dict of `StageSpec` by stage.
+        """
+        if tts.device != "cpu":
+            print(f">> CPU execution planner on device {tts.device}: the thread budgets only apply to CPU stages")
+        self.tts = tts
+        self.topology = topology if isinstance(topology, dict) else parse_topology(topology)
+        self.pools = {}
+        for name in STAGES:
+            stage = self.topology[name]
+            self.pools[name] = ThreadPoolExecutor(max_workers=stage.workers,
+                                                  thread_name_prefix=f"indextts-{name}",
+                                                  initializer=set_thread_budget,
+                                                  initargs=(stage.threads, stage.cpus))
+        self._lock = threading.Lock()
+        self._busy = {name: 0.0 for name in STAGES}
+        self._completed = {name: 0 for name in STAGES}
+        self._pending = {name: 0 for name in STAGES}
+        print(">> CPU execution topology: " + ",".join(repr(self.topology[name]) for name in STAGES))
+
+    def submit(self, spk_audio_prompt, text, output_path, **infer_kwargs) -> Future:
+        """
+        Queue a request, the arguments are the ones of `IndexTTS2.infer`, except ``session``: the incremental
+        synthesis of a document runs its requests one after another, with `IndexTTS2.infer`.
+
+        Returns:
+            a future of the result of `infer`.
+        """
+        if infer_kwargs.get("session") is not None:
+            raise ValueError("the CPU pipeline executor does not support incremental sessions, use IndexTTS2.infer")
+        request = _Request(dict(infer_kwargs, spk_audio_prompt=spk_audio_prompt, text=text, output_path=output_path))
+        self._dispatch(0, request)
+        return request.future
+
+    def _dispatch(self, index: int, request: _Request):
+        name = STAGES[index]
+        with self._lock:
+            self._pending[name] += 1
+        self.pools[name].submit(self._run_stage, index, request)
+
+    def _run_stage(self, index: int, request: _Request):
+        name = STAGES[index]
+        start = time.perf_counter()
+        if index == 0 and not request.future.set_running_or_notify_cancel():
+            # cancelled while queued
+            with self._lock:
+                self._pending[name] -= 1
+            return
+        try:
+            result = getattr(self, f"_{name}")(request)
+        except BaseException as e:
+            request.future.set_exception(e)
+            return
+        finally:
+            with self._lock:
+                self._pending[name] -= 1
+                self._completed[name] += 1
+                self._busy[name] += time.perf_counter() - start
+        if index + 1 < len(STAGES):
+            self._dispatch(index + 1, request)
+        else:
+            request.future.set_result(result)
+
+    def _frontend(self, request: _Request):
+        kwargs = request.kwargs
+        max_text_tokens_per_segment = kwargs.pop("max_text_tokens_per_segment", 120)
+        request.segments = self.tts.text_frontend(kwargs["text"], max_text_tokens_per_segment,
+                                                  kwargs.get("verbose", False),
+                                                  balanced=kwargs.get("balanced_segments", False))
+        generation_kwargs = {k: v for k, v in kwargs.items() if k not in _INFER_ARGS}
+        request.options = self.tts.generation_options(max_text_tokens_per_segment, **generation_kwargs)
+        request.stats = self.tts.new_stats()
+
+    def _prompt(self, request: _Request):
+        kwargs = request.kwargs
+        emo_audio_prompt, emo_alpha, emo_vector = self.tts.prepare_emotion(
+            kwargs["text"], kwargs["spk_audio_prompt"], kwargs.get("emo_audio_prompt"), kwargs.get("emo_alpha", 1.0),
+            kwargs.get("emo_vector"), kwargs.get("use_emo_text", False), kwargs.get("emo_text")
+        )
+        request.conditions = self.tts.encode_prompts(kwargs["spk_audio_prompt"], emo_audio_prompt, emo_alpha,
+                                                     emo_vector, kwargs.get("use_random", False),
+                                                     kwargs.get("verbose", False))
+
+    def _gpt(self, request: _Request):
+        verbose = request.kwargs.get("verbose", False)
+        deterministic = request.kwargs.get("deterministic")
+        if deterministic is None:
+            deterministic = self.tts.segment_cache is not None
+        # the cached segments are taken from the segment cache as in `IndexTTS2.infer`, with the same seeds
+        request.pending = list(self.tts._uncached_segments(enumerate(request.segments), request.conditions,
+                                                           request.options, deterministic, request.wavs,
+                                                           request.stats))
+        request.outputs = [self.tts.generate_segment(sent, request.conditions, request.options, request.stats, verbose,
+                                                     seed)
+                           for _, sent, _, seed in request.pending]
+
+    def _s2mel(self, request: _Request):
+        request.outputs = [self.tts.synthesize_mel(codes, code_lens, latent, request.conditions, request.stats, seed)
+                           for (codes, code_lens, latent), (_, _, _, seed) in zip(request.outputs, request.pending)]
+
+    def _vocoder(self, request: _Request):
+        verbose = request.kwargs.get("verbose", False)
+        for vc_target, (seg_idx, _, key, _) in zip(request.outputs, request.pending):
+            request.wavs[seg_idx] = self.tts.vocode(vc_target, request.stats, verbose)
+            self.tts._store_segment(key, request.wavs[seg_idx])
+        wavs = [request.wavs[seg_idx] for seg_idx in range(len(request.segments))]
+        request.outputs = None
+        return self.tts.save_output(wavs, request.kwargs["output_path"], request.stats, request.start_time,
+                                    time.perf_counter(), request.kwargs.get("interval_silence", 200),
+                                    request.options["use_mel_budget"])
+
+    def metrics(self) -> Dict[str, dict]:
+        """
+        Per stage: thread budget, queued or running requests, completed requests and busy seconds. The stage with
+        the most busy time is the bottleneck and should get more threads.
+        """
+        with self._lock:
+            return {
+                name: {
+                    "threads": self.topology[name].threads,
+                    "workers": self.topology[name].workers,
+                    "pending": self._pending[name],
+                    "completed": self._completed[name],
+                    "busy_seconds": round(self._busy[name], 3),
+                }
+                for name in STAGES
+            }
+
+    def shutdown(self, wait: bool = True):
+        for name in STAGES:
+            self.pools[name].shutdown(wait=wait)
+
+
+# the `infer` arguments which are not generation kwargs
+_INFER_ARGS = ("spk_audio_prompt", "text", "output_path", "emo_audio_prompt", "emo_alpha", "emo_vector",
+               "use_emo_text", "emo_text", "use_random", "interval_silence", "verbose", "pipelined",
+               "balanced_segments", "deterministic", "session")
@@ -0,0 +1,98 @@
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional
+
+from indextts.utils.front import TextNormalizer, TextTokenizer
+
+# paragraphs: blank lines or line breaks
+_PARAGRAPH_RE = re.compile(r"(?<=\n)")
+
+# tokenizer of a worker process
+_worker_tokenizer: Optional[TextTokenizer] = None
+
+
+def _init_worker(vocab_file: Optional[str], model_proto: Optional[bytes]):
+    global _worker_tokenizer
+    # the normalizer FSTs are loaded once per worker process
+    _worker_tokenizer = TextTokenizer(vocab_file, TextNormalizer(), model_proto=model_proto)
+
+
+def _tokenize_chunk(chunk: str) -> List[str]:
+    return _worker_tokenizer.tokenize(chunk)
+
+
+def split_chunks(text: str, chunk_chars: int = 1000) -> List[str]:
+    """
+    Split ``text`` at its line breaks, then at its sentence boundaries, into chunks of about ``chunk_chars``
+    characters at most: the chunks joined back are ``text``.
+    """
+    chunks = []
+    current = ""
+    for paragraph in _PARAGRAPH_RE.split(text):
+        pieces = [paragraph] if len(paragraph) <= chunk_chars else TextNormalizer.split_sentences(paragraph)
+        for piece in pieces:
+            if current and len(current) + len(piece) > chunk_chars:
+                chunks.append(current)
+                current = ""
+            current += piece
+    if current.strip():
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+class DocumentFrontend:
+    """
+    Text front end of long documents: the text is cut into chunks at paragraph and sentence boundaries, the chunks
+    are normalized and tokenized in a pool of processes (the normalizer FSTs hold the GIL), and the segments are
+    produced in order as soon as the chunks before them are done, so that the synthesis of the first segments
+    starts while the rest of the document is still being normalized.
+
+    The workers are spawned: each one imports the ``__main__`` module of the parent again as ``__mp_main__``, so a
+    script creating a `DocumentFrontend` (e.g. through `IndexTTS2(frontend_workers=...)`) must parse its arguments
+    and load its models under ``if __name__ == "__main__":``, not at import time.
+    """
+
+    def __init__(self, vocab_file: Optional[str] = None, model_proto: Optional[bytes] = None, workers: int = 2,
+                 chunk_chars: int = 1000, min_chars: int = 2000):
+        """
+        Args:
+            vocab_file: path to the sentencepiece model.
+            model_proto: the serialized sentencepiece model, used instead of `vocab_file`.
+            workers: processes of the pool, each loads its own normalizers.
+            chunk_chars: characters of text normalized by a task of the pool.
+            min_chars: texts shorter than this are not worth the pool, see `accepts`.
+        """
+        self.chunk_chars = chunk_chars
+        self.min_chars = min_chars
+        # spawn: the parent holds CUDA and OpenMP state that must not be forked
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker, initargs=(vocab_file, model_proto))
+
+    def accepts(self, text: str) -> bool:
+        return len(text) >= self.min_chars
+
+    def segments(self, text: str, split_segments, max_text_tokens_per_segment: int = 120) -> Iterator[List[str]]:
+        """
+        Args:
+            split_segments: the segmenter of the tokens of a chunk, `TextTokenizer.split_segments`.
+
+        Yields:
+            the segments of sentencepiece tokens of ``text``, in order. The short segments at the end of a chunk are
+            merged with the start of the next one, as `split_segments` does within a chunk.
+        """
+        pending = None
+        # `map` submits all the chunks at once and returns their results in order
+        for tokens in self.executor.map(_tokenize_chunk, split_chunks(text, self.chunk_chars)):
+            for segment in split_segments(tokens, max_text_tokens_per_segment):
+                if pending is not None and len(pending) + len(segment) <= max_text_tokens_per_segment:
+                    pending = pending + segment
+                    continue
+                if pending is not None:
+                    yield pending
+                pending = segment
+        if pending is not None:
+            yield pending
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,108 @@
+from typing import Optional
+
+import torch
+from transformers import LogitsProcessor
+
+
+class EarlyStopLogitsProcessor(LogitsProcessor):
+    """
+    Force ``stop_token`` for rows whose generation has degenerated, so runaway rows don't
+    keep decoding until ``max_length``. Every check is a tensor op on the scores' device,
+    there is no host synchronization inside the decode loop.
+
+    A row is treated as degenerate when any of the following holds:
+        - the last ``max_silent_tokens`` generated tokens are all ``silent_token``
+        - the last ``max(p * ngram_repeats, min_loop_tokens)`` generated tokens repeat with
+          a period ``p`` in ``[2, max_ngram_size]`` and are not all the same token (a run of a
+          single token, e.g. a pause, is left to ``max_silent_tokens``)
+        - the number of generated tokens reached the row's ``length_budget``
+
+    Works for greedy, sampling and beam search, since the forced row simply emits the stop token.
+    """
+
+    def __init__(
+        self,
+        stop_token: int,
+        prompt_length: int,
+        silent_token: int = 52,
+        max_silent_tokens: int = 100,
+        max_ngram_size: int = 10,
+        ngram_repeats: int = 4,
+        min_loop_tokens: int = 40,
+        length_budget: Optional[torch.Tensor] = None,
+        filter_value: float = -float("Inf"),
+    ):
+        """
+        Args:
+            stop_token: the token to force for degenerate rows (``stop_mel_token``).
+            prompt_length: length of the prompt part of ``input_ids``, these tokens are never checked.
+            silent_token: the mel code of silence.
+            max_silent_tokens: stop after this many consecutive ``silent_token``, ``<= 0`` to disable.
+            max_ngram_size: the longest loop period to detect, ``< 2`` to disable loop detection.
+            ngram_repeats: how many times a period must repeat to be considered a loop.
+            min_loop_tokens: minimal span of a loop, prevents short natural repetitions from stopping.
+            length_budget: (b,) the maximal number of generated tokens per row, ``None`` to disable.
+        """
+        self.stop_token = stop_token
+        self.prompt_length = prompt_length
+        self.silent_token = silent_token
+        self.max_silent_tokens = max_silent_tokens
+        self.max_ngram_size = max_ngram_size
+        self.ngram_repeats = ngram_repeats
+        self.min_loop_tokens = min_loop_tokens
+        self.length_budget = length_budget
+        self.filter_value = filter_value
+
+    def degenerate_mask(self, input_ids: torch.LongTensor) -> torch.BoolTensor:
+        """
+        Returns: (b,) bool tensor, ``True`` for the rows to stop.
+        """
+        generated = input_ids[:, self.prompt_length:]
+        gen_len = generated.shape[1]
+        mask = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        if gen_len == 0:
+            return mask
+        if 0 < self.max_silent_tokens <= gen_len:
+            mask |= (generated[:, -self.max_silent_tokens:] == self.silent_token).all(dim=-1)
+        for period in range(2, self.max_ngram_size + 1):
+            window = max(period * self.ngram_repeats, self.min_loop_tokens)
+            if window > gen_len:
+                break
+            tail = generated[:, -window:]
+            varied = (tail != tail[:, :1]).any(dim=-1)
+            mask |= varied & (tail[:, period:] == tail[:, :-period]).all(dim=-1)
+        if self.length_budget is not None:
+            budget = self.length_budget
+            if budget.shape[0] != input_ids.shape[0]:
+                # expanded by `num_beams` or `num_return_sequences`
+                budget = budget.repeat_interleave(input_ids.shape[0] // budget.shape[0], dim=0)
+            mask |= budget.to(input_ids.device) <= gen_len
+        return mask
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        mask = self.degenerate_mask(input_ids).unsqueeze(-1)
+        forced = torch.full_like(scores, self.filter_value)
+        forced[:, self.stop_token] = 0
+        return torch.where(mask, forced, scores)
+
+
+def build_early_stop_processor(early_stop, stop_token: int, prompt_length: int, text_inputs: torch.Tensor,
+                               start_text_token: int, stop_text_token: int) -> Optional[EarlyStopLogitsProcessor]:
+    """
+    Build the ``EarlyStopLogitsProcessor`` from the ``early_stop`` argument of ``inference_speech``.
+
+    Args:
+        early_stop: ``False``/``None`` to disable, ``True`` for defaults, or a dict of
+            ``EarlyStopLogitsProcessor`` kwargs. The dict may also contain ``max_tokens_per_text_token``
+            and ``min_length_budget`` to derive ``length_budget`` from the text lengths.
+        text_inputs: (b, L) the padded text tokens.
+    """
+    if not early_stop:
+        return None
+    kwargs = dict(early_stop) if isinstance(early_stop, dict) else {}
+    max_tokens_per_text_token = kwargs.pop("max_tokens_per_text_token", None)
+    min_length_budget = kwargs.pop("min_length_budget", 0)
+    if max_tokens_per_text_token is not None and kwargs.get("length_budget") is None:
+        text_lengths = ((text_inputs != start_text_token) & (text_inputs != stop_text_token)).sum(dim=-1)
+        kwargs["length_budget"] = text_lengths * max_tokens_per_text_token + min_length_budget
+    return EarlyStopLogitsProcessor(stop_token, prompt_length, **kwargs)
@@ -48,3 +48,112 @@ class MelSpectrogramFeatures(FeatureExtractor):
         mel = self.mel_spec(audio)
         mel = safe_log(mel)
         return mel
+
+
+class SeamlessM4TFbankFeatures(FeatureExtractor):
+    """
+    Torch port of the `SeamlessM4TFeatureExtractor` of transformers, the input features of w2v-bert: Kaldi
+    log-mel fbank, normalized per utterance and mel bin, consecutive frames stacked by ``stride``. Runs on the
+    device of the module and on a padded batch.
+    """
+
+    def __init__(self, num_mel_bins=80, sampling_rate=16000, stride=2, padding_value=0.0,
+                 frame_length=400, hop_length=160, fft_length=512, preemphasis=0.97, mel_floor=1.192092955078125e-07):
+        super().__init__()
+        self.num_mel_bins = num_mel_bins
+        self.sampling_rate = sampling_rate
+        self.stride = stride
+        self.padding_value = padding_value
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.fft_length = fft_length
+        self.preemphasis = preemphasis
+        self.mel_floor = mel_floor
+        # povey window of Kaldi
+        self.register_buffer("window", torch.hann_window(frame_length, periodic=False, dtype=torch.float64).pow(0.85)
+                             .float(), persistent=False)
+        self.register_buffer("mel_filters", self._kaldi_mel_filters().float(), persistent=False)
+
+    @classmethod
+    def from_hf(cls, feature_extractor):
+        """
+        Build from the configuration of a transformers `SeamlessM4TFeatureExtractor`.
+        """
+        return cls(num_mel_bins=feature_extractor.num_mel_bins, sampling_rate=feature_extractor.sampling_rate,
+                   stride=feature_extractor.stride, padding_value=feature_extractor.padding_value)
+
+    def _kaldi_mel_filters(self):
+        # triangular filters in the Kaldi mel scale from 20 Hz to the Nyquist frequency, (fft_length // 2 + 1, mels)
+        def hertz_to_mel(freq):
+            return 1127.0 * torch.log(1.0 + freq / 700.0)
+
+        num_frequency_bins = self.fft_length // 2 + 1
+        mel_freqs = torch.linspace(float(hertz_to_mel(torch.tensor(20.0, dtype=torch.float64))),
+                                   float(hertz_to_mel(torch.tensor(self.sampling_rate // 2, dtype=torch.float64))),
+                                   self.num_mel_bins + 2, dtype=torch.float64)
+        fft_bin_width = self.sampling_rate / ((num_frequency_bins - 1) * 2)
+        fft_freqs = hertz_to_mel(fft_bin_width * torch.arange(num_frequency_bins, dtype=torch.float64))
+        filter_diff = torch.diff(mel_freqs)
+        slopes = mel_freqs.unsqueeze(0) - fft_freqs.unsqueeze(1)
+        down_slopes = -slopes[:, :-2] / filter_diff[:-1]
+        up_slopes = slopes[:, 2:] / filter_diff[1:]
+        return torch.clamp(torch.minimum(down_slopes, up_slopes), min=0.0)
+
+    def fbank(self, audio: torch.Tensor) -> torch.Tensor:
+        """
+        Log-mel fbank of the frames of ``audio`` (B, samples) in [-1, 1], without edge padding: (B, frames, mels).
+        """
+        frames = (audio.float() * 32768.0).unfold(-1, self.frame_length, self.hop_length)
+        frames = frames - frames.mean(dim=-1, keepdim=True)
+        frames = torch.cat([frames[..., :1] * (1.0 - self.preemphasis),
+                            frames[..., 1:] - self.preemphasis * frames[..., :-1]], dim=-1)
+        frames = frames * self.window
+        spectrum = torch.fft.rfft(frames, n=self.fft_length).abs().pow(2.0)
+        return torch.log(torch.clamp(spectrum @ self.mel_filters, min=self.mel_floor))
+
+    def forward(self, audio, lengths=None, **kwargs):
+        """
+        Args:
+            audio: waveform at ``sampling_rate``, (samples,), (B, samples) padded at the end, or a list of 1-D tensors.
+            lengths: number of samples of every waveform of a padded batch, all the samples by default.
+
+        Returns:
+            (input_features, attention_mask): (B, frames // stride, mels * stride) float features and the
+            (B, frames // stride) int32 mask, as `SeamlessM4TFeatureExtractor` with ``return_tensors="pt"``.
+        """
+        device = self.mel_filters.device
+        if isinstance(audio, (list, tuple)):
+            lengths = torch.tensor([len(wav) for wav in audio])
+            audio = torch.nn.utils.rnn.pad_sequence([torch.as_tensor(wav).reshape(-1) for wav in audio],
+                                                    batch_first=True)
+        audio = torch.as_tensor(audio).to(device)
+        if audio.dim() == 1:
+            audio = audio.unsqueeze(0)
+        batch_size = audio.size(0)
+        if lengths is None:
+            lengths = torch.full((batch_size,), audio.size(1), dtype=torch.long)
+        lengths = torch.as_tensor(lengths, device=device).long()
+        if audio.size(1) < self.frame_length:
+            audio = torch.nn.functional.pad(audio, (0, self.frame_length - audio.size(1)))
+        num_frames = torch.clamp((lengths - self.frame_length) // self.hop_length + 1, min=0)
+        max_frames = int(num_frames.max())
+
+        features = self.fbank(audio)[:, :max_frames]
+        mask = torch.arange(max_frames, device=device).unsqueeze(0) < num_frames.unsqueeze(1)
+        # per utterance and mel bin over the valid frames, unbiased variance
+        valid = mask.unsqueeze(-1).to(features.dtype)
+        counts = num_frames.to(features.dtype).view(-1, 1, 1)
+        mean = (features * valid).sum(dim=1, keepdim=True) / counts.clamp(min=1)
+        var = ((features - mean).pow(2) * valid).sum(dim=1, keepdim=True) / (counts - 1).clamp(min=1)
+        features = (features - mean) / torch.sqrt(var + 1e-7)
+        features = features.masked_fill(~mask.unsqueeze(-1), self.padding_value)
+
+        # padded to an even number of frames (``pad_to_multiple_of=2``), then consecutive frames stacked
+        padded_frames = (max_frames + 1) // 2 * 2
+        features = torch.nn.functional.pad(features, (0, 0, 0, padded_frames - max_frames), value=self.padding_value)
+        mask = torch.nn.functional.pad(mask, (0, padded_frames - max_frames), value=False)
+        padded_frames -= padded_frames % self.stride
+        input_features = features[:, :padded_frames].reshape(batch_size, padded_frames // self.stride,
+                                                             self.num_mel_bins * self.stride)
+        attention_mask = mask[:, 1:padded_frames:self.stride].to(torch.int32)
+        return input_features, attention_mask
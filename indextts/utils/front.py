@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
+import math
 import os
+import threading
 import traceback
 import re
-from typing import List, Union, overload
+from collections import OrderedDict
+from typing import List, Optional, Union, overload
 import warnings
 from indextts.utils.common import tokenize_by_CJK_char, de_tokenized_by_CJK_char
 from sentencepiece import SentencePieceProcessor
@@ -53,11 +56,13 @@ class TextNormalizer:
             "$": ".",
             **self.char_rep_map,
         }
+        # 替换表的正则只编译一次
+        self.char_rep_pattern = re.compile("|".join(re.escape(p) for p in self.char_rep_map.keys()))
+        self.zh_char_rep_pattern = re.compile("|".join(re.escape(p) for p in self.zh_char_rep_map.keys()))
 
     def match_email(self, email):
         # 正则表达式匹配邮箱格式：数字英文@数字英文.英文
-        pattern = r"^[a-zA-Z0-9]+@[a-zA-Z0-9]+\.[a-zA-Z]+$"
-        return re.match(pattern, email) is not None
+        return TextNormalizer.EMAIL_RE.match(email) is not None
 
     PINYIN_TONE_PATTERN = r"(?<![a-z])((?:[bpmfdtnlgkhjqxzcsryw]|[zcs]h)?(?:[aeiouüv]|[ae]i|u[aio]|ao|ou|i[aue]|[uüv]e|[uvü]ang?|uai|[aeiuv]n|[aeio]ng|ia[no]|i[ao]ng)|ng|er)([1-5])"
     """
@@ -74,17 +79,34 @@ class TextNormalizer:
     # 匹配常见英语缩写 's，仅用于替换为 is，不匹配所有 's
     ENGLISH_CONTRACTION_PATTERN = r"(what|where|who|which|how|t?here|it|s?he|that|this)'s"
 
+    # 预编译的正则
+    PINYIN_TONE_RE = re.compile(PINYIN_TONE_PATTERN, re.IGNORECASE)
+    NAME_RE = re.compile(NAME_PATTERN, re.IGNORECASE)
+    ENGLISH_CONTRACTION_RE = re.compile(ENGLISH_CONTRACTION_PATTERN, re.IGNORECASE)
+    EMAIL_RE = re.compile(r"^[a-zA-Z0-9]+@[a-zA-Z0-9]+\.[a-zA-Z]+$")
+    CHINESE_RE = re.compile(r"[\u4e00-\u9fff]")
+    ALPHA_RE = re.compile(r"[a-zA-Z]")
+    JQX_PINYIN_RE = re.compile(r"([jqx])[uü](n|e|an)*(\d)", re.IGNORECASE)
+    # 句子: 到句末标点(及其后的引号、括号)为止, 英文句号需后接空白, 不拆分小数
+    SENTENCE_RE = re.compile(r".+?(?:[。！？!?；\n]+|\.+(?=\s)|$)[”’\"'」』）)\]]*", re.DOTALL)
 
     def use_chinese(self, s):
-        has_chinese = bool(re.search(r"[\u4e00-\u9fff]", s))
-        has_alpha = bool(re.search(r"[a-zA-Z]", s))
+        has_chinese = TextNormalizer.CHINESE_RE.search(s) is not None
+        has_alpha = TextNormalizer.ALPHA_RE.search(s) is not None
         is_email = self.match_email(s)
         if has_chinese or not has_alpha or is_email:
             return True
 
-        has_pinyin = bool(re.search(TextNormalizer.PINYIN_TONE_PATTERN, s, re.IGNORECASE))
+        has_pinyin = TextNormalizer.PINYIN_TONE_RE.search(s) is not None
         return has_pinyin
 
+    @staticmethod
+    def split_sentences(text: str) -> List[str]:
+        """
+        Split ``text`` after its sentence-final punctuation, the sentences joined back are ``text``.
+        """
+        return TextNormalizer.SENTENCE_RE.findall(text)
+
     def load(self):
         # print(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
         # sys.path.append(model_dir)
@@ -110,12 +132,18 @@ class TextNormalizer:
             )
             self.en_normalizer = NormalizerEn(overwrite_cache=False)
 
-    def normalize(self, text: str) -> str:
+    def normalize(self, text: str, use_chinese: Optional[bool] = None) -> str:
+        """
+        Args:
+            use_chinese: use the Chinese normalizer, by default decided from ``text`` by `use_chinese`.
+        """
         if not self.zh_normalizer or not self.en_normalizer:
             print("Error, text normalizer is not initialized !!!")
             return ""
-        if self.use_chinese(text):
-            text = re.sub(TextNormalizer.ENGLISH_CONTRACTION_PATTERN, r"\1 is", text, flags=re.IGNORECASE)
+        if use_chinese is None:
+            use_chinese = self.use_chinese(text)
+        if use_chinese:
+            text = TextNormalizer.ENGLISH_CONTRACTION_RE.sub(r"\1 is", text)
             replaced_text, pinyin_list = self.save_pinyin_tones(text.rstrip())
             
             replaced_text, original_name_list = self.save_names(replaced_text)
@@ -128,17 +156,15 @@ class TextNormalizer:
             result = self.restore_names(result, original_name_list)
             # 恢复拼音声调
             result = self.restore_pinyin_tones(result, pinyin_list)
-            pattern = re.compile("|".join(re.escape(p) for p in self.zh_char_rep_map.keys()))
-            result = pattern.sub(lambda x: self.zh_char_rep_map[x.group()], result)
+            result = self.zh_char_rep_pattern.sub(lambda x: self.zh_char_rep_map[x.group()], result)
         else:
             try:
-                text = re.sub(TextNormalizer.ENGLISH_CONTRACTION_PATTERN, r"\1 is", text, flags=re.IGNORECASE)
+                text = TextNormalizer.ENGLISH_CONTRACTION_RE.sub(r"\1 is", text)
                 result = self.en_normalizer.normalize(text)
             except Exception:
                 result = text
                 print(traceback.format_exc())
-            pattern = re.compile("|".join(re.escape(p) for p in self.char_rep_map.keys()))
-            result = pattern.sub(lambda x: self.char_rep_map[x.group()], result)
+            result = self.char_rep_pattern.sub(lambda x: self.char_rep_map[x.group()], result)
         return result
 
     def correct_pinyin(self, pinyin: str):
@@ -149,9 +175,8 @@ class TextNormalizer:
         if pinyin[0] not in "jqxJQX":
             return pinyin
         # 匹配 jqx 的韵母为 u/ü 的拼音
-        pattern = r"([jqx])[uü](n|e|an)*(\d)"
         repl = r"\g<1>v\g<2>\g<3>"
-        pinyin = re.sub(pattern, repl, pinyin, flags=re.IGNORECASE)
+        pinyin = TextNormalizer.JQX_PINYIN_RE.sub(repl, pinyin)
         return pinyin.upper()
 
     def save_names(self, original_text):
@@ -160,8 +185,7 @@ class TextNormalizer:
         例如：克里斯托弗·诺兰 -> <n_a>
         """
         # 人名
-        name_pattern = re.compile(TextNormalizer.NAME_PATTERN, re.IGNORECASE)
-        original_name_list = re.findall(name_pattern, original_text)
+        original_name_list = TextNormalizer.NAME_RE.findall(original_text)
         if len(original_name_list) == 0:
             return (original_text, None)
         original_name_list = list(set("".join(n) for n in original_name_list))
@@ -194,8 +218,7 @@ class TextNormalizer:
         例如：xuan4 -> <pinyin_a>
         """
         # 声母韵母+声调数字
-        origin_pinyin_pattern = re.compile(TextNormalizer.PINYIN_TONE_PATTERN, re.IGNORECASE)
-        original_pinyin_list = re.findall(origin_pinyin_pattern, original_text)
+        original_pinyin_list = TextNormalizer.PINYIN_TONE_RE.findall(original_text)
         if len(original_pinyin_list) == 0:
             return (original_text, None)
         original_pinyin_list = list(set("".join(p) for p in original_pinyin_list))
@@ -229,18 +252,34 @@ class TextNormalizer:
 
 
 class TextTokenizer:
-    def __init__(self, vocab_file: str, normalizer: TextNormalizer = None):
+    def __init__(self, vocab_file: str, normalizer: TextNormalizer = None, model_proto: bytes = None,
+                 cache_size: int = 4096):
+        """
+        Args:
+            vocab_file: path to the sentencepiece model.
+            model_proto: the serialized sentencepiece model, used instead of `vocab_file` (e.g. from a model bundle).
+            cache_size: LRU cache size of the `tokenize` results by sentence, 0 to disable.
+        """
         self.vocab_file = vocab_file
         self.normalizer = normalizer
-
-        if self.vocab_file is None:
-            raise ValueError("vocab_file is None")
-        if not os.path.exists(self.vocab_file):
-            raise ValueError(f"vocab_file {self.vocab_file} does not exist")
+        self.cache_size = cache_size
+        self._sentence_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        if model_proto is None:
+            if self.vocab_file is None:
+                raise ValueError("vocab_file is None")
+            if not os.path.exists(self.vocab_file):
+                raise ValueError(f"vocab_file {self.vocab_file} does not exist")
         if self.normalizer:
             self.normalizer.load()
         # 加载词表
-        self.sp_model = SentencePieceProcessor(model_file=self.vocab_file)
+        if model_proto is not None:
+            self.sp_model = SentencePieceProcessor(model_proto=model_proto)
+        else:
+            self.sp_model = SentencePieceProcessor(model_file=self.vocab_file)
 
         self.pre_tokenizers = [
             # 预处理器
@@ -311,7 +350,40 @@ class TextTokenizer:
         return [self.sp_model.PieceToId(token) for token in tokens]
 
     def tokenize(self, text: str) -> List[str]:
-        return self.encode(text, out_type=str)
+        if self.cache_size <= 0 or not self.normalizer or len(text.strip()) <= 1:
+            return self.encode(text, out_type=str)
+        # 按句子缓存 normalize + 分词的结果, 中英文的选择仍由整段文本决定.
+        # 句子在空白处切分, 拼接后与整段分词一致
+        use_chinese = self.normalizer.use_chinese(text)
+        tokens = []
+        for sentence in TextNormalizer.split_sentences(text):
+            if not sentence.strip():
+                continue
+            tokens.extend(self._tokenize_sentence(sentence, use_chinese))
+        return tokens
+
+    def _tokenize_sentence(self, sentence: str, use_chinese: bool) -> List[str]:
+        key = (sentence, use_chinese)
+        with self._cache_lock:
+            tokens = self._sentence_cache.get(key)
+            if tokens is not None:
+                self._sentence_cache.move_to_end(key)
+                self.cache_hits += 1
+                return tokens
+            self.cache_misses += 1
+        text = self.normalizer.normalize(sentence, use_chinese=use_chinese)
+        for pre_tokenizer in self.pre_tokenizers:
+            text = pre_tokenizer(text)
+        tokens = tuple(self.sp_model.Encode(text, out_type=str))
+        with self._cache_lock:
+            self._sentence_cache[key] = tokens
+            while len(self._sentence_cache) > self.cache_size:
+                self._sentence_cache.popitem(last=False)
+        return tokens
+
+    def cache_info(self):
+        return {"hits": self.cache_hits, "misses": self.cache_misses, "size": len(self._sentence_cache),
+                "max_size": self.cache_size}
 
     def encode(self, text: str, **kwargs):
         if len(text) == 0:
@@ -422,11 +494,84 @@ class TextTokenizer:
         "▁?",
         "▁...", # ellipsis
     ]
-    def split_segments(self, tokenized: List[str], max_text_tokens_per_segment=120) -> List[List[str]]:
+    clause_marks_tokens = [",", "▁,", "-"]
+
+    def split_segments(self, tokenized: List[str], max_text_tokens_per_segment=120,
+                       balanced=False) -> List[List[str]]:
+        """
+        Args:
+            balanced: choose the split points over the whole text for segments of similar lengths, see
+                `split_segments_balanced`, instead of cutting at every sentence end and merging the neighbours.
+        """
+        if balanced:
+            return TextTokenizer.split_segments_balanced(
+                tokenized, max_text_tokens_per_segment, self.punctuation_marks_tokens, self.clause_marks_tokens
+            )
         return TextTokenizer.split_segments_by_token(
             tokenized, self.punctuation_marks_tokens, max_text_tokens_per_segment=max_text_tokens_per_segment
         )
 
+    @staticmethod
+    def split_segments_balanced(
+        tokenized_str: List[str], max_text_tokens_per_segment: int, sentence_tokens: List[str],
+        clause_tokens: List[str] = (), clause_penalty=0.3, word_penalty=4.0, subword_penalty=8.0,
+        segment_penalty=0.05,
+    ) -> List[List[str]]:
+        """
+        Split the tokens into segments of at most ``max_text_tokens_per_segment`` tokens and of lengths as close
+        as possible to each other, by dynamic programming over the split points of the whole text: the cost of a
+        segment is its squared relative deviation from the mean length of the fewest segments, plus the penalty
+        of its end (free after a sentence end, ``clause_penalty`` after a comma, ``word_penalty`` between two
+        words and ``subword_penalty`` inside a word), plus ``segment_penalty`` per segment.
+        """
+        n = len(tokenized_str)
+        if n == 0:
+            return []
+        if n <= max_text_tokens_per_segment:
+            return [list(tokenized_str)]
+        # penalty of a split before the token j
+        penalty = [word_penalty if token.startswith("▁") else subword_penalty for token in tokenized_str] + [0.0]
+        for i, token in enumerate(tokenized_str[:-1]):
+            if token not in sentence_tokens and token not in clause_tokens:
+                continue
+            j = i + 1
+            if tokenized_str[j] in ["'", "▁'"]:
+                # 后续token是'，则不切分
+                j += 1
+            penalty[j] = min(penalty[j], 0.0 if token in sentence_tokens else clause_penalty)
+
+        target = n / math.ceil(n / max_text_tokens_per_segment)
+        cost = [0.0] + [math.inf] * n
+        back = [0] * (n + 1)
+        for j in range(1, n + 1):
+            for i in range(max(0, j - max_text_tokens_per_segment), j):
+                if cost[i] == math.inf:
+                    continue
+                deviation = (j - i - target) / target
+                c = cost[i] + deviation * deviation + segment_penalty + penalty[j]
+                if c < cost[j]:
+                    cost[j] = c
+                    back[j] = i
+        segments = []
+        j = n
+        while j > 0:
+            segments.append(list(tokenized_str[back[j]:j]))
+            j = back[j]
+        return segments[::-1]
+
+    @staticmethod
+    def padding_waste(segments: List[List[str]], bucket_size: int) -> float:
+        """
+        Expected share of padding tokens when the segments are batched by ``bucket_size`` after sorting them by
+        length, as `IndexTTS.bucket_segments` groups them.
+        """
+        lengths = sorted(len(segment) for segment in segments)
+        padded = 0
+        for i in range(0, len(lengths), max(1, bucket_size)):
+            bucket = lengths[i:i + bucket_size]
+            padded += bucket[-1] * len(bucket)
+        return 1 - sum(lengths) / padded if padded > 0 else 0.0
+
 
 if __name__ == "__main__":
     # 测试程序
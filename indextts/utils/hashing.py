@@ -0,0 +1,24 @@
+import functools
+import hashlib
+import os
+
+
+def file_sha1(path: str, block_size: int = 1 << 20) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_file_sha1(path: str, mtime_ns: int, size: int) -> str:
+    return file_sha1(path)
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    The sha1 of the content of ``path``, hashed again only when the file is modified.
+    """
+    stat = os.stat(path)
+    return _cached_file_sha1(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,110 @@
+import difflib
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import torch
+
+
+def match_tokens(old_tokens: Sequence[str], new_tokens: Sequence[str]) -> List[Tuple[int, int, int]]:
+    """
+    Returns:
+        the matching blocks (i, j, size) of ``old_tokens[i:i + size] == new_tokens[j:j + size]``, increasing in i
+        and j. The common prefix and suffix are matched directly, `difflib.SequenceMatcher` only aligns the edited
+        part in between.
+    """
+    n_old, n_new = len(old_tokens), len(new_tokens)
+    prefix = 0
+    while prefix < min(n_old, n_new) and old_tokens[prefix] == new_tokens[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < min(n_old, n_new) - prefix and old_tokens[n_old - 1 - suffix] == new_tokens[n_new - 1 - suffix]:
+        suffix += 1
+    blocks = [(0, 0, prefix)] if prefix else []
+    # no autojunk: the punctuation tokens are frequent in any script, they must be matched all the same
+    matcher = difflib.SequenceMatcher(None, old_tokens[prefix:n_old - suffix], new_tokens[prefix:n_new - suffix],
+                                      autojunk=False)
+    blocks += [(prefix + i, prefix + j, size) for i, j, size in matcher.get_matching_blocks() if size]
+    if suffix:
+        blocks.append((n_old - suffix, n_new - suffix, suffix))
+    return blocks
+
+
+def plan_segments(old_segments: Sequence[Sequence[str]], new_tokens: Sequence[str],
+                  split_segments: Callable[[List[str]], List[List[str]]]) -> List[Tuple[List[str], Optional[int]]]:
+    """
+    Segment ``new_tokens`` reusing the old segments that are found unchanged in it: the old segments whose tokens
+    are all aligned, in one piece, to the new tokens are kept as they are, and only the tokens between them are
+    split again. An edit so changes the segments around it, not the segmentation of the rest of the text.
+
+    Args:
+        old_segments: the segments of the previous run.
+        new_tokens: the tokens of the edited text.
+        split_segments: the segmenter of the changed tokens, e.g. `TextTokenizer.split_segments` with its max.
+
+    Returns:
+        the new segments, each with the index of the identical old segment, or None if it must be synthesized.
+    """
+    old_tokens = [token for segment in old_segments for token in segment]
+    # new position of each old token, -1 for the deleted or changed ones
+    positions = [-1] * len(old_tokens)
+    for i, j, size in match_tokens(old_tokens, new_tokens):
+        positions[i:i + size] = range(j, j + size)
+
+    plan = []
+    done = 0
+    start = 0
+    for old_idx, segment in enumerate(old_segments):
+        end = start + len(segment)
+        new_start = positions[start] if segment else -1
+        if new_start >= done and all(positions[k] == new_start + k - start for k in range(start, end)):
+            if new_start > done:
+                plan += [(new_segment, None) for new_segment in split_segments(list(new_tokens[done:new_start]))]
+            plan.append((list(segment), old_idx))
+            done = new_start + len(segment)
+        start = end
+    if done < len(new_tokens):
+        plan += [(new_segment, None) for new_segment in split_segments(list(new_tokens[done:]))]
+    return plan
+
+
+class IncrementalSession:
+    """
+    The segments of the last synthesis of a document, with their waveforms and seeds. `IndexTTS2.infer` with a
+    session re-synthesizes only the segments of the edited text that are not among them, see `plan_segments`, so
+    that editing a sentence of a long script costs the synthesis of that sentence. Keep one session per document.
+
+    The segments are reused only if the voice, emotion and generation options are the same as in the last run.
+    """
+
+    def __init__(self):
+        self.settings = None
+        self.segments: List[List[str]] = []
+        self.seeds: List[Optional[int]] = []
+        self._wavs: List[torch.Tensor] = []
+
+    def plan(self, tokens: List[str], settings, split_segments) -> List[Tuple[List[str], Optional[int]]]:
+        """
+        Args:
+            settings: the settings of the request, the old segments are reused only if they are the same.
+
+        Returns:
+            the segments of ``tokens``, each with the index of the old segment to reuse or None, see `plan_segments`.
+        """
+        if settings is None or settings != self.settings:
+            return [(segment, None) for segment in split_segments(tokens)]
+        return plan_segments(self.segments, tokens, split_segments)
+
+    def wav(self, index: int) -> torch.Tensor:
+        """
+        The waveform of the old segment ``index``, as `IndexTTS2.vocode` returns it.
+        """
+        return self._wavs[index].float()
+
+    def update(self, settings, segments: List[List[str]], wavs: List[torch.Tensor], seeds: List[Optional[int]]):
+        # int16 samples, those saved by `IndexTTS2.save_output`, at half the memory
+        self.settings = settings
+        self.segments = [list(segment) for segment in segments]
+        self._wavs = [wav.detach().cpu().to(torch.int16) for wav in wavs]
+        self.seeds = list(seeds)
+
+    def reset(self):
+        self.update(None, [], [], [])
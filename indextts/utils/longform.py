@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import re
+import struct
+import time
+from typing import List, Optional, Sequence, Tuple, Union
+
+import torch
+
+from indextts.utils.hashing import file_sha1
+
+# output sample rate of IndexTTS2
+SAMPLE_RATE = 22050
+WAV_HEADER_SIZE = 44
+MANIFEST_VERSION = 1
+# markdown headings and Chinese chapter titles on their own line
+CHAPTER_PATTERN = r"^[ \t]*(?:#{1,6}[ \t]+.+|第[0-9一二三四五六七八九十百千零两]+[章节回卷部].*|Chapter[ \t]+\w+.*)$"
+
+
+def split_chapters(text: str, pattern: Optional[str] = CHAPTER_PATTERN) -> List[Tuple[str, str]]:
+    """
+    Split ``text`` at the lines matching ``pattern``, the title line is the start of its chapter.
+
+    Returns:
+        list of (title, text), a single untitled chapter if no line matches.
+    """
+    if not pattern:
+        return [("", text)]
+    starts = [m.start() for m in re.finditer(pattern, text, re.MULTILINE | re.IGNORECASE)]
+    if not starts or starts[0] > 0 and text[:starts[0]].strip():
+        starts = [0] + starts
+    chapters = []
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        chapter = text[start:end]
+        if chapter.strip():
+            chapters.append((chapter.strip().splitlines()[0].lstrip("# ").strip(), chapter))
+    return chapters
+
+
+def _sha1(data: Union[bytes, str]) -> str:
+    return hashlib.sha1(data.encode("utf-8") if isinstance(data, str) else data).hexdigest()
+
+
+class IncrementalWavWriter:
+    """
+    Mono PCM16 WAV file written segment by segment: the header is rewritten after every append, so the file on
+    disk is always a valid WAV of the segments written so far.
+    """
+
+    def __init__(self, path: str, sample_rate: int = SAMPLE_RATE, data_bytes: int = 0):
+        """
+        Args:
+            data_bytes: resume after this many bytes of samples of an existing file, the rest is discarded.
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        resume = data_bytes > 0 and os.path.exists(path)
+        self.file = open(path, "r+b" if resume else "w+b")
+        self.data_bytes = data_bytes if resume else 0
+        self.file.truncate(WAV_HEADER_SIZE + self.data_bytes)
+        self._write_header()
+
+    def _write_header(self):
+        self.file.seek(0)
+        self.file.write(struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + self.data_bytes, b"WAVE", b"fmt ", 16, 1, 1,
+                                    self.sample_rate, self.sample_rate * 2, 2, 16, b"data", self.data_bytes))
+
+    def append(self, pcm: bytes):
+        self.file.seek(WAV_HEADER_SIZE + self.data_bytes)
+        self.file.write(pcm)
+        self.data_bytes += len(pcm)
+        self._write_header()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def verified_prefix(path: str, records: Sequence[dict]) -> int:
+    """
+    Number of leading ``records`` whose bytes in the WAV file at ``path`` still match their hash.
+    """
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open(path, "rb") as f:
+        f.seek(WAV_HEADER_SIZE)
+        for record in records:
+            if _sha1(f.read(record["bytes"])) != record["sha1"]:
+                break
+            count += 1
+    return count
+
+
+def wav_to_flac(wav_path: str, flac_path: str, block_size: int = 1 << 16):
+    import soundfile as sf
+    with sf.SoundFile(wav_path) as src, \
+            sf.SoundFile(flac_path, "w", src.samplerate, 1, format="FLAC", subtype="PCM_16") as dst:
+        for block in src.blocks(blocksize=block_size, dtype="int16"):
+            dst.write(block)
+
+
+class LongFormJob:
+    """
+    Synthesize a long document segment by segment into per-chapter audio files, with a memory use independent of
+    the document length: every finished segment is appended to the WAV file of its chapter, and recorded in the
+    ``manifest.json`` of the output directory with the hash of its samples. Running the same job again resumes
+    after the last segment on disk that matches the manifest.
+    """
+
+    def __init__(self, tts, spk_audio_prompt: str, output_dir: str, text: Optional[str] = None,
+                 chapters: Optional[Sequence[Union[str, Tuple[str, str]]]] = None,
+                 chapter_pattern: Optional[str] = CHAPTER_PATTERN, audio_format: str = "wav",
+                 interval_silence: int = 200, max_text_tokens_per_segment: int = 120,
+                 emo_audio_prompt: Optional[str] = None, emo_alpha: float = 1.0, emo_vector=None,
+                 use_emo_text: bool = False, emo_text: Optional[str] = None, use_random: bool = False,
+                 verbose: bool = False, **generation_kwargs):
+        """
+        Args:
+            tts: the `IndexTTS2` model.
+            output_dir: directory of the chapter files and of the manifest.
+            text: the document, split into chapters at the lines matching ``chapter_pattern``.
+            chapters: the chapters instead of ``text``, texts or (title, text).
+            chapter_pattern: regex of the chapter title lines, None for a single output file.
+            audio_format: 'wav' or 'flac'. The chapters are written as WAV, then encoded to FLAC when complete.
+            interval_silence: silence between two segments, in ms.
+            The other arguments are the ones of `IndexTTS2.infer`.
+        """
+        if audio_format not in ("wav", "flac"):
+            raise ValueError(f"unknown audio format '{audio_format}', expected 'wav' or 'flac'")
+        if (text is None) == (chapters is None):
+            raise ValueError("exactly one of text and chapters is required")
+        self.tts = tts
+        self.spk_audio_prompt = spk_audio_prompt
+        self.output_dir = output_dir
+        if text is not None:
+            self.chapters = split_chapters(text, chapter_pattern)
+        else:
+            self.chapters = [chapter if isinstance(chapter, tuple) else ("", chapter) for chapter in chapters]
+        self.audio_format = audio_format
+        self.interval_silence = interval_silence
+        self.max_text_tokens_per_segment = max_text_tokens_per_segment
+        self.emotion_args = dict(emo_audio_prompt=emo_audio_prompt, emo_alpha=emo_alpha, emo_vector=emo_vector,
+                                 use_emo_text=use_emo_text, emo_text=emo_text)
+        self.use_random = use_random
+        self.verbose = verbose
+        self.generation_kwargs = generation_kwargs
+        self.manifest_path = os.path.join(output_dir, "manifest.json")
+
+    def settings(self) -> dict:
+        """
+        What the audio of the segments depends on, a resumed job must have the same settings.
+        """
+        emotion_args = dict(self.emotion_args)
+        if emotion_args["emo_audio_prompt"] is not None:
+            emotion_args["emo_audio_prompt"] = file_sha1(emotion_args["emo_audio_prompt"])
+        return {
+            "voice": file_sha1(self.spk_audio_prompt),
+            "emotion": emotion_args,
+            "use_random": self.use_random,
+            "interval_silence": self.interval_silence,
+            "max_text_tokens_per_segment": self.max_text_tokens_per_segment,
+            "generation_kwargs": self.generation_kwargs,
+            "model_version": self.tts.model_version,
+        }
+
+    def _load_manifest(self, settings: dict) -> dict:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_VERSION or manifest.get("settings") != settings:
+                raise ValueError(f"{self.output_dir} holds a job with other settings, use another output directory")
+            return manifest
+        return {"version": MANIFEST_VERSION, "settings": settings, "sample_rate": SAMPLE_RATE, "chapters": []}
+
+    def _save_manifest(self, manifest: dict):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _chapter_entry(self, manifest: dict, index: int, title: str, text: str) -> dict:
+        text_sha1 = _sha1(text)
+        while len(manifest["chapters"]) <= index:
+            manifest["chapters"].append(None)
+        entry = manifest["chapters"][index]
+        if entry is not None and entry["text_sha1"] != text_sha1:
+            raise ValueError(f"chapter {index} '{title}' changed since the job started, use another output directory")
+        if entry is None:
+            name = f"{index + 1:03d}"
+            entry = {"index": index, "title": title, "text_sha1": text_sha1, "wav": f"{name}.wav",
+                     "output": f"{name}.{self.audio_format}", "segments": None, "completed": [], "done": False}
+            manifest["chapters"][index] = entry
+        return entry
+
+    def run(self) -> List[str]:
+        """
+        Returns:
+            the paths of the chapter audio files.
+        """
+        tts = self.tts
+        os.makedirs(self.output_dir, exist_ok=True)
+        # as read back from the manifest
+        manifest = self._load_manifest(json.loads(json.dumps(self.settings())))
+        start_time = time.perf_counter()
+        conditions = None
+        options = tts.generation_options(self.max_text_tokens_per_segment, **self.generation_kwargs)
+        stats = tts.new_stats()
+        silence = b"\x00\x00" * int(SAMPLE_RATE * self.interval_silence / 1000)
+        synthesized = 0
+        outputs = []
+        for index, (title, text) in enumerate(self.chapters):
+            entry = self._chapter_entry(manifest, index, title, text)
+            output_path = os.path.join(self.output_dir, entry["output"])
+            outputs.append(output_path)
+            if entry["done"] and os.path.exists(output_path):
+                print(f">> chapter {index + 1}/{len(self.chapters)} '{title}' already done: {output_path}")
+                continue
+
+            segments = tts.text_frontend(text, self.max_text_tokens_per_segment, self.verbose)
+            segment_hashes = [_sha1("\x1f".join(segment)) for segment in segments]
+            if entry["segments"] is not None and entry["segments"] != segment_hashes:
+                # the text front end changed: the written segments may not match the new segmentation
+                print(f">> chapter {index + 1}: segmentation changed, restarting the chapter")
+                entry["completed"] = []
+            entry["segments"] = segment_hashes
+            wav_path = os.path.join(self.output_dir, entry["wav"])
+            completed = entry["completed"][:verified_prefix(wav_path, entry["completed"])]
+            if len(completed) < len(entry["completed"]):
+                print(f">> chapter {index + 1}: {len(entry['completed']) - len(completed)} segments on disk "
+                      f"do not match the manifest, synthesizing them again")
+            entry["completed"] = completed
+            if completed:
+                print(f">> chapter {index + 1}: resuming after {len(completed)}/{len(segments)} segments")
+            writer = IncrementalWavWriter(wav_path, SAMPLE_RATE, sum(record["bytes"] for record in completed))
+            try:
+                for seg_idx in range(len(completed), len(segments)):
+                    if conditions is None:
+                        emo_audio_prompt, emo_alpha, emo_vector = tts.prepare_emotion(
+                            text, self.spk_audio_prompt, **self.emotion_args)
+                        conditions = tts.encode_prompts(self.spk_audio_prompt, emo_audio_prompt, emo_alpha,
+                                                        emo_vector, self.use_random, self.verbose)
+                    codes, code_lens, latent = tts.generate_segment(segments[seg_idx], conditions, options, stats,
+                                                                    self.verbose)
+                    vc_target = tts.synthesize_mel(codes, code_lens, latent, conditions, stats)
+                    wav = tts.vocode(vc_target, stats, self.verbose)
+                    pcm = (silence if seg_idx > 0 else b"") + wav.squeeze(0).to(torch.int16).numpy().tobytes()
+                    writer.append(pcm)
+                    entry["completed"].append({"index": seg_idx, "bytes": len(pcm), "sha1": _sha1(pcm)})
+                    self._save_manifest(manifest)
+                    synthesized += 1
+                    elapsed = time.perf_counter() - start_time
+                    print(f">> chapter {index + 1}/{len(self.chapters)} segment {seg_idx + 1}/{len(segments)}, "
+                          f"{writer.data_bytes / 2 / SAMPLE_RATE:.1f}s of audio, {elapsed / synthesized:.2f}s/segment")
+            finally:
+                writer.close()
+            if self.audio_format == "flac":
+                wav_to_flac(wav_path, output_path)
+                os.remove(wav_path)
+            entry["done"] = True
+            self._save_manifest(manifest)
+            print(f">> chapter {index + 1}/{len(self.chapters)} '{title}' saved to: {output_path}")
+        print(f">> long-form job done: {synthesized} segments synthesized in {time.perf_counter() - start_time:.2f}s, "
+              f"{len(outputs)} chapters in {self.output_dir}")
+        return outputs
@@ -0,0 +1,89 @@
+import math
+import re
+from collections import deque
+from typing import Dict, List, Tuple, Union
+
+from indextts.utils.text_utils import get_text_syllable_num, get_text_tts_dur
+
+# letters of the scripts not counted by `get_text_syllable_num` (kana, Hangul, Cyrillic...)
+_UNCOUNTED_LETTER_RE = re.compile(r"[^\W\d_a-zA-Z\u00c0-\u024f\u4e00-\u9fff]")
+
+
+class MelBudgetEstimator:
+    """
+    Estimate how many mel codes a text segment will generate, from its syllable count
+    (see `get_text_tts_dur`), and derive a per-segment generation budget from it.
+
+    The budget caps `max_generate_length`, which bounds the KV cache growth and the worst-case
+    runtime of a segment, and the expected length is used as the cost of a segment for bucketing.
+    Estimated vs. actual lengths are recorded by `record()` so the coefficients can be tuned.
+    """
+
+    def __init__(self, code_rate: float, max_mel_tokens: int, safety_factor: float = 1.5, min_tokens: int = 50,
+                 history_size: int = 1000, chars_per_second: float = 4.0):
+        """
+        Args:
+            code_rate: mel codes generated per second of speech.
+            max_mel_tokens: upper bound of the budget.
+            safety_factor: multiplier on the slowest plausible duration.
+            min_tokens: added to every budget, covers leading/trailing silence of short segments.
+            history_size: number of (expected, actual, budget) records kept for `metrics()`.
+            chars_per_second: speech rate of the expected length of the segments with uncounted letters.
+        """
+        self.code_rate = code_rate
+        self.max_mel_tokens = max_mel_tokens
+        self.safety_factor = safety_factor
+        self.min_tokens = min_tokens
+        self.history = deque(maxlen=history_size)
+        self.chars_per_second = chars_per_second
+
+    @staticmethod
+    def segment_text(segment: Union[str, List[str]]) -> str:
+        if isinstance(segment, str):
+            return segment
+        # sentencepiece tokens -> text
+        return "".join(segment).replace("▁", " ").strip()
+
+    def estimate(self, segment: Union[str, List[str]]) -> Tuple[int, int]:
+        """
+        Args:
+            segment: the text or the sentencepiece tokens of one segment.
+        Returns:
+            (expected, budget): the expected number of mel codes and the generation budget. The budget of a
+            segment whose syllables are not all counted (kana, Hangul, only symbols...) is `max_mel_tokens`.
+        """
+        text = self.segment_text(segment)
+        if _UNCOUNTED_LETTER_RE.search(text) or get_text_syllable_num(text) == 0:
+            # a budget from the undercounted syllables would truncate the segment
+            chars = len("".join(text.split()))
+            return int(round(chars / self.chars_per_second * self.code_rate)), self.max_mel_tokens
+        # NOTE: `get_text_tts_dur` returns (duration at max speed, duration at min speed)
+        fast_dur, slow_dur = get_text_tts_dur(text)
+        expected = int(round((fast_dur + slow_dur) / 2 * self.code_rate))
+        budget = int(math.ceil(slow_dur * self.code_rate * self.safety_factor)) + self.min_tokens
+        return expected, min(budget, self.max_mel_tokens)
+
+    def record(self, expected: int, actual: int, budget: int):
+        self.history.append((int(expected), int(actual), int(budget)))
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        Summary of the recorded segments:
+            - ``actual_to_expected``: mean ratio of the actual to the expected length, ideally ~1.0
+            - ``budget_usage``: mean ratio of the actual length to the budget
+            - ``budget_exhausted``: number of segments that reached their budget
+        """
+        count = len(self.history)
+        if count == 0:
+            return {"segments": 0}
+        ratios = [a / max(e, 1) for e, a, _ in self.history]
+        usage = [a / max(b, 1) for _, a, b in self.history]
+        return {
+            "segments": count,
+            "expected_tokens": sum(e for e, _, _ in self.history),
+            "actual_tokens": sum(a for _, a, _ in self.history),
+            "actual_to_expected": sum(ratios) / count,
+            "budget_usage": sum(usage) / count,
+            "max_budget_usage": max(usage),
+            "budget_exhausted": sum(1 for _, a, b in self.history if a >= b),
+        }
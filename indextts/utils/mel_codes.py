@@ -0,0 +1,54 @@
+from typing import Optional, Tuple
+
+import torch
+
+
+def postprocess_mel_codes(
+    codes: torch.Tensor,
+    stop_token: int,
+    silent_token: int = 52,
+    max_consecutive: Optional[int] = 30,
+    keep_silent: int = 10,
+    trim: bool = True,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Vectorized post-processing of the generated mel codes of a whole batch:
+        1. cut every row at its first ``stop_token``
+        2. for rows with more than ``max_consecutive`` silent tokens, shrink every run of
+           ``silent_token`` to its first ``keep_silent`` tokens
+        3. pack the kept codes to the left, padded with ``stop_token``
+
+    Only tensor ops are used, the only host synchronization is the optional ``trim``.
+
+    Args:
+        codes: (b, T) generated mel codes.
+        max_consecutive: ``None`` to disable the silence shrinking, only cut at ``stop_token``.
+        trim: clip the packed codes to the longest row, needs one host sync for the whole batch.
+    Returns:
+        codes: (b, T') packed codes, ``T' = T`` if not ``trim``.
+        code_lens: (b,) lengths of the rows.
+    """
+    b, T = codes.shape
+    positions = torch.arange(T, device=codes.device).unsqueeze(0)  # [1, T]
+    is_stop = codes == stop_token
+    # the first stop position of each row, `T` for rows without stop_token
+    stop_idx = torch.where(is_stop.any(dim=-1), is_stop.int().argmax(dim=-1), T)
+    keep = positions < stop_idx.unsqueeze(-1)
+
+    if max_consecutive is not None:
+        is_silent = codes == silent_token
+        # 1-based position inside the current run of silent tokens, 0 for the other tokens
+        last_break = torch.where(is_silent, -1, positions).cummax(dim=-1).values
+        silent_run_pos = positions - last_break
+        shrink = (is_silent.sum(dim=-1) > max_consecutive).unsqueeze(-1)
+        keep = keep & (~shrink | (silent_run_pos <= keep_silent))
+
+    code_lens = keep.sum(dim=-1)
+    # scatter the kept codes to the left; dropped codes go to the extra trash column `T`
+    dest = torch.where(keep, keep.long().cumsum(dim=-1) - 1, T)
+    packed = codes.new_full((b, T + 1), stop_token)
+    packed.scatter_(1, dest, codes)
+    packed = packed[:, :T]
+    if trim and b > 0:
+        packed = packed[:, :int(code_lens.max())]
+    return packed, code_lens
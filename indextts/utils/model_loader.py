@@ -0,0 +1,172 @@
+import contextlib
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+import torch.nn as nn
+
+
+def load_state_dict_mmap(path: str) -> Dict[str, Any]:
+    """
+    ``torch.load`` with ``mmap=True``: the tensors are backed by the file pages instead of being read into memory,
+    so only the pages actually used are read, once, when the weights are assigned or moved to the device.
+    Falls back to a normal load for checkpoints in the legacy (non-zip) format.
+    """
+    try:
+        return torch.load(path, map_location="cpu", mmap=True)
+    except RuntimeError:
+        return torch.load(path, map_location="cpu")
+
+
+# modules are built one at a time by the loader threads: `transformers` ``from_pretrained`` patches
+# ``nn.Module.register_parameter`` and the ``torch.nn.init`` functions for the whole process while it builds a model
+_CONSTRUCTION_LOCK = threading.RLock()
+# `init_empty_weights` only applies to the thread that entered it
+_meta_init = threading.local()
+_original_register_parameter = nn.Module.register_parameter
+
+
+def _register_parameter(module: nn.Module, name: str, param: Optional[nn.Parameter]):
+    _original_register_parameter(module, name, param)
+    if param is not None and getattr(_meta_init, "depth", 0) > 0 and not param.is_meta:
+        param = module._parameters[name]
+        kwargs = dict(param.__dict__, requires_grad=param.requires_grad)
+        module._parameters[name] = type(param)(param.to("meta"), **kwargs)
+
+
+def module_construction():
+    """
+    Context manager to hold while building modules in a `ParallelLoader` thread, so that a model built at the same
+    time by ``from_pretrained`` in another thread does not leave their parameters uninitialized or on the meta device.
+    """
+    return _CONSTRUCTION_LOCK
+
+
+@contextlib.contextmanager
+def init_empty_weights():
+    """
+    Context manager to build modules with their parameters on the meta device, skipping the allocation and the
+    random initialization of weights which are overwritten by the checkpoint anyway. Buffers are created normally,
+    since the non-persistent ones are not in the checkpoint. Load the weights with ``load_state_dict(assign=True)``.
+
+    Unlike the one of ``accelerate``, only the modules built by the calling thread are affected.
+    """
+    with _CONSTRUCTION_LOCK:
+        # installed once, the patch does nothing outside of this context
+        if nn.Module.register_parameter is not _register_parameter:
+            nn.Module.register_parameter = _register_parameter
+        _meta_init.depth = getattr(_meta_init, "depth", 0) + 1
+        try:
+            yield
+        finally:
+            _meta_init.depth -= 1
+
+
+def materialize_meta_parameters(module: nn.Module, device) -> List[str]:
+    """
+    Allocate the parameters left on the meta device after loading a non-strict checkpoint: modules without any
+    loaded parameter are reset by their ``reset_parameters()``, the other missing parameters are zero initialized.
+
+    Returns:
+        the names of the materialized parameters.
+    """
+    names = []
+    for module_name, m in module.named_modules():
+        own_params = list(m.named_parameters(recurse=False))
+        missing = [name for name, param in own_params if param.is_meta]
+        if not missing:
+            continue
+        for name in missing:
+            param = m._parameters[name]
+            m._parameters[name] = nn.Parameter(torch.zeros(param.shape, dtype=param.dtype, device=device),
+                                               requires_grad=param.requires_grad)
+            names.append(f"{module_name}.{name}" if module_name else name)
+        if len(missing) == len(own_params) and hasattr(m, "reset_parameters"):
+            m.reset_parameters()
+    return names
+
+
+def module_nbytes(*modules: Optional[nn.Module]) -> int:
+    """
+    Bytes of the parameters and buffers of ``modules``, shared tensors are counted once.
+    """
+    seen = set()
+    total = 0
+    for module in modules:
+        if module is None:
+            continue
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if tensor.is_meta or tensor.data_ptr() in seen:
+                continue
+            seen.add(tensor.data_ptr())
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ParallelLoader:
+    """
+    Load independent model components concurrently in a thread pool and record the time of each of them.
+    Loading is dominated by file IO, downloads, deserialization and host-to-device copies, which release the GIL.
+
+    Usage::
+
+        loader = ParallelLoader(max_workers=4)
+        loader.submit("gpt", self._load_gpt)
+        loader.submit("bigvgan", self._load_bigvgan)
+        loader.wait()
+        print(loader.report())
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        Args:
+            max_workers: threads of the pool, ``1`` to load sequentially in submission order.
+        """
+        self.max_workers = max_workers or min(8, (os.cpu_count() or 1) + 2)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="indextts-load")
+        self.futures: Dict[str, Future] = {}
+        self.timings: Dict[str, float] = {}
+        self.start_time = time.perf_counter()
+        self.total_time = None
+
+    def _run(self, name: str, fn: Callable, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def submit(self, name: str, fn: Callable, *args, **kwargs) -> Future:
+        self.futures[name] = self.executor.submit(self._run, name, fn, *args, **kwargs)
+        return self.futures[name]
+
+    def wait(self) -> Dict[str, Any]:
+        """
+        Wait for all the tasks, then raise the first error if any.
+
+        Returns:
+            the results of the tasks by name.
+        """
+        self.executor.shutdown(wait=True)
+        self.total_time = time.perf_counter() - self.start_time
+        results = {}
+        for name, future in self.futures.items():
+            error = future.exception()
+            if error is not None:
+                print(f">> ✗ {name} 加载失败: {error}")
+                print("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+                raise error
+            results[name] = future.result()
+        return results
+
+    def report(self) -> str:
+        total = self.total_time if self.total_time is not None else time.perf_counter() - self.start_time
+        lines = [f">> startup time: {total:.2f}s (wall), {sum(self.timings.values()):.2f}s summed over "
+                 f"{len(self.timings)} components, {self.max_workers} workers"]
+        for name, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            lines.append(f">>   {name:<20} {seconds:7.2f}s")
+        return "\n".join(lines)
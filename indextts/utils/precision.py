@@ -0,0 +1,66 @@
+import math
+from typing import Dict, Optional
+
+import torch
+import torch.nn as nn
+
+PRECISIONS = {"fp32": None, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def precision_dtype(precision: str) -> Optional[torch.dtype]:
+    """
+    The autocast dtype of ``precision``, ``None`` for fp32.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}, expected one of {list(PRECISIONS)}")
+    return PRECISIONS[precision]
+
+
+def cpu_has_native_bf16() -> bool:
+    """
+    Whether the CPU has native bf16 matmuls (AVX512-BF16 or AMX), otherwise bf16 is emulated and slow.
+    """
+    for check in ("_is_amx_tile_supported", "_is_avx512_bf16_supported"):
+        fn = getattr(torch.cpu, check, None) or getattr(getattr(torch._C, "_cpu", None), check, None)
+        if fn is not None and fn():
+            return True
+    return False
+
+
+def _is_norm(module: nn.Module) -> bool:
+    return isinstance(module, (nn.LayerNorm, nn.GroupNorm, nn.modules.batchnorm._BatchNorm)) \
+        or type(module).__name__.endswith("RMSNorm")
+
+
+def cast_module(module: nn.Module, dtype: torch.dtype) -> nn.Module:
+    """
+    Cast the weights of ``module`` to ``dtype`` in place, except the normalization layers which keep fp32
+    parameters: their reductions run in fp32, and they accept both fp32 and ``dtype`` inputs.
+    Run the module under ``torch.amp.autocast`` so the fp32 inputs are cast by the matmuls and convolutions.
+    """
+    module.to(dtype)
+    for m in module.modules():
+        if _is_norm(m):
+            for param in m.parameters(recurse=False):
+                param.data = param.data.float()
+            for name, buffer in m.named_buffers(recurse=False):
+                if buffer is not None and buffer.is_floating_point():
+                    setattr(m, name, buffer.float())
+    return module
+
+
+def compare_tensors(reference: torch.Tensor, estimate: torch.Tensor) -> Dict[str, float]:
+    """
+    Error of ``estimate`` against ``reference``, both are compared in fp32.
+    """
+    reference = reference.detach().float()
+    estimate = estimate.detach().float()
+    if reference.shape != estimate.shape:
+        raise ValueError(f"shape mismatch: {tuple(reference.shape)} vs {tuple(estimate.shape)}")
+    noise = (reference - estimate).pow(2).sum().item()
+    signal = reference.pow(2).sum().item()
+    return {
+        "max_abs": (reference - estimate).abs().max().item() if reference.numel() > 0 else 0.0,
+        "rel_l2": math.sqrt(noise / max(signal, 1e-12)),
+        "snr_db": 10 * math.log10(max(signal, 1e-12) / max(noise, 1e-12)),
+    }
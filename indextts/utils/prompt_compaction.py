@@ -0,0 +1,144 @@
+from typing import Optional, Tuple
+
+import torch
+
+# the flat cut of the reference audios without compaction
+DEFAULT_PROMPT_SECONDS = 15.0
+
+
+def voiced_frames(audio: torch.Tensor, sr: int, frame_ms: float = 20.0, threshold_db: float = -40.0,
+                  floor_db: float = -60.0) -> torch.Tensor:
+    """
+    Energy voice activity of ``audio`` (1, samples): the frames louder than the loudest frame + ``threshold_db``
+    and than ``floor_db`` dBFS.
+
+    Returns:
+        bool tensor of shape (frames,).
+    """
+    frame = max(1, int(sr * frame_ms / 1000))
+    num_frames = audio.size(-1) // frame
+    if num_frames == 0:
+        return torch.zeros(0, dtype=torch.bool)
+    frames = audio.reshape(-1)[:num_frames * frame].float().view(num_frames, frame)
+    energy_db = 10 * torch.log10(frames.pow(2).mean(dim=1) + 1e-10)
+    return (energy_db > energy_db.max() + threshold_db) & (energy_db > floor_db)
+
+
+def best_window(voiced: torch.Tensor, start: int, end: int, length: int) -> Tuple[int, int]:
+    """
+    The window of ``length`` frames within [start, end) with the most voiced frames, the first one on ties.
+    """
+    if end - start <= length:
+        return start, end
+    counts = torch.cumsum(torch.cat([voiced.new_zeros(1, dtype=torch.long), voiced[start:end].long()]), dim=0)
+    sums = counts[length:] - counts[:-length]
+    offset = int(torch.argmax(sums))
+    return start + offset, start + offset + length
+
+
+class PromptCompactor:
+    """
+    Select the parts of a reference audio used as prompts: leading and trailing silence trimmed by an energy VAD,
+    then the window with the most speech within the length cap of the GPT conditioning prompt (the input of the
+    conformer conditioning encoder of every segment) and of the s2mel prompt (the reference mel and style, the mel
+    being prepended to every segment in all the diffusion steps). Without compaction, the prompts are the first
+    seconds up to the caps.
+    """
+
+    def __init__(self, gpt_max_seconds: float = DEFAULT_PROMPT_SECONDS,
+                 s2mel_max_seconds: float = DEFAULT_PROMPT_SECONDS, enabled: bool = False,
+                 search_seconds: Optional[float] = 30.0, frame_ms: float = 20.0, threshold_db: float = -40.0,
+                 pad_ms: float = 100.0):
+        """
+        Args:
+            gpt_max_seconds: length cap of the GPT conditioning prompt.
+            s2mel_max_seconds: length cap of the s2mel mel prompt.
+            enabled: trim the silence and select the best windows, otherwise only cut at the caps.
+            search_seconds: with compaction, the decoded head of the reference audio to search the windows in,
+                None for the whole audio.
+            frame_ms: frame length of the VAD.
+            threshold_db: voiced frames are louder than the loudest frame + ``threshold_db``.
+            pad_ms: silence kept around the trimmed speech.
+        """
+        self.gpt_max_seconds = gpt_max_seconds
+        self.s2mel_max_seconds = s2mel_max_seconds
+        self.enabled = enabled
+        self.search_seconds = search_seconds
+        self.frame_ms = frame_ms
+        self.threshold_db = threshold_db
+        self.pad_ms = pad_ms
+
+    @property
+    def decode_seconds(self) -> Optional[float]:
+        """
+        Length of the head of the reference audios to decode.
+        """
+        max_seconds = max(self.gpt_max_seconds, self.s2mel_max_seconds)
+        if not self.enabled:
+            return max_seconds
+        return None if self.search_seconds is None else max(self.search_seconds, max_seconds)
+
+    def compact(self, audio: torch.Tensor, sr: int) -> dict:
+        """
+        Args:
+            audio: the reference audio (1, samples).
+            sr: its sample rate.
+
+        Returns:
+            dict of the ``gpt`` and ``s2mel`` windows (start, end) in seconds, the ``original_seconds`` and
+            ``trimmed_seconds`` lengths, and the ``baseline_seconds`` prompt length of the flat 15s cut.
+        """
+        original_seconds = audio.size(-1) / sr
+        frame_seconds = self.frame_ms / 1000
+        start, end = 0.0, original_seconds
+        voiced = None
+        if self.enabled:
+            voiced = voiced_frames(audio, sr, self.frame_ms, self.threshold_db)
+            indices = torch.nonzero(voiced).flatten()
+            if len(indices) > 0:
+                start = max(0.0, int(indices[0]) * frame_seconds - self.pad_ms / 1000)
+                end = min(original_seconds, (int(indices[-1]) + 1) * frame_seconds + self.pad_ms / 1000)
+
+        windows = {}
+        for name, max_seconds in (("gpt", self.gpt_max_seconds), ("s2mel", self.s2mel_max_seconds)):
+            if end - start <= max_seconds:
+                windows[name] = (start, end)
+            elif voiced is not None:
+                first, last = best_window(voiced, int(start / frame_seconds),
+                                          min(len(voiced), int(end / frame_seconds)),
+                                          int(max_seconds / frame_seconds))
+                windows[name] = (first * frame_seconds, min(end, last * frame_seconds))
+            else:
+                windows[name] = (start, start + max_seconds)
+        windows.update(original_seconds=original_seconds, trimmed_seconds=end - start,
+                       baseline_seconds=min(original_seconds, DEFAULT_PROMPT_SECONDS))
+        return windows
+
+    @staticmethod
+    def cut(audio: torch.Tensor, sr: int, window: Tuple[float, float]) -> torch.Tensor:
+        return audio[:, int(window[0] * sr):int(window[1] * sr)]
+
+    @staticmethod
+    def report(windows: dict) -> str:
+        baseline = windows["baseline_seconds"]
+        parts = [f">> prompt compaction: {windows['original_seconds']:.2f}s, "
+                 f"{windows['trimmed_seconds']:.2f}s after trimming the silence"]
+        for name in ("gpt", "s2mel"):
+            seconds = windows[name][1] - windows[name][0]
+            parts.append(f"{name} prompt {windows[name][0]:.2f}-{windows[name][1]:.2f}s "
+                         f"({(1 - seconds / baseline) * 100 if baseline > 0 else 0:.0f}% shorter than {baseline:.2f}s)")
+        return ", ".join(parts)
+
+    @staticmethod
+    def request_report(windows: dict, ref_frames: int, segments: int, diffusion_steps: int = 25) -> str:
+        """
+        Compute saved by the compaction in a request of ``segments`` segments, against the flat 15s cut.
+        """
+        gpt_seconds = windows["gpt"][1] - windows["gpt"][0]
+        s2mel_seconds = windows["s2mel"][1] - windows["s2mel"][0]
+        baseline = windows["baseline_seconds"]
+        saved_frames = max(0.0, ref_frames * baseline / max(s2mel_seconds, 1e-3) - ref_frames)
+        # the DiT runs the conditional and unconditional batch at every step
+        return (f">> prompt compaction saved {saved_frames:.0f} DiT prompt frames per segment, "
+                f"{saved_frames * segments * diffusion_steps * 2:.0f} frame evaluations in {segments} segments, "
+                f"and {max(0.0, baseline - gpt_seconds):.2f}s of conditioning audio per segment")
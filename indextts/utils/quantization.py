@@ -0,0 +1,284 @@
+from typing import Dict, Iterable, Optional, Union
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from transformers.pytorch_utils import Conv1D
+
+QUANTIZE_MODES = ("int8", "int4")
+
+
+def quantize_per_channel_int8(weight: torch.Tensor):
+    """
+    Symmetric per output channel int8 quantization, same scheme as `gpt_fast/quantize.py`.
+
+    Args:
+        weight: (out_features, in_features)
+    Returns:
+        int8 weight and the (out_features,) scales in the dtype of ``weight``.
+    """
+    w = weight.float()
+    max_val = w.abs().amax(dim=1)
+    scales = (max_val / 127.5).clamp(min=torch.finfo(torch.float32).eps)
+    quant = torch.round(w / scales.unsqueeze(-1)).clamp(-128, 127).to(torch.int8)
+    return quant, scales.to(weight.dtype)
+
+
+def quantize_groupwise_int4(weight: torch.Tensor, groupsize: int = 128):
+    """
+    Asymmetric group-wise uint4 quantization along the input features, two values packed per byte.
+
+    Args:
+        weight: (out_features, in_features), ``in_features`` must be divisible by ``groupsize``.
+    Returns:
+        packed (out_features, in_features // 2) uint8 weight, (out_features, n_groups) scales and zeros.
+    """
+    out_features, in_features = weight.shape
+    w = weight.float().reshape(out_features, -1, groupsize)
+    min_val = w.amin(dim=-1, keepdim=True)
+    max_val = w.amax(dim=-1, keepdim=True)
+    scales = ((max_val - min_val) / 15).clamp(min=1e-6)
+    quant = torch.round((w - min_val) / scales).clamp(0, 15).to(torch.uint8).reshape(out_features, in_features)
+    packed = quant[:, 0::2] | (quant[:, 1::2] << 4)
+    return packed, scales.squeeze(-1).to(weight.dtype), min_val.squeeze(-1).to(weight.dtype)
+
+
+# (kernel, device type) of the fused kernels missing in this build of PyTorch
+_MISSING_KERNELS = set()
+
+
+def _has_kernel(name: str, device: torch.device) -> bool:
+    return hasattr(torch.ops.aten, name) and (name, device.type) not in _MISSING_KERNELS
+
+
+def _no_kernel(name: str, device: torch.device):
+    print(f">> {name} is not available on {device.type}, the quantized weights are dequantized at each call")
+    _MISSING_KERNELS.add((name, device.type))
+
+
+class WeightOnlyInt8Linear(nn.Module):
+    """
+    ``nn.Linear`` with an int8 per-channel weight, the activations keep their dtype.
+    """
+
+    def __init__(self, in_features: int, out_features: int, bias: bool = True, dtype=torch.float32):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.register_buffer("weight", torch.empty((out_features, in_features), dtype=torch.int8))
+        self.register_buffer("scales", torch.ones(out_features, dtype=dtype))
+        self.register_buffer("bias", torch.zeros(out_features, dtype=dtype) if bias else None)
+
+    @classmethod
+    def from_float(cls, weight: torch.Tensor, bias: Optional[torch.Tensor]):
+        module = cls(weight.shape[1], weight.shape[0], bias=bias is not None, dtype=weight.dtype)
+        module.weight, module.scales = quantize_per_channel_int8(weight)
+        if bias is not None:
+            module.bias = bias.detach().clone()
+        return module.to(weight.device)
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        scales = self.scales.to(input.dtype)
+        if _has_kernel("_weight_int8pack_mm", input.device):
+            try:
+                # reads the int8 weight directly, no dequantized copy of the weight
+                output = torch.ops.aten._weight_int8pack_mm(input.reshape(-1, self.in_features), self.weight, scales)
+                output = output.reshape(*input.shape[:-1], self.out_features)
+            except (RuntimeError, NotImplementedError):
+                _no_kernel("_weight_int8pack_mm", input.device)
+                output = F.linear(input, self.weight.to(input.dtype)) * scales
+        else:
+            output = F.linear(input, self.weight.to(input.dtype)) * scales
+        if self.bias is not None:
+            output = output + self.bias.to(input.dtype)
+        return output
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}"
+
+
+class WeightOnlyInt4Linear(nn.Module):
+    """
+    ``nn.Linear`` with a group-wise uint4 weight. On CUDA the matmul is the tinygemm kernel
+    ``_weight_int4pack_mm`` of `gpt_fast/quantize.py` on a bf16 copy of the input, the weight being repacked to its
+    tiled layout at the first call. Elsewhere the weight is dequantized on the fly to the dtype of the input.
+    """
+
+    def __init__(self, in_features: int, out_features: int, bias: bool = True, groupsize: int = 128,
+                 dtype=torch.float32):
+        super().__init__()
+        assert in_features % groupsize == 0, f"in_features ({in_features}) must be divisible by {groupsize}"
+        self.in_features = in_features
+        self.out_features = out_features
+        self.groupsize = groupsize
+        n_groups = in_features // groupsize
+        self.register_buffer("weight", torch.empty((out_features, in_features // 2), dtype=torch.uint8))
+        self.register_buffer("scales", torch.ones((out_features, n_groups), dtype=dtype))
+        self.register_buffer("zeros", torch.zeros((out_features, n_groups), dtype=dtype))
+        self.register_buffer("bias", torch.zeros(out_features, dtype=dtype) if bias else None)
+        # the weight in the layout of `_weight_int4pack_mm` with its scales and zeros, not saved in the state dict
+        self._int4pack = None
+
+    @classmethod
+    def from_float(cls, weight: torch.Tensor, bias: Optional[torch.Tensor], groupsize: int = 128):
+        module = cls(weight.shape[1], weight.shape[0], bias=bias is not None, groupsize=groupsize, dtype=weight.dtype)
+        module.weight, module.scales, module.zeros = quantize_groupwise_int4(weight, groupsize)
+        if bias is not None:
+            module.bias = bias.detach().clone()
+        return module.to(weight.device)
+
+    def dequantize(self, dtype) -> torch.Tensor:
+        quant = torch.stack([self.weight & 0x0F, self.weight >> 4], dim=-1)
+        quant = quant.reshape(self.out_features, -1, self.groupsize).to(dtype)
+        weight = quant * self.scales.to(dtype).unsqueeze(-1) + self.zeros.to(dtype).unsqueeze(-1)
+        return weight.reshape(self.out_features, self.in_features)
+
+    def _pack_int4(self):
+        # uint4 q dequantized as q * scale + min, in gpt_fast as (q - 8) * scale + zero
+        quant = torch.stack([self.weight & 0x0F, self.weight >> 4], dim=-1).reshape(self.out_features, -1).int()
+        inner_k_tiles = next(tiles for tiles in (8, 4, 2) if self.in_features % (tiles * 16) == 0)
+        try:
+            # PyTorch >= 2.5 takes two values per byte, the first one in the high bits
+            weight = torch.ops.aten._convert_weight_to_int4pack((quant[:, ::2] << 4 | quant[:, 1::2]).to(torch.uint8),
+                                                                inner_k_tiles)
+        except RuntimeError:
+            weight = torch.ops.aten._convert_weight_to_int4pack(quant, inner_k_tiles)
+        scales = self.scales.to(torch.bfloat16)
+        zeros = (self.zeros.float() + 8 * self.scales.float()).to(torch.bfloat16)
+        scales_and_zeros = torch.stack([scales, zeros], dim=-1).transpose(0, 1).contiguous()
+        return weight, scales_and_zeros
+
+    def _use_int4pack(self, input: torch.Tensor) -> bool:
+        # the shapes supported by the kernel, see `gpt_fast/quantize.py`
+        return input.device.type == "cuda" and self.groupsize in (32, 64, 128, 256) and \
+            self.out_features % 8 == 0 and self.in_features % 32 == 0 and \
+            _has_kernel("_weight_int4pack_mm", input.device)
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        bias = self.bias.to(input.dtype) if self.bias is not None else None
+        if self._use_int4pack(input):
+            try:
+                if self._int4pack is None or self._int4pack[0].device != self.weight.device:
+                    self._int4pack = self._pack_int4()
+                weight, scales_and_zeros = self._int4pack
+                output = torch.ops.aten._weight_int4pack_mm(input.reshape(-1, self.in_features).to(torch.bfloat16),
+                                                            weight, self.groupsize, scales_and_zeros)
+                output = output.to(input.dtype).reshape(*input.shape[:-1], self.out_features)
+                return output + bias if bias is not None else output
+            except (RuntimeError, NotImplementedError):
+                _no_kernel("_weight_int4pack_mm", input.device)
+        return F.linear(input, self.dequantize(input.dtype), bias)
+
+    def extra_repr(self) -> str:
+        return (f"in_features={self.in_features}, out_features={self.out_features}, "
+                f"bias={self.bias is not None}, groupsize={self.groupsize}")
+
+
+def _linear_weight(module: nn.Module) -> Optional[torch.Tensor]:
+    if isinstance(module, nn.Linear) and not hasattr(module, "parametrizations") and not hasattr(module, "weight_g"):
+        return module.weight
+    if isinstance(module, Conv1D):
+        # HF GPT2 `Conv1D` stores the weight as (in_features, out_features)
+        return module.weight.t()
+    return None
+
+
+def _quantized_linear(module: nn.Module, mode: str, groupsize: int, empty: bool) -> Optional[nn.Module]:
+    weight = _linear_weight(module)
+    if weight is None:
+        return None
+    out_features, in_features = weight.shape
+    if mode == "int4" and in_features % groupsize == 0:
+        if empty:
+            return WeightOnlyInt4Linear(in_features, out_features, module.bias is not None, groupsize,
+                                        dtype=weight.dtype).to(weight.device)
+        return WeightOnlyInt4Linear.from_float(weight.detach(), module.bias, groupsize)
+    # int8, and the int4 fallback for layers that can't be split into groups
+    if empty:
+        return WeightOnlyInt8Linear(in_features, out_features, module.bias is not None,
+                                    dtype=weight.dtype).to(weight.device)
+    return WeightOnlyInt8Linear.from_float(weight.detach(), module.bias)
+
+
+@torch.no_grad()
+def quantize_module(root: nn.Module, path: str, mode: str = "int8", groupsize: int = 128, empty: bool = False) -> int:
+    """
+    Replace the linear layers (``nn.Linear`` and HF ``Conv1D``) of ``root.get_submodule(path)`` by
+    weight-only quantized layers, in place. Weight-normed linears are kept.
+
+    Args:
+        path: the submodule to quantize, may be a linear layer itself.
+        mode: ``"int8"`` or ``"int4"``, int4 falls back to int8 for layers not divisible by ``groupsize``.
+        empty: only build the quantized structure, to load a quantized state dict into.
+    Returns:
+        the number of replaced layers.
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}, expected one of {QUANTIZE_MODES}")
+    target = root.get_submodule(path)
+    quantized = _quantized_linear(target, mode, groupsize, empty)
+    if quantized is not None:
+        parent_path, _, name = path.rpartition(".")
+        setattr(root.get_submodule(parent_path), name, quantized)
+        return 1
+    count = 0
+    for name, child in target.named_children():
+        count += quantize_module(target, name, mode, groupsize, empty)
+    return count
+
+
+def save_quantized(root: nn.Module, paths: Iterable[str], mode: str, groupsize: int, output_path: str,
+                   sources: Optional[Dict[str, str]] = None):
+    """
+    Save the state dicts of the quantized submodules of ``root``, loaded back by `load_quantized`.
+
+    Args:
+        sources: the hashes of the checkpoints that were quantized, e.g. {"gpt.pth": sha1}, checked by
+            `check_quantized_sources`.
+    """
+    checkpoint = {
+        "mode": mode,
+        "groupsize": groupsize,
+        "sources": dict(sources or {}),
+        "modules": {path: root.get_submodule(path).state_dict() for path in paths},
+    }
+    torch.save(checkpoint, output_path)
+
+
+def check_quantized_sources(checkpoint: dict, sources: Dict[str, str]):
+    """
+    Raises:
+        ValueError: if the quantized checkpoint was not made from the checkpoints of ``sources``, the hashes of the
+            current ones: a stale checkpoint, written before the weights were updated.
+    """
+    saved = checkpoint.get("sources")
+    if not saved:
+        raise ValueError("The quantized checkpoint has no source hashes, quantize the model again")
+    for name, digest in sources.items():
+        if saved.get(name) != digest:
+            raise ValueError(f"The quantized checkpoint was not made from the current {name}, quantize the model again")
+
+
+@torch.no_grad()
+def load_quantized(root: nn.Module, checkpoint: Union[str, dict], mode: str,
+                   paths: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    """
+    Replace the submodules saved by `save_quantized` with their quantized version, skipping the quantization.
+
+    Args:
+        checkpoint: the path of the checkpoint, or the loaded checkpoint.
+        paths: only load these submodules, all the saved ones if ``None``.
+    Returns:
+        the number of quantized layers of each loaded submodule.
+    """
+    if isinstance(checkpoint, str):
+        checkpoint = torch.load(checkpoint, map_location="cpu")
+    if checkpoint["mode"] != mode:
+        raise ValueError(f"The checkpoint is quantized to {checkpoint['mode']}, not {mode}")
+    counts = {}
+    for path, state_dict in checkpoint["modules"].items():
+        if paths is not None and path not in paths:
+            continue
+        counts[path] = quantize_module(root, path, mode, checkpoint["groupsize"], empty=True)
+        root.get_submodule(path).load_state_dict(state_dict, strict=True)
+    return counts
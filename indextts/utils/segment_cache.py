@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import torch
+
+# generation options that do not change the audio of a segment
+_UNKEYED_OPTIONS = ("max_text_tokens_per_segment",)
+
+
+def segment_key(fingerprint: dict, tokens: Iterable[str], options: dict) -> str:
+    """
+    Args:
+        fingerprint: the model, voice and emotion settings of the request, see `IndexTTS2.encode_prompts`.
+        tokens: the sentencepiece tokens of the segment.
+        options: the generation options, see `IndexTTS2.generation_options`.
+
+    Returns:
+        the sha256 hex digest identifying the audio of the segment.
+    """
+    options = {name: value for name, value in options.items() if name not in _UNKEYED_OPTIONS}
+    payload = json.dumps({"fingerprint": fingerprint, "tokens": list(tokens), "options": options},
+                         sort_keys=True, ensure_ascii=False, default=repr)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def segment_seed(key: str) -> int:
+    """
+    The GPT sampling and DiT noise seed of the segment of ``key``, 63 bits for `torch.manual_seed`.
+    """
+    return int(key[:16], 16) & ((1 << 63) - 1)
+
+
+class SegmentAudioCache:
+    """
+    Cache of the final waveforms of the segments, keyed by `segment_key`: a LRU in memory bounded by bytes, and
+    optionally a directory on disk shared between processes and restarts. The waveforms are kept as int16, the
+    samples saved by `IndexTTS2.save_output`.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2, disk_dir: Optional[str] = None):
+        """
+        Args:
+            max_bytes: size of the in-memory tier, 0 disables it.
+            disk_dir: directory of the on-disk tier, one file per segment. None disables it.
+        """
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.pt")
+
+    def _remember(self, key: str, wav: torch.Tensor):
+        nbytes = wav.numel() * wav.element_size()
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = wav
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.numel() * evicted.element_size()
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        """
+        Returns:
+            the (1, samples) float waveform in the int16 range, as `IndexTTS2.vocode` returns it, or None.
+        """
+        with self._lock:
+            wav = self._entries.get(key)
+            if wav is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return wav.float()
+        if self.disk_dir is not None and os.path.exists(self._disk_path(key)):
+            try:
+                wav = torch.load(self._disk_path(key), map_location="cpu", weights_only=True)
+            except Exception as e:
+                # a partial or corrupted file: synthesize the segment again, it is rewritten
+                print(f">> segment cache: ignore unreadable {self._disk_path(key)}: {e}")
+            else:
+                self._remember(key, wav)
+                with self._lock:
+                    self.disk_hits += 1
+                return wav.float()
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, wav: torch.Tensor):
+        wav = wav.detach().cpu().to(torch.int16)
+        self._remember(key, wav)
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            torch.save(wav, tmp_path)
+            os.replace(tmp_path, path)
+
+    def clear(self):
+        """
+        Empty the in-memory tier, the files on disk are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "memory_hits": self.memory_hits,
+                    "disk_hits": self.disk_hits, "misses": self.misses}
+
+    def report(self) -> str:
+        metrics = self.metrics()
+        lookups = metrics["memory_hits"] + metrics["disk_hits"] + metrics["misses"]
+        hit_rate = (metrics["memory_hits"] + metrics["disk_hits"]) / lookups if lookups else 0.0
+        return (f"{metrics['entries']} segments ({metrics['bytes'] / 1024 ** 2:.1f} MB) in memory, "
+                f"hits: {metrics['memory_hits']} memory, {metrics['disk_hits']} disk, "
+                f"misses: {metrics['misses']}, hit rate {hit_rate:.1%}")
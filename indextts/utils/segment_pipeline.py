@@ -0,0 +1,178 @@
+import itertools
+import queue
+import threading
+import time
+from typing import Iterable, List, Optional
+
+import torch
+
+from indextts.utils.cpu_planner import auto_topology, parse_topology, set_thread_budget
+
+# end of the segments of a stage queue
+_END = None
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _record_event(device) -> Optional["torch.cuda.Event"]:
+    if torch.device(device).type != "cuda":
+        return None
+    # on the stream of the device of the tensors, not of the current device of the thread
+    event = torch.cuda.Event()
+    event.record(torch.cuda.current_stream(device))
+    return event
+
+
+def _wait_event(event, tensors):
+    # the tensors were produced on the stream of another thread: wait for them, and tell the caching allocator
+    # that they are used on this stream, so their memory is not reused before this stream is done with them
+    if event is None:
+        return
+    stream = torch.cuda.current_stream()
+    stream.wait_event(event)
+    for tensor in tensors:
+        tensor.record_stream(stream)
+
+
+class SegmentPipeline:
+    """
+    Overlap the stages of the segments of one request: the calling thread runs the GPT generation and latent
+    forward of the segments one after another, while a s2mel thread runs the DiT diffusion and a vocoder thread
+    BigVGAN for the segments already generated. The stages are connected by bounded queues, each stage handles the
+    segments in order, so the waveforms come out in order. On GPU every stage thread runs on its own CUDA stream.
+
+    With enough segments the wall clock approaches the time of the slowest stage instead of the sum of the stages.
+    """
+
+    def __init__(self, tts, queue_size: int = 2, topology=None):
+        """
+        Args:
+            tts: the `IndexTTS2` model.
+            queue_size: segments buffered between two stages, bounds the memory of the pending latents and mels.
+            topology: thread budgets of the ``gpt``, ``s2mel`` and ``vocoder`` stages on CPU, a spec for
+                `parse_topology` or a dict of `StageSpec`. By default the current intra-op threads are split by
+                `auto_topology`.
+        """
+        self.tts = tts
+        self.queue_size = queue_size
+        if topology is None and torch.device(tts.device).type == "cpu":
+            # the stage threads would each start as many intra-op threads as the caller: split them instead
+            topology = auto_topology(torch.get_num_threads())
+        elif topology is not None and not isinstance(topology, dict):
+            topology = parse_topology(topology)
+        self.topology = topology
+        self.stage_times = {}
+
+    def _stage_thread(self, name: str, fn, source: queue.Queue, sink: Optional[queue.Queue]):
+        if self.topology is not None:
+            set_thread_budget(self.topology[name].threads, self.topology[name].cpus)
+        stream = None
+        if self._cuda_device is not None:
+            # a new thread starts on the default CUDA device, not on the one of the model
+            torch.cuda.set_device(self._cuda_device)
+            stream = torch.cuda.Stream(device=self._cuda_device)
+        busy = 0.0
+        failed = None
+        while True:
+            item = source.get()
+            if item is _END or isinstance(item, _StageError):
+                break
+            if failed is not None:
+                # keep draining so that the upstream stage never blocks on a full queue
+                continue
+            try:
+                start = time.perf_counter()
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        result = fn(*item)
+                else:
+                    result = fn(*item)
+                busy += time.perf_counter() - start
+                if sink is not None:
+                    sink.put(result)
+            except BaseException as e:
+                failed = e
+                self._errors.append(e)
+                if sink is not None:
+                    sink.put(_StageError(e))
+        self.stage_times[name] = busy
+        if failed is None and sink is not None:
+            sink.put(item)
+
+    def _s2mel(self, index, event, codes, code_lens, latent, conditions, stats, seed):
+        _wait_event(event, (codes, code_lens, latent))
+        vc_target = self.tts.synthesize_mel(codes, code_lens, latent, conditions, stats, seed)
+        return index, _record_event(vc_target.device), vc_target, stats
+
+    def _vocoder(self, index, event, vc_target, stats):
+        _wait_event(event, (vc_target,))
+        self._wavs[index] = self.tts.vocode(vc_target, stats, self._verbose)
+
+    def run(self, segments: Iterable[List[str]], conditions: dict, options: dict, stats: dict,
+            verbose: bool = False, seeds: Optional[Iterable[Optional[int]]] = None) -> List[torch.Tensor]:
+        """
+        Synthesize the segments, the arguments are the ones of `IndexTTS2.generate_segment`. ``segments`` can be
+        an iterator, e.g. of a streamed text front end.
+
+        Args:
+            seeds: the seeds of the segments, in the same order, see `IndexTTS2.generate_segment`.
+
+        Returns:
+            the waveforms of the segments, in order.
+        """
+        segments_count = len(segments) if isinstance(segments, list) else None
+        self._wavs = {}
+        self._errors = []
+        self._verbose = verbose
+        self.stage_times = {}
+        device = torch.device(self.tts.device)
+        self._cuda_device = None
+        if device.type == "cuda":
+            # "cuda" is the current device of the calling thread
+            self._cuda_device = torch.device("cuda", device.index if device.index is not None
+                                             else torch.cuda.current_device())
+        mel_queue = queue.Queue(maxsize=self.queue_size)
+        wav_queue = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            threading.Thread(target=self._stage_thread, args=("s2mel", self._s2mel, mel_queue, wav_queue),
+                             name="indextts-s2mel", daemon=True),
+            threading.Thread(target=self._stage_thread, args=("vocoder", self._vocoder, wav_queue, None),
+                             name="indextts-vocoder", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        start_time = time.perf_counter()
+        num_threads = torch.get_num_threads()
+        if self.topology is not None:
+            torch.set_num_threads(self.topology["gpt"].threads)
+        try:
+            gpt_time = 0.0
+            seeds = itertools.repeat(None) if seeds is None else seeds
+            for seg_idx, (sent, seed) in enumerate(zip(segments, seeds)):
+                if self._errors:
+                    break
+                self.tts._set_segment_progress(seg_idx, segments_count)
+                m_start_time = time.perf_counter()
+                codes, code_lens, latent = self.tts.generate_segment(sent, conditions, options, stats, verbose, seed)
+                gpt_time += time.perf_counter() - m_start_time
+                mel_queue.put((seg_idx, _record_event(latent.device), codes, code_lens, latent, conditions, stats,
+                               seed))
+            self.stage_times["gpt"] = gpt_time
+        finally:
+            mel_queue.put(_END)
+            for thread in threads:
+                thread.join()
+            if self.topology is not None:
+                torch.set_num_threads(num_threads)
+        if self._errors:
+            raise self._errors[0]
+
+        wall_time = time.perf_counter() - start_time
+        print(f">> pipelined {len(self._wavs)} segments: {wall_time:.2f}s wall, stages " +
+              ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stage_times.items()) +
+              f", overlap saved {sum(self.stage_times.values()) - wall_time:.2f}s")
+        return [self._wavs[index] for index in range(len(self._wavs))]
@@ -0,0 +1,106 @@
+import atexit
+import os
+import re
+import shutil
+from typing import Dict, Optional
+
+# environment variables passed from the server parent process to its workers
+SHARED_BUNDLE_ENV = "INDEXTTS_SHARED_BUNDLE"
+
+# the shared copies, and their partial copies, named by the pid of the process that published them
+_SHARED_NAME_RE = re.compile(r"indextts2-(\d+)\.bundle\.safetensors(\.tmp)?")
+
+
+def publish_shared_bundle(bundle_path: str, shm_dir: Optional[str] = "/dev/shm") -> str:
+    """
+    Copy a model bundle once into shared memory (tmpfs) for the worker processes, which map it with
+    `ModelBundle(path, zero_copy=True)`: its pages are then resident once for all the workers, and not evicted under
+    page cache pressure like the pages of a file on disk. The copy is removed when the calling process exits, the
+    copies left by the processes that did not exit cleanly are removed by the next call.
+
+    Args:
+        shm_dir: tmpfs directory, if ``None``, not available or without enough free space for the bundle, the bundle
+            file is shared through the page cache.
+    Returns:
+        the path of the bundle to map in the workers.
+    """
+    if not shm_dir or not os.path.isdir(shm_dir):
+        return os.path.abspath(bundle_path)
+    remove_stale_bundles(shm_dir)
+    size = os.path.getsize(bundle_path)
+    free = shutil.disk_usage(shm_dir).free
+    if free < size:
+        print(f">> {shm_dir} has {free / 1024 ** 2:.0f} MB free for the {size / 1024 ** 2:.0f} MB bundle, "
+              f"the bundle is shared through the page cache")
+        return os.path.abspath(bundle_path)
+    shared_path = os.path.join(shm_dir, f"indextts2-{os.getpid()}.bundle.safetensors")
+    # the workers never see a partial copy
+    partial_path = shared_path + ".tmp"
+    try:
+        shutil.copyfile(bundle_path, partial_path)
+        os.replace(partial_path, shared_path)
+    except OSError as e:
+        # e.g. the tmpfs filled up during the copy
+        _remove_file(partial_path)
+        print(f">> failed to copy the bundle to {shm_dir}: {e}, the bundle is shared through the page cache")
+        return os.path.abspath(bundle_path)
+    atexit.register(_remove_file, shared_path)
+    return shared_path
+
+
+def remove_stale_bundles(shm_dir: str):
+    """
+    Remove the shared copies published by processes that are no longer running (killed before their exit handlers).
+    """
+    for name in os.listdir(shm_dir):
+        match = _SHARED_NAME_RE.fullmatch(name)
+        if match is not None and not _is_running(int(match.group(1))):
+            _remove_file(os.path.join(shm_dir, name))
+
+
+def _is_running(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running as another user
+        return True
+    return True
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, int]:
+    """
+    Resident memory of a process in bytes:
+
+    - ``rss``: total resident set.
+    - ``shared``: resident pages of mapped files and shared memory, shared with the other processes mapping them.
+    - ``private``: anonymous resident pages of this process only.
+    """
+    status_path = f"/proc/{pid or 'self'}/status"
+    if os.path.exists(status_path):
+        fields = {}
+        with open(status_path) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile", "RssShmem"):
+                    fields[key] = int(value.split()[0]) * 1024
+        if "VmRSS" in fields:
+            return {
+                "rss": fields["VmRSS"],
+                "shared": fields.get("RssFile", 0) + fields.get("RssShmem", 0),
+                "private": fields.get("RssAnon", 0),
+            }
+    import psutil
+    info = psutil.Process(pid).memory_info()
+    shared = getattr(info, "shared", 0)
+    return {"rss": info.rss, "shared": shared, "private": info.rss - shared}
@@ -25,7 +25,13 @@ echo "模型文件检查完成"
 export PYTORCH_CUDA_ALLOC_CONF="max_split_size_mb:512"
 export CUDA_LAUNCH_BLOCKING=1
 export OMP_NUM_THREADS=4
+# CPU推理：各阶段的线程预算，见 API_USAGE.md；为空时所有阶段共用 OMP_NUM_THREADS 个线程
+CPU_TOPOLOGY=${CPU_TOPOLOGY:-}
+CPU_TOPOLOGY_ARGS=()
+if [ -n "$CPU_TOPOLOGY" ]; then
+    CPU_TOPOLOGY_ARGS=(--cpu-topology "$CPU_TOPOLOGY")
+fi
 
 # 启动API服务器
 echo "启动API服务器..."
-nohup uv run api_server.py --host 0.0.0.0 --port 8040 --model-dir models/IndexTTS-2 > uvicorn.log 2>&1 &
\ No newline at end of file
+nohup uv run api_server.py --host 0.0.0.0 --port 8040 --model-dir models/IndexTTS-2 "${CPU_TOPOLOGY_ARGS[@]}" > uvicorn.log 2>&1 &
\ No newline at end of file
@@ -0,0 +1,87 @@
+import torch
+from omegaconf import OmegaConf
+from torch.nn import functional as F
+
+from indextts.gpt.attention_backend import ATTN_BACKENDS, is_attn_backend_available
+from indextts.gpt.model_v2 import UnifiedVoice
+
+
+def run_prefill_and_decode(gpt, conds, text_tokens, next_tokens):
+    """
+    Prefill with the left-padded batch, then feed `next_tokens` step by step through the KV cache.
+    Returns the last-position logits of every step: [steps+1, b, vocab]
+    """
+    fake_inputs, inputs_embeds, attention_mask = gpt.prepare_gpt_inputs(conds, text_tokens)
+    gpt.inference_model.store_mel_emb(inputs_embeds)
+    input_ids = fake_inputs
+    past_key_values = None
+    logits = []
+    for step in range(next_tokens.shape[1] + 1):
+        model_inputs = gpt.inference_model.prepare_inputs_for_generation(
+            input_ids, past_key_values=past_key_values, attention_mask=attention_mask, use_cache=True
+        )
+        outputs = gpt.inference_model(**model_inputs, return_dict=True)
+        logits.append(outputs.logits[:, -1].float())
+        past_key_values = outputs.past_key_values
+        if step < next_tokens.shape[1]:
+            input_ids = torch.cat([input_ids, next_tokens[:, step:step + 1]], dim=1)
+            attention_mask = F.pad(attention_mask, (0, 1), value=1)
+    return torch.stack(logits, dim=0)
+
+
+if __name__ == "__main__":
+    """
+    Parity of the GPT2 attention backends (eager/sdpa/flash) over prefill + decode steps with left-padded batches.
+    The weights are random, only the config is read:
+    ```
+    python tests/attention_backend_test.py checkpoints
+    ```
+    """
+    import sys
+    import transformers
+    transformers.set_seed(42)
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    dtype = torch.float16 if device.startswith("cuda") else torch.float32
+    cfg = OmegaConf.load(f"{model_dir}/config.yaml")
+    # a smaller GPT to keep the test fast, the attention code path is the same
+    gpt_cfg = OmegaConf.merge(cfg.gpt, {"layers": 4, "model_dim": 256, "heads": 4})
+    gpt = UnifiedVoice(**gpt_cfg).to(device=device, dtype=dtype).eval()
+
+    batch_size, text_len, steps = 6, 24, 8
+    text_lengths = torch.tensor([24, 20, 13, 7, 3, 1])
+    text_tokens = torch.randint(2, gpt.number_text_tokens, (batch_size, text_len))
+    positions = torch.arange(text_len).unsqueeze(0)
+    text_tokens[positions >= text_lengths.unsqueeze(-1)] = gpt.stop_text_token
+    # move part of the padding of half of the batch to the left
+    text_tokens[3:] = text_tokens[3:].roll(text_len // 2, dims=1)
+    text_tokens = text_tokens.to(device)
+    conds = torch.randn(batch_size, 32, gpt.model_dim, device=device, dtype=dtype)
+    next_tokens = torch.randint(0, gpt.number_mel_codes - 2, (batch_size, steps), device=device)
+
+    atol = 1e-2 if dtype == torch.float16 else 1e-4
+    with torch.no_grad():
+        gpt.post_init_gpt2_config(kv_cache=True, attn_backend="eager")
+        baseline = run_prefill_and_decode(gpt, conds, text_tokens, next_tokens)
+        mismatch = []
+        for backend in ("sdpa", "flash"):
+            if not is_attn_backend_available(gpt.gpt, ATTN_BACKENDS[backend], device, dtype):
+                print(f"{backend}: not available on {device}, skipped")
+                continue
+            gpt.post_init_gpt2_config(kv_cache=True, attn_backend=backend)
+            logits = run_prefill_and_decode(gpt, conds, text_tokens, next_tokens)
+            max_diff = (logits - baseline).abs().max().item()
+            print(f"{backend} vs eager: max abs diff {max_diff:.3e}")
+            if not torch.allclose(logits, baseline, atol=atol, rtol=1e-3):
+                # report the first diverging step of every mismatched row
+                for i in range(batch_size):
+                    diff = (logits[:, i] - baseline[:, i]).abs().amax(dim=-1)
+                    bad_steps = (diff > atol).nonzero().flatten().tolist()
+                    if bad_steps:
+                        mismatch.append((backend, i, bad_steps[0]))
+    print("--"*10)
+    if len(mismatch) > 0:
+        print("mismatch (backend, row, first step):", mismatch)
+    else:
+        print("all matched")
+    print("Test finished.")
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+import torch
+import torchaudio
+
+from indextts.utils.audio_prep import PromptAudioLoader, get_resampler, load_audio_head
+
+
+if __name__ == "__main__":
+    """
+    Check the truncated decode and the shared resampling of the reference audios, and time them against the
+    previous librosa path:
+    ```
+    python tests/audio_prep_test.py
+    ```
+    """
+    import librosa
+    sr = 44100
+    t = np.arange(sr * 40) / sr
+    stereo = np.stack([np.sin(2 * np.pi * 220 * t), np.sin(2 * np.pi * 330 * t)], axis=1).astype(np.float32) * 0.5
+    path = os.path.join(tempfile.mkdtemp(), "long_prompt.wav")
+    sf.write(path, stereo, sr)
+
+    audio, orig_sr = load_audio_head(path, 15)
+    assert orig_sr == sr and audio.shape == (1, 15 * sr), audio.shape
+    assert torch.allclose(audio[0], torch.from_numpy(stereo[:15 * sr].mean(axis=1)), atol=1e-6)
+    assert get_resampler(sr, 16000) is get_resampler(sr, 16000)
+
+    loader = PromptAudioLoader(max_seconds=15)
+    prompt_audio = loader.load(path)
+    assert loader.load(path) is prompt_audio, "the speaker and emotion prompts must share the decode"
+    audio_22k = prompt_audio.at(22050)
+    audio_16k = prompt_audio.at(16000)
+    assert audio_22k.shape[1] <= 15 * 22050 and audio_16k.shape[1] <= 15 * 16000
+
+    # same signal as the librosa path, up to the resampling filters
+    ref_16k = librosa.load(path, sr=16000)[0][:15 * 16000]
+    n = min(len(ref_16k), audio_16k.shape[1])
+    error = (audio_16k[0, :n] - torch.from_numpy(ref_16k[:n])).abs().max().item()
+    print(f">> max abs difference to librosa at 16k: {error:.5f}")
+    assert error < 1e-2
+
+    start = time.perf_counter()
+    audio, _ = librosa.load(path)
+    audio = torch.tensor(audio).unsqueeze(0)[:, :15 * 22050]
+    torchaudio.transforms.Resample(22050, 16000)(audio)
+    librosa.load(path, sr=16000)
+    librosa_time = time.perf_counter() - start
+    start = time.perf_counter()
+    prompt_audio = PromptAudioLoader(max_seconds=15).load(path)
+    prompt_audio.at(22050)
+    prompt_audio.at(16000)
+    fast_time = time.perf_counter() - start
+    print(f">> librosa: {librosa_time * 1000:.1f}ms, audio_prep: {fast_time * 1000:.1f}ms")
+    print("all passed")
+    print("Test finished.")
@@ -0,0 +1,54 @@
+import random
+
+from indextts.utils.front import TextTokenizer
+
+SENTENCE_TOKENS = TextTokenizer.punctuation_marks_tokens
+CLAUSE_TOKENS = TextTokenizer.clause_marks_tokens
+
+
+def random_document(sentences, seed=0):
+    rng = random.Random(seed)
+    tokens = []
+    for _ in range(sentences):
+        for _ in range(rng.randint(1, 3)):
+            tokens += ["▁w"] + ["ord"] * rng.randint(0, 1) + ["▁w"] * rng.randint(2, 25) + ["▁,"]
+        tokens[-1] = "."
+    return tokens
+
+
+if __name__ == "__main__":
+    """
+    Compare the greedy and the length-balanced segmenters on random documents: segment lengths and expected
+    padding waste of the batched synthesis.
+    ```
+    python tests/balanced_segments_test.py [max_text_tokens_per_segment] [bucket_size]
+    ```
+    """
+    import sys
+    max_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    bucket_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    failed = 0
+    for seed in range(5):
+        tokens = random_document(60, seed)
+        greedy = TextTokenizer.split_segments_by_token(tokens, SENTENCE_TOKENS, max_tokens)
+        balanced = TextTokenizer.split_segments_balanced(tokens, max_tokens, SENTENCE_TOKENS, CLAUSE_TOKENS)
+        if [t for s in balanced for t in s] != tokens:
+            print(f"seed {seed}: the balanced segments must cover the tokens in order")
+            failed += 1
+        if max(len(s) for s in balanced) > max_tokens:
+            print(f"seed {seed}: balanced segment longer than {max_tokens}")
+            failed += 1
+        sentence_ends = sum(s[-1] in SENTENCE_TOKENS for s in balanced)
+        for name, segments in (("greedy", greedy), ("balanced", balanced)):
+            lengths = [len(s) for s in segments]
+            print(f">> seed {seed} {name:>8}: {len(segments)} segments, lengths {min(lengths)}-{max(lengths)}, "
+                  f"padding waste {TextTokenizer.padding_waste(segments, bucket_size):.1%} (buckets of {bucket_size})")
+        print(f"   balanced segments ending a sentence: {sentence_ends}/{len(balanced)}")
+        if min(len(s) for s in balanced) < min(len(s) for s in greedy):
+            print(f"seed {seed}: the balanced segmenter left a shorter segment than the greedy one")
+            failed += 1
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
@@ -0,0 +1,106 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+
+from indextts.utils.batch import BatchRunner, ZipStream, group_by_voice, parse_manifest, read_status, \
+    resolve_output_dir
+
+EXTRA_LINES = [
+    '{"id": "greeting", "voice": "voice_01.wav", "text": "欢迎致电我们的客服中心。", "temperature": 0.7}',
+    '{"id": "greeting", "voice": "voice_02.wav", "text": "duplicate id"}',
+    '{"voice": "voice_01.wav"}',
+    '{"voice": "missing.wav", "text": "missing voice file"}',
+    '{"voice": "voice_01.wav", "text": "unknown field", "speed": 1.2}',
+    'not json',
+]
+
+
+if __name__ == "__main__":
+    """
+    Parse the example manifest with a few invalid lines, check the grouping by voice and the zip stream, then run
+    the examples as a batch:
+    ```
+    python tests/batch_test.py [checkpoints]
+    ```
+    """
+    import sys
+    failed = 0
+    base_dir = tempfile.mkdtemp()
+    with open("examples/cases.jsonl", encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    lines += EXTRA_LINES
+    # placeholders of the example audios, only their existence is checked by the parser
+    for line in lines[:-1]:
+        record = json.loads(line)
+        for key in ("prompt_audio", "voice", "emo_audio"):
+            if record.get(key) and record[key] != "missing.wav":
+                open(os.path.join(base_dir, record[key]), "wb").close()
+
+    items = parse_manifest(lines, base_dir=base_dir)
+    invalid = [item for item in items if "error" in item]
+    if len(items) != len(lines) or len(invalid) != 5:
+        print("invalid items:", invalid)
+        failed += 1
+    by_id = {item["id"]: item for item in items}
+    vector_item = next(item for item in items if "error" not in item and item["infer"]["emo_vector"] is not None)
+    if not vector_item["infer"].get("normalize_emo_vector") or vector_item["infer"]["emo_vector"][2] != 0.8:
+        print("emo_mode 2:", vector_item)
+        failed += 1
+    if by_id["greeting"]["infer"]["temperature"] != 0.7 or by_id["00000"]["infer"]["emo_audio_prompt"] is not None:
+        print("generation options and emo_mode 0:", by_id["greeting"], by_id["00000"])
+        failed += 1
+    valid = [item for item in items if "error" not in item]
+    grouped = group_by_voice(valid)
+    voices = [item["infer"]["spk_audio_prompt"] for item in grouped]
+    if sorted(voices) != sorted(item["infer"]["spk_audio_prompt"] for item in valid) or \
+            any(voice in voices[:i] and voice != voices[i - 1] for i, voice in enumerate(voices)):
+        print("the items of a voice must be consecutive:", voices)
+        failed += 1
+
+    archive = ZipStream()
+    chunks = [archive.add_bytes("a.txt", b"a" * 1000), archive.add_bytes("status.jsonl", b"{}\n"), archive.close()]
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as f:
+        if f.namelist() != ["a.txt", "status.jsonl"] or f.read("a.txt") != b"a" * 1000:
+            print("zip stream:", f.namelist())
+            failed += 1
+
+    if resolve_output_dir(base_dir, "jobs/a") != os.path.join(os.path.realpath(base_dir), "jobs", "a"):
+        print("output dir:", resolve_output_dir(base_dir, "jobs/a"))
+        failed += 1
+    for output_dir in ("../outside", "/tmp/outside", "jobs/../..", "."):
+        try:
+            resolve_output_dir(base_dir, output_dir)
+            print(f"the output dir {output_dir} must be rejected")
+            failed += 1
+        except ValueError:
+            pass
+
+    if len(sys.argv) > 1:
+        model_dir = sys.argv[1]
+        from indextts.infer_v2 import IndexTTS2
+        tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir)
+        output_dir = tempfile.mkdtemp()
+        with open("examples/cases.jsonl", encoding="utf-8") as f:
+            items = parse_manifest(f, base_dir="examples")
+        records = list(BatchRunner(tts, output_dir).run(items))
+        print(">> statuses:", [record["status"] for record in records])
+        status = read_status(output_dir)
+        if len(status) != len(items) or any(record["status"] != "done" for record in status.values()):
+            print("status file:", status)
+            failed += 1
+        # run again: every item is done
+        again = list(BatchRunner(tts, output_dir).run(items))
+        if [record.get("seconds") for record in again] != [status[item["id"]].get("seconds") for item in items]:
+            print("the items done must be skipped")
+            failed += 1
+        shutil.rmtree(output_dir)
+    shutil.rmtree(base_dir)
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
@@ -0,0 +1,49 @@
+import os
+import sys
+
+if __name__ == "__main__":
+    """
+    Write a bundle of the checkpoints, then check that the offline bundle load gives the same weights:
+    ```
+    python tests/bundle_test.py checkpoints
+    ```
+    """
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    bundle_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(model_dir, "indextts2.bundle.safetensors")
+
+    from indextts.utils.bundle import write_indextts2_bundle
+    if not os.path.exists(bundle_path):
+        write_indextts2_bundle(model_dir, os.path.join(model_dir, "config.yaml"), bundle_path)
+    import torch
+    from indextts.infer_v2 import IndexTTS2
+    reference = {}
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, device="cpu", use_cuda_kernel=False,
+                    qwen_emo_lazy=False, qwen_emo_device="cpu")
+    for name in ("gpt", "semantic_model", "semantic_codec", "s2mel", "campplus_model", "bigvgan"):
+        reference[name] = {k: v.clone() for k, v in getattr(tts, name).state_dict().items()}
+    reference["qwen_emo"] = {k: v.clone() for k, v in tts.qwen_emo.model.state_dict().items()}
+    reference_tokens = tts.tokenizer.encode("大家好，我现在正在bilibili 体验 ai 科技。")
+    del tts
+
+    # run with HF_HUB_OFFLINE=1 and an existing bundle to check that nothing else is read
+    tts = IndexTTS2(bundle_path=bundle_path, model_dir="/nonexistent", device="cpu", use_cuda_kernel=False,
+                    qwen_emo_lazy=False, qwen_emo_device="cpu")
+    mismatched = []
+    for name, state_dict in reference.items():
+        module = tts.qwen_emo.model if name == "qwen_emo" else getattr(tts, name)
+        bundled = module.state_dict()
+        if set(bundled) != set(state_dict):
+            mismatched.append((name, "keys", sorted(set(bundled) ^ set(state_dict))[:5]))
+            continue
+        for key, value in state_dict.items():
+            if not torch.equal(bundled[key].cpu(), value.cpu()):
+                mismatched.append((name, key))
+        print(f"{name}: {len(state_dict)} tensors compared")
+    if tts.tokenizer.encode("大家好，我现在正在bilibili 体验 ai 科技。") != reference_tokens:
+        mismatched.append(("tokenizer",))
+    print("--"*10)
+    if len(mismatched) > 0:
+        print("mismatched:", mismatched)
+    else:
+        print("all matched")
+    print("Test finished.")
@@ -0,0 +1,53 @@
+import torch
+from omegaconf import OmegaConf
+
+from indextts.s2mel.modules.commons import MyModel
+
+
+def random_cfm(cfg):
+    torch.manual_seed(0)
+    cfm = MyModel(cfg, use_gpt_latent=True).models["cfm"].eval()
+    # the final layers are zero initialized, their output would not depend on the input
+    with torch.no_grad():
+        for param in cfm.parameters():
+            param.add_(torch.randn_like(param) * 0.05)
+    cfm.estimator.setup_caches(max_batch_size=1, max_seq_length=2048)
+    return cfm
+
+
+if __name__ == "__main__":
+    """
+    The mel of the CFM with the sequence padded to a length bucket (as with `use_torch_compile`) must be the one of
+    the unpadded sequence, with a small random DiT of the s2mel config:
+    ```
+    python tests/cfm_padding_test.py [checkpoints]
+    ```
+    """
+    import sys
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    cfg = OmegaConf.load(f"{model_dir}/config.yaml").s2mel
+    cfg.DiT.depth = 2
+    cfg.wavenet.num_layers = 3
+    cfm = random_cfm(cfg)
+    failed = 0
+    for prompt_frames, frames in ((40, 150), (64, 257)):
+        mu = torch.randn(1, prompt_frames + frames, cfg.DiT.content_dim)
+        prompt = torch.randn(1, cfg.DiT.in_channels, prompt_frames)
+        style = torch.randn(1, cfg.style_encoder.dim)
+        x_lens = torch.LongTensor([mu.size(1)])
+        outputs = []
+        for buckets in (None, [128, 256, 384, 512]):
+            cfm.length_buckets = buckets
+            generator = torch.Generator().manual_seed(1)
+            outputs.append(cfm.inference(mu, x_lens, prompt, style, None, 4, generator=generator))
+        diff = (outputs[0] - outputs[1]).abs().max().item()
+        print(f">> {mu.size(1)} frames: max difference {diff:.2e}")
+        if outputs[0].shape != outputs[1].shape or diff > 1e-4:
+            print(f"{mu.size(1)} frames: the padded frames change the mel")
+            failed += 1
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
@@ -0,0 +1,63 @@
+import time
+
+import torch
+
+TEXTS = [
+    "大家好，我现在正在bilibili 体验 ai 科技。",
+    "There is a vehicle arriving in dock number 7?",
+    "今天天气真好，我们一起去公园散步吧，顺便买点水果。",
+]
+
+
+def run(tts, prompt_wav, rounds):
+    times = []
+    for _ in range(rounds):
+        for i, text in enumerate(TEXTS):
+            start = time.perf_counter()
+            tts.infer(spk_audio_prompt=prompt_wav, text=text, output_path=f"outputs/compile_{i}.wav")
+            times.append(time.perf_counter() - start)
+    return times
+
+
+if __name__ == "__main__":
+    """
+    Compare the eager and the compiled models: compile time of the first pass, steady-state speedup of the next ones.
+    Run it twice to check that the second run loads the compiled artifacts from the cache:
+    ```
+    python tests/compile_test.py checkpoints cpu
+    ```
+    """
+    import sys
+    from indextts.gpt.static_kv import StaticKVCache, round_up
+    from indextts.utils.compilation import bucket_length, pad_to_bucket
+
+    assert bucket_length(300) == 320 and bucket_length(320) == 320 and bucket_length(10000) == 10000
+    padded, length = pad_to_bucket(torch.ones(1, 80, 300), value=-1.0)
+    assert padded.shape == (1, 80, 320) and length == 300 and padded[0, 0, -1].item() == -1.0
+    past = [(torch.randn(3, 2, 5, 4), torch.randn(3, 2, 5, 4))]
+    cache = StaticKVCache(past, round_up(7, 4))
+    cache.reorder_cache(torch.tensor([2, 0, 0]))
+    assert cache.capacity == 8 and torch.equal(cache.keys[0][0, :, :5], past[0][0][2])
+
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    device = sys.argv[2] if len(sys.argv) > 2 else None
+    prompt_wav = "tests/sample_prompt.wav"
+    from indextts.infer_v2 import IndexTTS2
+
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, device=device, use_cuda_kernel=False)
+    run(tts, prompt_wav, 1)  # warm up
+    eager = run(tts, prompt_wav, 2)
+    del tts
+
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, device=device, use_cuda_kernel=False,
+                    use_torch_compile=True)
+    first = run(tts, prompt_wav, 1)
+    steady = run(tts, prompt_wav, 2)
+
+    print("--"*10)
+    print(tts.compile_stats.report())
+    print(f"first pass (compile or cache load): {sum(first):.2f}s")
+    print(f"eager: {sum(eager):.2f}s, compiled steady state: {sum(steady):.2f}s, "
+          f"speedup {sum(eager) / sum(steady):.2f}x")
+    print("all passed")
+    print("Test finished.")
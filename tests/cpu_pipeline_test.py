@@ -0,0 +1,81 @@
+import os
+import time
+
+from indextts.utils.cpu_planner import CPUPipelineExecutor, parse_topology
+
+TEXTS = [
+    "大家好，我现在正在bilibili 体验 ai 科技，说实话，来之前我绝对想不到！",
+    "There is a vehicle arriving in dock number 7?",
+    "今天天气真好，我们一起去公园散步吧。",
+    "The weather is really nice today, perfect for studying at home. Thank you!",
+]
+
+
+if __name__ == "__main__":
+    """
+    Run the same requests one by one with `infer`, then through the per-stage CPU thread pools, and compare the
+    throughput:
+    ```
+    python tests/cpu_pipeline_test.py checkpoints "frontend:1,prompt:2,gpt:4,s2mel:6,vocoder:2"
+    ```
+    """
+    import sys
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    spec = sys.argv[2] if len(sys.argv) > 2 else "auto"
+    prompt_wav = "tests/sample_prompt.wav"
+
+    topology = parse_topology("frontend:1,prompt:2,gpt:4,s2mel:6x1,vocoder:2x2@0-3+8")
+    assert topology["vocoder"].workers == 2 and topology["vocoder"].cpus == [0, 1, 2, 3, 8]
+    assert repr(topology["vocoder"]) == "vocoder:2x2@0+1+2+3+8"
+    try:
+        parse_topology("gpt:4x2")
+        raise AssertionError("several GPT workers must be rejected")
+    except ValueError:
+        pass
+
+    from indextts.infer_v2 import IndexTTS2
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, device="cpu", use_cuda_kernel=False)
+    os.makedirs("outputs", exist_ok=True)
+
+    start = time.perf_counter()
+    for i, text in enumerate(TEXTS):
+        tts.infer(spk_audio_prompt=prompt_wav, text=text, output_path=f"outputs/serial_{i}.wav")
+    serial_time = time.perf_counter() - start
+
+    executor = CPUPipelineExecutor(tts, spec)
+    start = time.perf_counter()
+    futures = [executor.submit(spk_audio_prompt=prompt_wav, text=text, output_path=f"outputs/pipelined_{i}.wav")
+               for i, text in enumerate(TEXTS)]
+    results = [future.result() for future in futures]
+    pipelined_time = time.perf_counter() - start
+
+    # the seeds derived from the segments are the ones of `infer`, up to the float differences of the thread counts
+    failed = 0
+    _, expected = tts.infer(spk_audio_prompt=prompt_wav, text=TEXTS[0], output_path=None, deterministic=True)
+    _, actual = executor.submit(spk_audio_prompt=prompt_wav, text=TEXTS[0], output_path=None,
+                                deterministic=True).result()
+    if expected.shape != actual.shape:
+        print(f"deterministic: {actual.shape} samples through the executor, {expected.shape} with infer")
+        failed += 1
+    try:
+        from indextts.utils.incremental import IncrementalSession
+        executor.submit(spk_audio_prompt=prompt_wav, text=TEXTS[0], output_path=None, session=IncrementalSession())
+        print("a request with a session must be rejected")
+        failed += 1
+    except ValueError:
+        pass
+    executor.shutdown()
+
+    print("--"*10)
+    for name, metrics in executor.metrics().items():
+        print(f"{name:>8}: {metrics}")
+    print(f"serial: {serial_time:.2f}s, pipelined: {pipelined_time:.2f}s, speedup {serial_time / pipelined_time:.2f}x")
+    missing = [path for path in results if not os.path.exists(path)]
+    if len(missing) > 0:
+        print("missing outputs:", missing)
+        failed += 1
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
@@ -0,0 +1,70 @@
+import time
+
+from indextts.utils.document_frontend import DocumentFrontend, split_chunks
+from indextts.utils.front import TextNormalizer, TextTokenizer
+
+PARAGRAPHS = [
+    "《盗梦空间》是由美国华纳兄弟影片公司出品的电影，由克里斯托弗·诺兰执导并编剧，2010年7月16日在美国上映。",
+    "影片剧情游走于梦境与现实之间，讲述了造梦师带领特工团队进入他人梦境，从他人的潜意识中盗取机密的故事。",
+    "The weather is really nice today, perfect for studying at home. It costs $12.5, only 2.5% of the budget!",
+    "清晨拉开窗帘，阳光洒在窗台的花艺礼盒上。设计师将“自然绽放美学”融入每个细节，钛合金骨架仅3.2g无负重感。",
+]
+
+
+if __name__ == "__main__":
+    """
+    Normalize a long document by chunks in a process pool, and compare the streamed segments and the time to the
+    first segment with the tokenization of the whole text:
+    ```
+    python tests/document_frontend_test.py checkpoints/bpe.model 4
+    ```
+    """
+    import sys
+    vocab_file = sys.argv[1] if len(sys.argv) > 1 else "checkpoints/bpe.model"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    text = "\n".join(PARAGRAPHS * 25)
+    failed = 0
+
+    chunks = split_chunks(text, chunk_chars=500)
+    if "".join(chunks) != text or max(len(chunk) for chunk in chunks) > 500:
+        print("the chunks must cover the text and respect chunk_chars")
+        failed += 1
+
+    tokenizer = TextTokenizer(vocab_file, TextNormalizer(), cache_size=0)
+    start = time.perf_counter()
+    expected = tokenizer.tokenize(text)
+    whole_segments = tokenizer.split_segments(expected, 120)
+    whole_time = time.perf_counter() - start
+
+    frontend = DocumentFrontend(vocab_file=vocab_file, workers=workers, chunk_chars=500)
+    # warm up the workers, they load their normalizers
+    list(frontend.segments(PARAGRAPHS[0] * 2, tokenizer.split_segments))
+    start = time.perf_counter()
+    first_segment_time = None
+    segments = []
+    for segment in frontend.segments(text, tokenizer.split_segments, 120):
+        if first_segment_time is None:
+            first_segment_time = time.perf_counter() - start
+        segments.append(segment)
+    streamed_time = time.perf_counter() - start
+    frontend.shutdown()
+
+    tokens = [token for segment in segments for token in segment]
+    # the chunks choose their zh/en normalizer by themselves, the same as tokenizing them one by one
+    chunk_tokens = [token for chunk in split_chunks(text, 500) for token in tokenizer.tokenize(chunk)]
+    if tokens != chunk_tokens:
+        print(f"streamed tokens differ from the chunks tokenized in process: {len(tokens)} vs {len(chunk_tokens)}")
+        failed += 1
+    if tokens != expected:
+        print(f">> note: {len(tokens)} tokens by chunks, {len(expected)} tokens for the whole text")
+    if max(len(segment) for segment in segments) > 120:
+        print("segment longer than max_text_tokens_per_segment")
+        failed += 1
+    print(f">> whole text: {whole_time:.2f}s, {len(whole_segments)} segments")
+    print(f">> {workers} workers: first segment after {first_segment_time:.2f}s, all in {streamed_time:.2f}s, "
+          f"{len(segments)} segments")
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
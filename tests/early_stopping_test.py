@@ -0,0 +1,73 @@
+import torch
+
+from indextts.utils.early_stopping import EarlyStopLogitsProcessor
+
+STOP = 8193
+SILENT = 52
+PROMPT = 5
+
+
+def rows(*generated):
+    # the generated tokens after a prompt of PROMPT tokens, padded to the same length on the left with speech
+    length = max(len(tokens) for tokens in generated)
+    padded = [[100 + i % 7 * 13 for i in range(length - len(tokens))] + list(tokens) for tokens in generated]
+    return torch.cat([torch.zeros(len(generated), PROMPT, dtype=torch.long), torch.tensor(padded)], dim=1)
+
+
+if __name__ == "__main__":
+    """
+    The silence, loop and length budget checks of the early stopping of the GPT decoding:
+    ```
+    python tests/early_stopping_test.py
+    ```
+    """
+    failed = 0
+    processor = EarlyStopLogitsProcessor(STOP, PROMPT, silent_token=SILENT, max_silent_tokens=100)
+    speech = [100 + (i * 37) % 501 for i in range(150)]
+
+    cases = [
+        ("speech", speech, False),
+        # a pause shorter than max_silent_tokens is natural, it must not stop as a loop of period 2..10
+        ("40 silent tokens", speech[:60] + [SILENT] * 40, False),
+        ("99 silent tokens", speech[:30] + [SILENT] * 99, False),
+        ("100 silent tokens", speech[:30] + [SILENT] * 100, True),
+        ("a constant run of another token", speech[:30] + [777] * 60, False),
+        ("a loop of period 3", speech[:60] + [11, 12, 13] * 14, True),
+        ("a loop of period 10", speech[:30] + list(range(200, 210)) * 4, True),
+        ("a loop shorter than min_loop_tokens", speech[:60] + [11, 12, 13] * 12, False),
+        ("a loop of silence and speech", speech[:60] + [SILENT, 300] * 20, True),
+    ]
+    for name, tokens, expected in cases:
+        stopped = processor.degenerate_mask(rows(tokens))[0].item()
+        if stopped != expected:
+            print(f"{name}: stopped={stopped}, expected {expected}")
+            failed += 1
+
+    # the rows of a batch are checked independently
+    mask = processor.degenerate_mask(rows(speech[:100], speech[:20] + [SILENT] * 100, speech[:58] + [11, 12] * 21))
+    if mask.tolist() != [False, True, True]:
+        print("batch:", mask.tolist())
+        failed += 1
+
+    budget = EarlyStopLogitsProcessor(STOP, PROMPT, length_budget=torch.tensor([50, 80]))
+    for length, expected in ((49, [False, False]), (50, [True, False]), (80, [True, True])):
+        mask = budget.degenerate_mask(rows(speech[:length], speech[:length]))
+        if mask.tolist() != expected:
+            print(f"length budget at {length} tokens: {mask.tolist()}, expected {expected}")
+            failed += 1
+    # expanded by num_beams
+    mask = budget.degenerate_mask(rows(*[speech[:60]] * 4))
+    if mask.tolist() != [True, True, False, False]:
+        print("length budget of the beams:", mask.tolist())
+        failed += 1
+
+    scores = processor(rows(speech[:20] + [SILENT] * 100, speech[:100]), torch.zeros(2, STOP + 1))
+    if scores[0].argmax().item() != STOP or scores[0, 0].item() != -float("inf") or scores[1].abs().sum() != 0:
+        print("the stopped row must be forced to the stop token, the others unchanged")
+        failed += 1
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
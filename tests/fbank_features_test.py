@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+import torch
+from transformers import SeamlessM4TFeatureExtractor
+
+from indextts.utils.feature_extractors import SeamlessM4TFbankFeatures
+
+
+if __name__ == "__main__":
+    """
+    Compare the torch fbank features of w2v-bert with the `SeamlessM4TFeatureExtractor` of transformers, for single
+    utterances and for a padded batch:
+    ```
+    python tests/fbank_features_test.py [cuda]
+    ```
+    """
+    import sys
+    device = sys.argv[1] if len(sys.argv) > 1 else "cpu"
+    hf_extractor = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
+    fbank_features = SeamlessM4TFbankFeatures.from_hf(hf_extractor).to(device)
+
+    rng = np.random.default_rng(0)
+    # odd and even frame counts, a prompt of 15s
+    lengths = [16000 * 3 + 123, 16000 * 5, 16000 * 15, 5000]
+    wavs = []
+    for length in lengths:
+        t = np.arange(length) / 16000
+        wav = 0.3 * np.sin(2 * np.pi * rng.uniform(100, 400) * t) + 0.05 * rng.standard_normal(length)
+        wavs.append(torch.from_numpy(wav.astype(np.float32)).unsqueeze(0))
+
+    failed = 0
+    hf_time = torch_time = 0.0
+    for wav in wavs:
+        start = time.perf_counter()
+        inputs = hf_extractor(wav, sampling_rate=16000, return_tensors="pt")
+        hf_time += time.perf_counter() - start
+        start = time.perf_counter()
+        input_features, attention_mask = fbank_features(wav)
+        torch_time += time.perf_counter() - start
+        error = (input_features.cpu() - inputs["input_features"]).abs().max().item()
+        same_mask = torch.equal(attention_mask.cpu(), inputs["attention_mask"].to(torch.int32))
+        shape_ok = input_features.shape == inputs["input_features"].shape
+        print(f">> {wav.shape[1]} samples: features {tuple(input_features.shape)}, max abs error {error:.2e}, "
+              f"mask matched: {same_mask}")
+        if not shape_ok or not same_mask or error > 1e-3:
+            failed += 1
+    print(f">> HF: {hf_time * 1000:.1f}ms, torch ({device}): {torch_time * 1000:.1f}ms")
+
+    # padded batch: the same as the utterances extracted one by one
+    hf_batch = hf_extractor([wav[0].numpy() for wav in wavs], sampling_rate=16000, return_tensors="pt")
+    input_features, attention_mask = fbank_features([wav[0] for wav in wavs])
+    error = (input_features.cpu() - hf_batch["input_features"]).abs().max().item()
+    same_mask = torch.equal(attention_mask.cpu(), hf_batch["attention_mask"].to(torch.int32))
+    print(f">> batch of {len(wavs)}: features {tuple(input_features.shape)}, max abs error {error:.2e}, "
+          f"mask matched: {same_mask}")
+    if input_features.shape != hf_batch["input_features"].shape or not same_mask or error > 1e-3:
+        failed += 1
+
+    if failed:
+        print(f"{failed} mismatched")
+    else:
+        print("all matched")
+    print("Test finished.")
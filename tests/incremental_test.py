@@ -0,0 +1,100 @@
+import functools
+import random
+import time
+
+from indextts.utils.front import TextTokenizer
+from indextts.utils.incremental import IncrementalSession, plan_segments
+
+SCRIPT = [
+    "清晨拉开窗帘，阳光洒在窗台的花艺礼盒上。",
+    "设计师将自然绽放美学融入每个细节。",
+    "今天天气真好，我们一起去公园散步吧。",
+    "The weather is really nice today, perfect for studying at home.",
+    "大家好，我现在正在bilibili 体验 ai 科技，说实话，来之前我绝对想不到！",
+    "影片剧情游走于梦境与现实之间。",
+]
+
+
+def random_script(sentences, seed=0):
+    rng = random.Random(seed)
+    tokens = []
+    for _ in range(sentences):
+        tokens += ["▁w" + str(rng.randint(0, 50)) for _ in range(rng.randint(3, 30))] + [rng.choice([".", "!", "?"])]
+    return tokens
+
+
+if __name__ == "__main__":
+    """
+    Align the segments of edited scripts with the previous ones, then synthesize a script, edit one sentence and
+    synthesize it again with the same session:
+    ```
+    python tests/incremental_test.py [checkpoints]
+    ```
+    """
+    import sys
+    failed = 0
+    split = functools.partial(TextTokenizer.split_segments_by_token, split_tokens=TextTokenizer.punctuation_marks_tokens,
+                              max_text_tokens_per_segment=60)
+    for seed in range(5):
+        tokens = random_script(300, seed)
+        old_segments = split(tokens)
+        rng = random.Random(seed)
+        edited = list(tokens)
+        for _ in range(3):
+            # replace a few words in a sentence, insert a sentence and delete a few words
+            position = rng.randrange(len(edited) - 10)
+            edited[position:position + 2] = ["▁edit", "▁ed"]
+            position = rng.randrange(len(edited))
+            edited[position:position] = ["▁new", "▁sentence", "."]
+            position = rng.randrange(len(edited) - 10)
+            del edited[position:position + 3]
+        start = time.perf_counter()
+        plan = plan_segments(old_segments, edited, split)
+        elapsed = time.perf_counter() - start
+        if [token for segment, _ in plan for token in segment] != edited:
+            print(f"seed {seed}: the planned segments must cover the edited tokens in order")
+            failed += 1
+        if any(old_idx is not None and segment != old_segments[old_idx] for segment, old_idx in plan):
+            print(f"seed {seed}: a reused segment differs from the old one")
+            failed += 1
+        reused = sum(old_idx is not None for _, old_idx in plan)
+        print(f">> seed {seed}: {len(tokens)} tokens, {len(old_segments)} segments, {reused} reused, "
+              f"{len(plan) - reused} to synthesize, aligned in {elapsed * 1000:.1f}ms")
+        if len(plan) - reused > 20:
+            print(f"seed {seed}: 9 edits must not re-synthesize {len(plan) - reused} segments")
+            failed += 1
+        if [old_idx for _, old_idx in plan_segments(old_segments, tokens, split)] != list(range(len(old_segments))):
+            print(f"seed {seed}: an unchanged script must reuse all its segments")
+            failed += 1
+
+    if len(sys.argv) > 1:
+        model_dir = sys.argv[1]
+        from indextts.infer_v2 import IndexTTS2
+        tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir)
+        session = IncrementalSession()
+        start = time.perf_counter()
+        _, first = tts.infer("tests/sample_prompt.wav", "".join(SCRIPT), None, max_text_tokens_per_segment=30,
+                             session=session)
+        first_time = time.perf_counter() - start
+        first_segments = list(session.segments)
+        edited_script = list(SCRIPT)
+        edited_script[2] = "今天天气不太好，我们在家看书吧。"
+        start = time.perf_counter()
+        _, second = tts.infer("tests/sample_prompt.wav", "".join(edited_script), None, max_text_tokens_per_segment=30,
+                              session=session)
+        print(f">> full synthesis {first_time:.2f}s, after the edit {time.perf_counter() - start:.2f}s")
+        kept = [segment for segment in session.segments if segment in first_segments]
+        if len(kept) < len(first_segments) - 2:
+            print(f"only {len(kept)}/{len(first_segments)} segments reused after editing a sentence")
+            failed += 1
+        # the audio before the edited sentence is the same
+        head = session.wav(0).shape[-1]
+        if (first[:head] != second[:head]).any():
+            print("the first segment must be reused as it is")
+            failed += 1
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
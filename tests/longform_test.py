@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+
+import soundfile as sf
+
+from indextts.utils.longform import IncrementalWavWriter, LongFormJob, split_chapters, verified_prefix, _sha1
+
+DOCUMENT = """第一章 出发
+清晨拉开窗帘，阳光洒在窗台的花艺礼盒上。设计师将自然绽放美学融入每个细节。
+今天天气真好，我们一起去公园散步吧。
+
+第二章 归来
+The weather is really nice today, perfect for studying at home. Thank you!
+大家好，我现在正在bilibili 体验 ai 科技，说实话，来之前我绝对想不到！
+"""
+
+
+if __name__ == "__main__":
+    """
+    Check the incremental WAV writer and the chapter split, then run a long-form job, simulate a crash after its
+    first segments and resume it:
+    ```
+    python tests/longform_test.py [checkpoints]
+    ```
+    """
+    import sys
+    failed = 0
+    tmp_dir = tempfile.mkdtemp()
+
+    chapters = split_chapters(DOCUMENT)
+    if [title for title, _ in chapters] != ["第一章 出发", "第二章 归来"] or "".join(t for _, t in chapters) != DOCUMENT:
+        print("chapters:", chapters)
+        failed += 1
+
+    wav_path = os.path.join(tmp_dir, "incremental.wav")
+    writer = IncrementalWavWriter(wav_path, 22050)
+    records = []
+    for value in (1, 2, 3):
+        pcm = value.to_bytes(2, "little", signed=True) * 22050
+        writer.append(pcm)
+        records.append({"bytes": len(pcm), "sha1": _sha1(pcm)})
+        # valid after every append
+        if sf.info(wav_path).frames != 22050 * value:
+            print("frames after append:", sf.info(wav_path).frames)
+            failed += 1
+    writer.close()
+    # a crash while writing the fourth segment, resumed after the second one
+    with open(wav_path, "ab") as f:
+        f.write(b"\x07" * 1000)
+    if verified_prefix(wav_path, records + [{"bytes": 2000, "sha1": "0"}]) != 3:
+        print("verified prefix:", verified_prefix(wav_path, records))
+        failed += 1
+    writer = IncrementalWavWriter(wav_path, 22050, data_bytes=sum(r["bytes"] for r in records[:2]))
+    writer.close()
+    if sf.info(wav_path).frames != 22050 * 2 or verified_prefix(wav_path, records) != 2:
+        print("resumed file frames:", sf.info(wav_path).frames)
+        failed += 1
+
+    if len(sys.argv) > 1:
+        model_dir = sys.argv[1]
+        from indextts.infer_v2 import IndexTTS2
+        tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir)
+        output_dir = os.path.join(tmp_dir, "book")
+        job = LongFormJob(tts, "tests/sample_prompt.wav", output_dir, text=DOCUMENT, max_text_tokens_per_segment=20)
+        outputs = job.run()
+        with open(os.path.join(output_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        complete = [sf.info(path).frames for path in outputs]
+        # crash: the last chapter lost its last segment and is not done
+        chapter = manifest["chapters"][-1]
+        chapter["completed"] = chapter["completed"][:-1]
+        chapter["done"] = False
+        with open(os.path.join(output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        LongFormJob(tts, "tests/sample_prompt.wav", output_dir, text=DOCUMENT, max_text_tokens_per_segment=20).run()
+        resumed = [sf.info(path).frames for path in outputs]
+        print(f">> chapter frames: {complete}, after resuming: {resumed}")
+        if len(resumed) != 2 or resumed[0] != complete[0]:
+            print("the first chapter must not be synthesized again")
+            failed += 1
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
@@ -0,0 +1,32 @@
+from indextts.utils.mel_budget import MelBudgetEstimator
+
+MAX_MEL_TOKENS = 1815
+
+if __name__ == "__main__":
+    """
+    The budget of the segments without counted syllables must not be capped to `min_tokens`:
+    ```
+    python tests/mel_budget_test.py
+    ```
+    """
+    failed = 0
+    estimator = MelBudgetEstimator(code_rate=25, max_mel_tokens=MAX_MEL_TOKENS)
+    for text in ("こんにちは、いい天気ですね。", "안녕하세요, 만나서 반갑습니다.", "……！？"):
+        expected, budget = estimator.estimate(text)
+        if budget != MAX_MEL_TOKENS:
+            print(f"{text}: budget {budget}, expected {MAX_MEL_TOKENS}")
+            failed += 1
+        elif expected <= 0:
+            print(f"{text}: expected length {expected}")
+            failed += 1
+    # the counted segments keep their estimated budget
+    expected, budget = estimator.estimate("今天天气真好，我们一起去公园散步吧。")
+    if not 0 < expected < budget < MAX_MEL_TOKENS:
+        print(f"counted syllables: expected {expected}, budget {budget}")
+        failed += 1
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
@@ -0,0 +1,123 @@
+import random
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from indextts.utils.mel_codes import postprocess_mel_codes
+
+STOP = 8193
+SILENT = 52
+
+
+def remove_long_silence_loop(codes, stop_mel_token=STOP, silent_token=SILENT, max_consecutive=30):
+    """
+    The per-row loop of `IndexTTS2.remove_long_silence` before `postprocess_mel_codes`, the reference.
+    """
+    code_lens = []
+    codes_list = []
+    isfix = False
+    for i in range(0, codes.shape[0]):
+        code = codes[i]
+        if not torch.any(code == stop_mel_token).item():
+            len_ = code.size(0)
+        else:
+            stop_mel_idx = (code == stop_mel_token).nonzero(as_tuple=False)
+            len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
+
+        count = torch.sum(code == silent_token).item()
+        if count > max_consecutive:
+            ncode_idx = []
+            n = 0
+            for k in range(len_):
+                if code[k] != silent_token:
+                    ncode_idx.append(k)
+                    n = 0
+                elif code[k] == silent_token and n < 10:
+                    ncode_idx.append(k)
+                    n += 1
+            len_ = len(ncode_idx)
+            codes_list.append(code[ncode_idx])
+            isfix = True
+        else:
+            codes_list.append(code[:len_])
+        code_lens.append(len_)
+    if isfix:
+        if len(codes_list) > 1:
+            codes = pad_sequence(codes_list, batch_first=True, padding_value=stop_mel_token)
+        else:
+            codes = codes_list[0].unsqueeze(0)
+    max_len = max(code_lens)
+    if max_len < codes.shape[1]:
+        codes = codes[:, :max_len]
+    return codes, torch.tensor(code_lens, dtype=torch.long)
+
+
+def random_row(rng, length, silent_runs, stop_at=None):
+    row = [rng.randrange(0, 8192) for _ in range(length)]
+    for _ in range(silent_runs):
+        start = rng.randrange(length)
+        run = rng.randint(1, 60)
+        row[start:start + run] = [SILENT] * len(row[start:start + run])
+    if stop_at is not None and stop_at < length:
+        # generation goes on after the stop of this row while the other rows of the batch are decoded
+        row[stop_at] = STOP
+        row[stop_at + 1:] = [rng.choice([STOP, SILENT, rng.randrange(0, 8192)]) for _ in row[stop_at + 1:]]
+    return row
+
+
+if __name__ == "__main__":
+    """
+    Parity of the vectorized `postprocess_mel_codes` with the per-row loop it replaced:
+    ```
+    python tests/mel_codes_test.py
+    ```
+    """
+    failed = 0
+    rng = random.Random(0)
+    cases = {
+        "a long silent run": [[7, 8] + [SILENT] * 50 + [9, STOP]],
+        "silent runs of 30 tokens in total": [[SILENT] * 20 + [5] + [SILENT] * 10 + [6, STOP, STOP]],
+        "31 silent tokens, some after the stop": [[SILENT] * 25 + [5, STOP] + [SILENT] * 6],
+        "no stop token": [[1, 2] + [SILENT] * 40 + [3, SILENT, 4]],
+        "only a stop token": [[STOP, SILENT, 3]],
+        "rows of different lengths": [[1, 2, 3, STOP, STOP, STOP, STOP], [1, 2, 3, 4, 5, 6, STOP],
+                                      [1, 2, 3, 4, 5, 6, 7]],
+        "a shrunk row in a batch": [[1] + [SILENT] * 40 + [2, STOP, STOP], [1, 2, 3] + [SILENT] * 20 + [4] * 20],
+    }
+    for seed in range(50):
+        length = rng.randint(1, 400)
+        cases[f"random batch {seed}"] = [
+            random_row(rng, length, rng.randint(0, 6), rng.choice([None, rng.randrange(length + 1)]))
+            for _ in range(rng.randint(1, 6))
+        ]
+
+    for name, rows in cases.items():
+        codes = torch.tensor(rows)
+        expected, expected_lens = remove_long_silence_loop(codes)
+        actual, actual_lens = postprocess_mel_codes(codes, STOP, silent_token=SILENT, max_consecutive=30)
+        if not torch.equal(actual_lens, expected_lens) or actual.shape != expected.shape:
+            print(f"{name}: lengths {actual_lens.tolist()} {tuple(actual.shape)}, "
+                  f"expected {expected_lens.tolist()} {tuple(expected.shape)}")
+            failed += 1
+            continue
+        # the codes after the length of a row are padding, stop tokens in the packed codes
+        for row, length in enumerate(expected_lens.tolist()):
+            if not torch.equal(actual[row, :length], expected[row, :length]):
+                print(f"{name}: row {row} differs")
+                failed += 1
+            elif (actual[row, length:] != STOP).any():
+                print(f"{name}: row {row} must be padded with the stop token")
+                failed += 1
+
+    # max_consecutive=None only cuts at the stop token
+    codes = torch.tensor([[1] + [SILENT] * 40 + [STOP, 3], [2] * 10 + [SILENT] * 5 + [4] * 28])
+    actual, actual_lens = postprocess_mel_codes(codes, STOP, max_consecutive=None)
+    if actual_lens.tolist() != [41, 43] or not torch.equal(actual[0, :41], codes[0, :41]):
+        print("max_consecutive=None:", actual_lens.tolist())
+        failed += 1
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
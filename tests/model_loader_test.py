@@ -0,0 +1,53 @@
+import threading
+
+import torch.nn as nn
+
+from indextts.utils.model_loader import init_empty_weights
+
+
+if __name__ == "__main__":
+    """
+    `init_empty_weights` in a loader thread must not put the parameters of the modules built at the same time by the
+    other threads on the meta device:
+    ```
+    python tests/model_loader_test.py
+    ```
+    """
+    failed = 0
+    entered, built = threading.Event(), threading.Event()
+    modules = {}
+
+    def build_empty():
+        with init_empty_weights():
+            entered.set()
+            built.wait(timeout=10)
+            modules["empty"] = nn.Sequential(nn.Linear(8, 8), nn.LayerNorm(8), nn.Conv1d(8, 8, 3))
+
+    thread = threading.Thread(target=build_empty)
+    thread.start()
+    entered.wait(timeout=10)
+    modules["other thread"] = nn.Sequential(nn.Linear(8, 8), nn.LayerNorm(8))
+    built.set()
+    thread.join()
+
+    if not all(param.is_meta for param in modules["empty"].parameters()):
+        print("the parameters built in init_empty_weights must be on the meta device")
+        failed += 1
+    if any(param.is_meta for param in modules["other thread"].parameters()):
+        print("a module built by another thread meanwhile must keep its parameters")
+        failed += 1
+    # nested, and the patch does nothing after it
+    with init_empty_weights():
+        with init_empty_weights():
+            inner = nn.Linear(4, 4)
+        outer = nn.Linear(4, 4)
+    after = nn.Linear(4, 4)
+    if not (inner.weight.is_meta and outer.weight.is_meta) or after.weight.is_meta:
+        print("nested init_empty_weights:", inner.weight.device, outer.weight.device, after.weight.device)
+        failed += 1
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
@@ -66,6 +66,24 @@ if __name__ == "__main__":
         assert len(pad_text_tokens) == batched_text_tokens.shape[0] and batched_text_tokens.ndim == 2
         batch_output = tts.gpt.inference_speech(auto_conditioning, batched_text_tokens, **kwargs)
         del pad_text_tokens
+        # batched `prepare_gpt_inputs` vs. the per-row reference implementation
+        print("Compare batched prepare_gpt_inputs with the per-row loop...")
+        conds_latent = tts.gpt.get_conditioning(auto_conditioning, cond_mel_lengths)
+        random_text_tokens = torch.randint(2, tts.gpt.number_text_tokens, (64, 48), device=tts.device)
+        random_lengths = torch.randint(0, 49, (64,), device=tts.device)
+        positions = torch.arange(48, device=tts.device).unsqueeze(0)
+        random_text_tokens[positions >= random_lengths.unsqueeze(-1)] = 1 # right eos
+        random_text_tokens[positions < (48 - random_lengths.unsqueeze(-1)) // 2] = 0 # left bos
+        prepare_mismatch = []
+        for name, t, conds in [
+            ("padded", batched_text_tokens, conds_latent),
+            ("random", random_text_tokens, conds_latent),
+            ("random per-row conds", random_text_tokens, conds_latent.repeat(64, 1, 1)),
+        ]:
+            expected = tts.gpt.prepare_gpt_inputs_loop(conds, t)
+            actual = tts.gpt.prepare_gpt_inputs(conds, t)
+            if not all(e.equal(a) for e, a in zip(expected, actual)):
+                prepare_mismatch.append(name)
     mismatch_idx = []
     print("baseline:", baseline.shape, baseline)
     print("--"*10)
@@ -96,4 +114,11 @@ if __name__ == "__main__":
     else:
         print("all matched")
     
+    print("--"*10)
+    print("batched vs per-row prepare_gpt_inputs:")
+    if len(prepare_mismatch) > 0:
+        print("mismatch:", prepare_mismatch)
+    else:
+        print("all matched")
+
     print("Test finished.")
\ No newline at end of file
@@ -0,0 +1,90 @@
+import copy
+
+import torch
+
+from indextts.infer_v2 import IndexTTS2
+from indextts.utils.precision import cast_module, compare_tensors, precision_dtype
+from quantize_test import prepare_conditions, run_dit, run_gpt
+
+# minimal SNR in dB of every stage against fp32
+MIN_SNR = {"conditioning": 25.0, "gpt_latent": 20.0, "dit_mel": 15.0, "bigvgan_wav": 15.0}
+
+
+if __name__ == "__main__":
+    """
+    Per-stage error report of a reduced precision mode against fp32, every stage gets the fp32 inputs:
+    ```
+    python tests/precision_test.py checkpoints bf16 cpu
+    ```
+    """
+    import sys
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    precision = sys.argv[2] if len(sys.argv) > 2 else "bf16"
+    device = sys.argv[3] if len(sys.argv) > 3 else "cpu"
+    dtype = precision_dtype(precision)
+    audio_prompt = "tests/sample_prompt.wav"
+    texts = [
+        "晕 XUAN4 是 一 种 not very good GAN3 觉",
+        "大家好，我现在正在bilibili 体验 ai 科技，说实话，来之前我绝对想不到！AI技术已经发展到这样匪夷所思的地步了！",
+        "Translate for me, what is a surprise!",
+    ]
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, device=device, precision="fp32",
+                    use_cuda_kernel=False)
+    device_type = torch.device(tts.device).type
+    with torch.no_grad():
+        spk_cond_emb, ref_mel, style, prompt_condition = prepare_conditions(tts, audio_prompt)
+        # the same casts as `IndexTTS2(precision=...)`, on copies of the fp32 models
+        gpt = cast_module(copy.deepcopy(tts.gpt), dtype)
+        gpt.post_init_gpt2_config(kv_cache=True)
+        s2mel = copy.deepcopy(tts.s2mel)
+        cast_module(s2mel.models['cfm'], dtype)
+        vocoder = cast_module(copy.deepcopy(tts.bigvgan), dtype)
+
+        def autocast():
+            return torch.amp.autocast(device_type, dtype=dtype)
+
+        cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=tts.device)
+        reports = []
+        for i, text in enumerate(texts):
+            report = {}
+            text_tokens = tts.tokenizer.convert_tokens_to_ids(tts.tokenizer.tokenize(text))
+            text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=tts.device).unsqueeze(0)
+            # conformer/perceiver conditioning
+            ref_cond = tts.gpt.get_conditioning(spk_cond_emb.transpose(1, 2), cond_lengths)
+            ref_emovec = tts.gpt.merge_emovec(spk_cond_emb, spk_cond_emb, cond_lengths, cond_lengths)
+            with autocast():
+                cond = gpt.get_conditioning(spk_cond_emb.transpose(1, 2), cond_lengths)
+                emovec = gpt.merge_emovec(spk_cond_emb, spk_cond_emb, cond_lengths, cond_lengths)
+            report["conditioning"] = compare_tensors(torch.cat([ref_cond.flatten(), ref_emovec.flatten()]),
+                                                     torch.cat([cond.flatten(), emovec.flatten()]))
+            # GPT: greedy codes and the teacher-forced latent of the fp32 codes
+            ref_codes, _, ref_latent = run_gpt(tts.gpt, tts, spk_cond_emb, text_tokens)
+            with autocast():
+                codes, _, latent = run_gpt(gpt, tts, spk_cond_emb, text_tokens, codes=ref_codes)
+            report["gpt_latent"] = compare_tensors(ref_latent, latent)
+            min_len = min(ref_codes.shape[-1], codes.shape[-1])
+            agreement = (ref_codes[:, :min_len] == codes[:, :min_len]).float().mean().item()
+            # DiT
+            ref_mel_out = run_dit(tts.s2mel, tts, ref_latent, ref_codes, ref_mel, style, prompt_condition)
+            with autocast():
+                mel_out = run_dit(s2mel, tts, ref_latent, ref_codes, ref_mel, style, prompt_condition)
+            report["dit_mel"] = compare_tensors(ref_mel_out, mel_out)
+            # BigVGAN
+            ref_wav = tts.bigvgan(ref_mel_out.float())
+            with autocast():
+                wav = vocoder(ref_mel_out.float())
+            report["bigvgan_wav"] = compare_tensors(ref_wav, wav)
+
+            print(f"[{i}] codes: {ref_codes.shape[-1]} vs {codes.shape[-1]}, greedy agreement {agreement:.3f}")
+            for stage, errors in report.items():
+                print(f"    {stage:>12}: SNR {errors['snr_db']:6.2f} dB, rel_l2 {errors['rel_l2']:.2e}, "
+                      f"max_abs {errors['max_abs']:.2e}")
+            reports.append(report)
+    print("--"*10)
+    failed = [(i, stage) for i, report in enumerate(reports)
+              for stage, errors in report.items() if errors["snr_db"] < MIN_SNR[stage]]
+    if len(failed) > 0:
+        print(f"{precision} stages below the SNR thresholds {MIN_SNR}:", failed)
+    else:
+        print("all passed")
+    print("Test finished.")
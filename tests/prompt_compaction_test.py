@@ -0,0 +1,61 @@
+import torch
+
+from indextts.utils.prompt_compaction import PromptCompactor, voiced_frames
+
+
+def tone(seconds, sr, amplitude=0.3):
+    t = torch.arange(int(seconds * sr)) / sr
+    return amplitude * torch.sin(2 * torch.pi * 220 * t)
+
+
+if __name__ == "__main__":
+    """
+    Check the silence trimming and the window selection of the reference audios, optionally on a real prompt:
+    ```
+    python tests/prompt_compaction_test.py [tests/sample_prompt.wav]
+    ```
+    """
+    import sys
+    sr = 16000
+    # 2s silence, 4s speech, 3s near silence, 10s speech, 1s silence
+    audio = torch.cat([torch.zeros(2 * sr), tone(4, sr), tone(3, sr, 1e-5), tone(10, sr), torch.zeros(sr)]).unsqueeze(0)
+    failed = 0
+
+    voiced = voiced_frames(audio, sr)
+    if abs(voiced.sum().item() * 0.02 - 14) > 0.1:
+        print(f"voiced: {voiced.sum().item() * 0.02:.2f}s, expected 14s")
+        failed += 1
+
+    windows = PromptCompactor(enabled=False).compact(audio, sr)
+    if windows["gpt"] != (0.0, 15.0) or windows["s2mel"] != (0.0, 15.0):
+        print("without compaction the prompts must be the first 15s:", windows)
+        failed += 1
+
+    compactor = PromptCompactor(gpt_max_seconds=15, s2mel_max_seconds=8, enabled=True)
+    windows = compactor.compact(audio, sr)
+    print(compactor.report(windows))
+    print(compactor.request_report(windows, ref_frames=690, segments=4))
+    if abs(windows["trimmed_seconds"] - 17.2) > 0.05:
+        print(f"trimmed: {windows['trimmed_seconds']:.2f}s, expected 17.2s")
+        failed += 1
+    # the 8s window falls entirely in the 10s of speech
+    if not (9.0 - 1e-6 <= windows["s2mel"][0] and windows["s2mel"][1] <= 19.0 + 1e-6):
+        print("s2mel window outside of the speech:", windows["s2mel"])
+        failed += 1
+    if abs(windows["gpt"][1] - windows["gpt"][0] - 15) > 0.05:
+        print("gpt window:", windows["gpt"])
+        failed += 1
+    if abs(compactor.cut(audio, sr, windows["s2mel"]).shape[1] - 8 * sr) > 1:
+        print("cut length:", compactor.cut(audio, sr, windows["s2mel"]).shape)
+        failed += 1
+
+    if len(sys.argv) > 1:
+        from indextts.utils.audio_prep import load_audio_head
+        prompt, prompt_sr = load_audio_head(sys.argv[1], compactor.decode_seconds)
+        print(compactor.report(compactor.compact(prompt, prompt_sr)))
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
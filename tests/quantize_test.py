@@ -0,0 +1,150 @@
+import copy
+
+import torch
+import torch.nn as nn
+import torchaudio
+import transformers
+
+from indextts.infer_v2 import CONFORMER_QUANTIZE_TARGETS, DIT_QUANTIZE_TARGETS, GPT_QUANTIZE_TARGETS, IndexTTS2
+from indextts.utils.quantization import (
+    WeightOnlyInt4Linear, WeightOnlyInt8Linear, check_quantized_sources, quantize_module,
+)
+
+# minimal quality per mode: (teacher-forced GPT latent cosine similarity, DiT mel SNR in dB)
+THRESHOLDS = {"int8": (0.99, 20.0), "int4": (0.95, 10.0)}
+
+
+def prepare_conditions(tts, audio_prompt):
+    """
+    The speaker conditions of `IndexTTS2.infer`, the prompt is also used as the emotion reference.
+    """
+    audio, sr = tts._load_and_cut_audio(audio_prompt, 15)
+    audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
+    audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
+    inputs = tts.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
+    spk_cond_emb = tts.get_emb(inputs["input_features"].to(tts.device), inputs["attention_mask"].to(tts.device))
+    _, S_ref = tts.semantic_codec.quantize(spk_cond_emb)
+    ref_mel = tts.mel_fn(audio_22k.to(tts.device).float())
+    feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(tts.device), num_mel_bins=80, dither=0, sample_frequency=16000)
+    style = tts.campplus_model((feat - feat.mean(dim=0, keepdim=True)).unsqueeze(0))
+    prompt_condition = tts.s2mel.models['length_regulator'](
+        S_ref, ylens=torch.LongTensor([ref_mel.size(2)]).to(tts.device), n_quantizers=3, f0=None
+    )[0]
+    return spk_cond_emb, ref_mel, style, prompt_condition
+
+
+def run_gpt(gpt, tts, spk_cond_emb, text_tokens, codes=None, seed=42):
+    """
+    Greedy decoding with a fixed seed, then the teacher-forced latent of `codes` (the decoded codes if None).
+    """
+    cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=tts.device)
+    emovec = gpt.merge_emovec(spk_cond_emb, spk_cond_emb, cond_lengths, cond_lengths, alpha=1.0)
+    transformers.set_seed(seed)
+    generated, speech_conditioning_latent = gpt.inference_speech(
+        spk_cond_emb, text_tokens, spk_cond_emb, cond_lengths=cond_lengths, emo_cond_lengths=cond_lengths,
+        emo_vec=emovec, do_sample=False, num_beams=1, repetition_penalty=10.0, max_generate_length=500,
+    )
+    generated, _ = tts.remove_long_silence(generated, max_consecutive=None)
+    if codes is None:
+        codes = generated
+    code_lens = torch.tensor([codes.shape[-1]], device=tts.device)
+    latent = gpt(
+        speech_conditioning_latent, text_tokens, torch.tensor([text_tokens.shape[-1]], device=tts.device),
+        codes, code_lens, spk_cond_emb, cond_mel_lengths=cond_lengths, emo_cond_mel_lengths=cond_lengths,
+        emo_vec=emovec, use_speed=torch.zeros(1, device=tts.device).long(),
+    )
+    return generated, codes, latent
+
+
+def run_dit(s2mel, tts, latent, codes, ref_mel, style, prompt_condition, seed=42):
+    latent = s2mel.models['gpt_layer'](latent)
+    S_infer = tts.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1)).transpose(1, 2) + latent
+    target_lengths = (torch.tensor([codes.shape[-1]], device=tts.device) * 1.72).long()
+    cond = s2mel.models['length_regulator'](S_infer, ylens=target_lengths, n_quantizers=3, f0=None)[0]
+    cat_condition = torch.cat([prompt_condition, cond], dim=1)
+    torch.manual_seed(seed)
+    mel = s2mel.models['cfm'].inference(cat_condition, torch.LongTensor([cat_condition.size(1)]).to(tts.device),
+                                        ref_mel, style, None, 25, inference_cfg_rate=0.7)
+    return mel[:, :, ref_mel.size(-1):]
+
+
+def snr_db(reference, estimate):
+    noise = (reference - estimate).pow(2).sum()
+    return (10 * torch.log10(reference.pow(2).sum() / noise.clamp(min=1e-12))).item()
+
+
+if __name__ == "__main__":
+    """
+    Quality of the weight-only quantization against the fp32 outputs on fixed seeds:
+    ```
+    python tests/quantize_test.py checkpoints int8
+    python tests/quantize_test.py checkpoints int4 --conformer
+    ```
+    """
+    import sys
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    mode = sys.argv[2] if len(sys.argv) > 2 else "int8"
+    quantize_conformer = "--conformer" in sys.argv
+    audio_prompt = "tests/sample_prompt.wav"
+    texts = [
+        "晕 XUAN4 是 一 种 not very good GAN3 觉",
+        "大家好，我现在正在bilibili 体验 ai 科技，说实话，来之前我绝对想不到！AI技术已经发展到这样匪夷所思的地步了！",
+        "Translate for me, what is a surprise!",
+    ]
+    # the fused kernels (int8 on CPU, int4 tinygemm on CUDA) against the dequantized weights
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+    with torch.no_grad():
+        for device in devices:
+            weight, bias = torch.randn(256, 512, device=device), torch.randn(256, device=device)
+            x = torch.randn(3, 7, 512, device=device)
+            int8 = WeightOnlyInt8Linear.from_float(weight, bias)
+            int4 = WeightOnlyInt4Linear.from_float(weight, bias)
+            for layer, dequantized in ((int8, int8.weight.float() * int8.scales.float().unsqueeze(-1)),
+                                       (int4, int4.dequantize(torch.float32))):
+                reference = torch.nn.functional.linear(x, dequantized, bias)
+                cosine = torch.nn.functional.cosine_similarity(layer(x).flatten(), reference.flatten(), dim=0).item()
+                print(f"{type(layer).__name__} on {device}: cosine {cosine:.5f} with the dequantized weight")
+                assert cosine > 0.999, cosine
+    checkpoint = {"mode": mode, "sources": {"gpt.pth": "a", "s2mel.pth": "b"}}
+    check_quantized_sources(checkpoint, {"gpt.pth": "a", "s2mel.pth": "b"})
+    for sources in ({"gpt.pth": "c", "s2mel.pth": "b"}, {"other.pth": "a"}):
+        try:
+            check_quantized_sources(checkpoint, sources)
+            raise AssertionError(f"a checkpoint quantized from other weights must be rejected: {sources}")
+        except ValueError:
+            pass
+
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, use_fp16=False, use_cuda_kernel=False)
+    with torch.no_grad():
+        spk_cond_emb, ref_mel, style, prompt_condition = prepare_conditions(tts, audio_prompt)
+        # quantize copies, the fp32 models stay as reference
+        quantized = nn.ModuleDict({"gpt": copy.deepcopy(tts.gpt), "s2mel": copy.deepcopy(tts.s2mel)})
+        targets = GPT_QUANTIZE_TARGETS + DIT_QUANTIZE_TARGETS + (CONFORMER_QUANTIZE_TARGETS if quantize_conformer else ())
+        for path in targets:
+            print(f"{path}: {quantize_module(quantized, path, mode)} linear layers quantized to {mode}")
+        quantized.gpt.post_init_gpt2_config(kv_cache=True)
+
+        min_cosine, min_snr = THRESHOLDS[mode]
+        failed = []
+        for i, text in enumerate(texts):
+            text_tokens = tts.tokenizer.convert_tokens_to_ids(tts.tokenizer.tokenize(text))
+            text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=tts.device).unsqueeze(0)
+            ref_codes, _, ref_latent = run_gpt(tts.gpt, tts, spk_cond_emb, text_tokens)
+            q_codes, _, q_latent = run_gpt(quantized.gpt, tts, spk_cond_emb, text_tokens, codes=ref_codes)
+            min_len = min(ref_codes.shape[-1], q_codes.shape[-1])
+            agreement = (ref_codes[:, :min_len] == q_codes[:, :min_len]).float().mean().item()
+            cosine = torch.nn.functional.cosine_similarity(ref_latent.flatten(), q_latent.flatten(), dim=0).item()
+            # both DiTs get the fp32 GPT outputs, to measure the DiT error alone
+            ref_mel_out = run_dit(tts.s2mel, tts, ref_latent, ref_codes, ref_mel, style, prompt_condition)
+            q_mel_out = run_dit(quantized.s2mel, tts, ref_latent, ref_codes, ref_mel, style, prompt_condition)
+            snr = snr_db(ref_mel_out, q_mel_out)
+            print(f"[{i}] codes: {ref_codes.shape[-1]} vs {q_codes.shape[-1]}, greedy agreement {agreement:.3f}, "
+                  f"latent cosine {cosine:.4f}, DiT mel SNR {snr:.2f} dB")
+            if cosine < min_cosine or snr < min_snr:
+                failed.append(i)
+    print("--"*10)
+    if len(failed) > 0:
+        print(f"below the {mode} thresholds (cosine >= {min_cosine}, SNR >= {min_snr} dB):", failed)
+    else:
+        print("all passed")
+    print("Test finished.")
@@ -0,0 +1,61 @@
+import os
+import time
+
+from omegaconf import OmegaConf
+
+from indextts.infer_v2 import QwenEmotion
+
+TEXTS = [
+    "酒楼丧尽天良，开始借机竞拍房间，哎，一群蠢货。",
+    "你看看你，对我还有没有一点父子之间的信任了。",
+    "快躲起来！是他要来了！他要来抓我们了！",
+    "今天天气真好，我们一起去公园散步吧。",
+    "I can't believe it, we actually won the championship!",
+    "Everything feels so gloomy since she left.",
+]
+
+
+def top_emotion(emotion_dict):
+    return max(emotion_dict, key=emotion_dict.get)
+
+
+if __name__ == "__main__":
+    """
+    Compare the batched inference against one call per text, and the cached results against the generated ones:
+    ```
+    python tests/qwen_emotion_test.py checkpoints cuda:0
+    ```
+    """
+    import sys
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    device = sys.argv[2] if len(sys.argv) > 2 else None
+    cfg = OmegaConf.load(os.path.join(model_dir, "config.yaml"))
+    qwen_emo = QwenEmotion(os.path.join(model_dir, cfg.qwen_emo_path), device=device)
+
+    start = time.perf_counter()
+    generated = [qwen_emo.inference(text) for text in TEXTS]
+    print(f"generate, one call per text: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    cached = qwen_emo.inference(TEXTS)
+    print(f"cached: {time.perf_counter() - start:.4f}s")
+    assert cached == generated, "cached results differ"
+
+    qwen_emo._cache.clear()
+    start = time.perf_counter()
+    batched = qwen_emo.inference(TEXTS)
+    print(f"generate, batched: {time.perf_counter() - start:.2f}s")
+
+    mismatched = []
+    for i, text in enumerate(TEXTS):
+        print(f"[{i}] {text}")
+        for name, result in (("generate", generated[i]), ("batched", batched[i])):
+            print(f"    {name:>8}: {top_emotion(result):>10} " + " ".join(f"{v:.2f}" for v in result.values()))
+        if top_emotion(batched[i]) != top_emotion(generated[i]):
+            mismatched.append(i)
+    print("--"*10)
+    if len(mismatched) > 0:
+        print("top emotion mismatched:", mismatched)
+    else:
+        print("all matched")
+    print("Test finished.")
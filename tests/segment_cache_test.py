@@ -0,0 +1,89 @@
+import os
+import tempfile
+import time
+
+import torch
+
+from indextts.utils.segment_cache import SegmentAudioCache, segment_key, segment_seed
+
+FINGERPRINT = {"model": ["2.0", "gpt.pth", "fp32", None], "voice": "0" * 40, "emotion": "0" * 40, "emo_alpha": 1.0,
+               "emo_vector": None, "prompts": [False, 15, 15]}
+OPTIONS = {"do_sample": True, "top_p": 0.8, "top_k": 30, "temperature": 0.8, "max_text_tokens_per_segment": 120,
+           "generation_kwargs": {}}
+TEXT = "欢迎致电我们的客服中心。本次通话可能会被录音。请按一查询余额，按二办理业务。本次通话可能会被录音。"
+
+
+if __name__ == "__main__":
+    """
+    Check the keys and the tiers of the segment cache, then synthesize the same text twice with the cache: the
+    second request comes from the cache and is the same audio.
+    ```
+    python tests/segment_cache_test.py [checkpoints]
+    ```
+    """
+    import sys
+    failed = 0
+
+    tokens = ["▁HELLO", "▁WORLD", "."]
+    key = segment_key(FINGERPRINT, tokens, OPTIONS)
+    if key != segment_key(dict(FINGERPRINT), list(tokens), dict(OPTIONS, max_text_tokens_per_segment=80)):
+        print("the key must not depend on the segment length limit")
+        failed += 1
+    if key == segment_key(FINGERPRINT, tokens, dict(OPTIONS, temperature=0.7)) or \
+            key == segment_key(dict(FINGERPRINT, voice="1" * 40), tokens, OPTIONS) or \
+            key == segment_key(FINGERPRINT, tokens[:2], OPTIONS):
+        print("the key must depend on the options, the voice and the tokens")
+        failed += 1
+    seed = segment_seed(key)
+    if not 0 <= seed < 2 ** 63 or seed != segment_seed(key):
+        print("seed:", seed)
+        failed += 1
+
+    disk_dir = tempfile.mkdtemp()
+    wav = torch.linspace(-32767, 32767, 22050).unsqueeze(0)
+    cache = SegmentAudioCache(max_bytes=3 * 22050 * 2, disk_dir=disk_dir)
+    for i in range(4):
+        cache.put(f"{i:064x}", wav * (i + 1) / 4)
+    metrics = cache.metrics()
+    if metrics["entries"] != 3 or cache.get(f"{0:064x}") is None or cache.metrics()["disk_hits"] != 1:
+        print("LRU eviction and disk tier:", cache.metrics())
+        failed += 1
+    if not torch.equal(cache.get(f"{3:064x}"), (wav * 4 / 4).to(torch.int16).float()):
+        print("the cached waveform must be the int16 samples")
+        failed += 1
+    restarted = SegmentAudioCache(max_bytes=0, disk_dir=disk_dir)
+    if restarted.get(f"{2:064x}") is None or restarted.get(f"{9:064x}") is not None:
+        print("disk tier after a restart:", restarted.metrics())
+        failed += 1
+    with open(os.path.join(disk_dir, "00", f"{1:064x}.pt"), "wb") as f:
+        f.write(b"truncated")
+    if restarted.get(f"{1:064x}") is not None:
+        print("a corrupted file must be a miss")
+        failed += 1
+
+    if len(sys.argv) > 1:
+        model_dir = sys.argv[1]
+        from indextts.infer_v2 import IndexTTS2
+        tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, segment_cache_mb=64)
+        outputs = []
+        for name in ("first", "second"):
+            start = time.perf_counter()
+            sr, wav_data = tts.infer("tests/sample_prompt.wav", TEXT, None, max_text_tokens_per_segment=20)
+            print(f">> {name} request: {time.perf_counter() - start:.2f}s")
+            outputs.append(wav_data)
+        if outputs[0].shape != outputs[1].shape or (outputs[0] != outputs[1]).any():
+            print("the cached request must be the same audio")
+            failed += 1
+        # deterministic seeds without the cache
+        tts.segment_cache = None
+        _, uncached = tts.infer("tests/sample_prompt.wav", TEXT, None, max_text_tokens_per_segment=20,
+                                deterministic=True)
+        if uncached.shape != outputs[0].shape:
+            print(f">> note: seeded synthesis gives {uncached.shape} samples instead of {outputs[0].shape} "
+                  f"(non-deterministic kernels)")
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
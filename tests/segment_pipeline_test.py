@@ -0,0 +1,42 @@
+import os
+import time
+
+if __name__ == "__main__":
+    """
+    Synthesize a long text with the segments one after another, then with the overlapped segment pipeline, and
+    compare the wall clock with the per-stage times:
+    ```
+    python tests/segment_pipeline_test.py checkpoints
+    ```
+    """
+    import sys
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    prompt_wav = "tests/sample_prompt.wav"
+    text = """《盗梦空间》是由美国华纳兄弟影片公司出品的电影，由克里斯托弗·诺兰执导并编剧，
+莱昂纳多·迪卡普里奥、玛丽昂·歌迪亚、约瑟夫·高登-莱维特、艾利奥特·佩吉、汤姆·哈迪等联袂主演，
+2010年7月16日在美国上映，2010年9月1日在中国内地上映，2020年8月28日在中国内地重映。
+影片剧情游走于梦境与现实之间，被定义为“发生在意识结构内的当代动作科幻片”，
+讲述了由莱昂纳多·迪卡普里奥扮演的造梦师，带领特工团队进入他人梦境，从他人的潜意识中盗取机密，并重塑他人梦境的故事。
+""".replace("\n", "")
+
+    from indextts.infer_v2 import IndexTTS2
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, use_cuda_kernel=False)
+    os.makedirs("outputs", exist_ok=True)
+    # warm up the prompt cache
+    tts.infer(spk_audio_prompt=prompt_wav, text="大家好。", output_path="outputs/warmup.wav")
+
+    results = {}
+    for pipelined in (False, True):
+        start = time.perf_counter()
+        output_path = tts.infer(spk_audio_prompt=prompt_wav, text=text, output_path=f"outputs/pipelined_{pipelined}.wav",
+                                max_text_tokens_per_segment=40, pipelined=pipelined)
+        results[pipelined] = (time.perf_counter() - start, output_path)
+
+    print("--"*10)
+    print(f"sequential: {results[False][0]:.2f}s, pipelined: {results[True][0]:.2f}s, "
+          f"speedup {results[False][0] / results[True][0]:.2f}x")
+    if not all(os.path.exists(path) for _, path in results.values()):
+        print("missing outputs")
+    else:
+        print("all passed")
+    print("Test finished.")
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from indextts.utils import shared_weights
+from indextts.utils.shared_weights import publish_shared_bundle
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+if __name__ == "__main__":
+    """
+    `publish_shared_bundle` with a directory standing for /dev/shm: the copies of dead processes are removed, a full
+    tmpfs falls back to the bundle file:
+    ```
+    python tests/shared_bundle_test.py
+    ```
+    """
+    failed = 0
+    with tempfile.TemporaryDirectory() as bundle_dir, tempfile.TemporaryDirectory() as shm_dir:
+        bundle_path = os.path.join(bundle_dir, "model.bundle.safetensors")
+        with open(bundle_path, "wb") as f:
+            f.write(os.urandom(1 << 16))
+        stale = [f"indextts2-{dead_pid()}.bundle.safetensors", f"indextts2-{dead_pid()}.bundle.safetensors.tmp"]
+        # the parent process is running, `other` is not a bundle copy
+        kept = [f"indextts2-{os.getppid()}.bundle.safetensors", "other.safetensors"]
+        for name in stale + kept:
+            open(os.path.join(shm_dir, name), "wb").close()
+
+        shared_path = publish_shared_bundle(bundle_path, shm_dir)
+        names = set(os.listdir(shm_dir))
+        if any(name in names for name in stale):
+            print("the copies of the dead processes must be removed:", sorted(names))
+            failed += 1
+        if not all(name in names for name in kept):
+            print("the copies of the running processes must be kept:", sorted(names))
+            failed += 1
+        if os.path.dirname(shared_path) != shm_dir or any(name.endswith(".tmp") for name in names):
+            print("the bundle must be published in the shared directory without partial copies:", shared_path)
+            failed += 1
+        else:
+            with open(shared_path, "rb") as f, open(bundle_path, "rb") as g:
+                if f.read() != g.read():
+                    print("the shared copy differs from the bundle")
+                    failed += 1
+        os.remove(shared_path)
+
+        # not enough free space
+        disk_usage = shared_weights.shutil.disk_usage
+        shared_weights.shutil.disk_usage = lambda path: disk_usage(path)._replace(free=1024)
+        try:
+            shared_path = publish_shared_bundle(bundle_path, shm_dir)
+        finally:
+            shared_weights.shutil.disk_usage = disk_usage
+        if shared_path != os.path.abspath(bundle_path):
+            print("a full shared directory must fall back to the bundle file:", shared_path)
+            failed += 1
+
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all passed")
+    print("Test finished.")
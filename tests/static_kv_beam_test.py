@@ -0,0 +1,53 @@
+import torch
+
+from indextts.gpt.model_v2 import UnifiedVoice
+
+CONDITION_MODULE = {"output_size": 64, "linear_units": 128, "attention_heads": 2, "num_blocks": 1,
+                    "input_layer": "conv2d2", "perceiver_mult": 2}
+
+
+def tiny_gpt():
+    torch.manual_seed(0)
+    gpt = UnifiedVoice(layers=2, model_dim=64, heads=2, max_text_tokens=32, max_mel_tokens=64, number_text_tokens=100,
+                       number_mel_codes=130, start_mel_token=128, stop_mel_token=129,
+                       condition_type="conformer_perceiver", condition_module=CONDITION_MODULE,
+                       emo_condition_module=CONDITION_MODULE)
+    gpt.post_init_gpt2_config(kv_cache=True, attn_backend="eager")
+    return gpt.eval()
+
+
+def generate(gpt, num_beams):
+    torch.manual_seed(1)
+    condition = torch.randn(1, 1024, 50)
+    text = torch.randint(2, 100, (1, 12), dtype=torch.int32)
+    with torch.no_grad():
+        codes, _ = gpt.inference_speech(condition, text, condition, do_sample=False, num_beams=num_beams,
+                                        max_generate_length=40)
+    return codes
+
+
+if __name__ == "__main__":
+    """
+    Beam search through the static KV cache decode step (the one compiled by `use_torch_compile`) must generate the
+    same tokens as the eager decode with the legacy cache:
+    ```
+    python tests/static_kv_beam_test.py
+    ```
+    """
+    failed = 0
+    gpt = tiny_gpt()
+    for num_beams in (1, 3):
+        gpt.inference_model.static_decoder = None
+        eager = generate(gpt, num_beams)
+        gpt.inference_model.enable_static_kv(compile=False, multiple=16)
+        static = generate(gpt, num_beams)
+        if eager.shape != static.shape or not torch.equal(eager, static):
+            print(f"num_beams={num_beams}: static decode {static.tolist()} != eager {eager.tolist()}")
+            failed += 1
+        else:
+            print(f">> num_beams={num_beams}: {eager.shape[-1]} tokens matched")
+    if failed:
+        print(f"{failed} failed")
+    else:
+        print("all matched")
+    print("Test finished.")
@@ -0,0 +1,58 @@
+import time
+
+from indextts.utils.front import TextNormalizer, TextTokenizer
+
+SENTENCES = [
+    "您好，欢迎致电客服中心。",
+    "请按1查询余额，按2办理业务，按0转人工服务。",
+    "IndexTTS 正式发布1.0版本了，效果666！",
+    "现在是北京时间2025年01月11日 20:00。",
+    "This sales for 2.5% off, only $12.5.",
+    "See you at 8:00 AM. Thank you for calling!",
+    "约瑟夫·高登-莱维特是一名演员。",
+    "“衣裳”不读衣chang2，而是读衣shang5。",
+    "今天是个好日子 it's a good day.",
+    "晕XUAN4是一种GAN3觉。",
+]
+
+
+def throughput(tokenizer, texts, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            tokenizer.tokenize(text)
+    return rounds * sum(len(TextNormalizer.split_sentences(text)) for text in texts) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    """
+    Throughput of `TextTokenizer.tokenize` in sentences per second, without and with the sentence cache, and check
+    that the cached results are the same as the tokenization of the whole texts:
+    ```
+    python tests/tokenize_benchmark_test.py checkpoints/bpe.model
+    ```
+    """
+    import sys
+    vocab_file = sys.argv[1] if len(sys.argv) > 1 else "checkpoints/bpe.model"
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    normalizer = TextNormalizer()
+    uncached = TextTokenizer(vocab_file, normalizer, cache_size=0)
+    cached = TextTokenizer(vocab_file, normalizer)
+    # paragraphs of repeated phrases, as in IVR prompts
+    texts = SENTENCES + ["".join(SENTENCES[i:i + 3]) for i in range(0, len(SENTENCES), 2)]
+
+    mismatched = 0
+    for text in texts:
+        expected = uncached.tokenize(text)
+        tokens = cached.tokenize(text)
+        if tokens != expected:
+            mismatched += 1
+            print(f"mismatched: {text}\n  whole:    {expected}\n  cached:   {tokens}")
+
+    print(f">> uncached: {throughput(uncached, texts, rounds):.1f} sentences/s")
+    print(f">> cached (warm): {throughput(cached, texts, rounds):.1f} sentences/s, {cached.cache_info()}")
+    if mismatched:
+        print(f"{mismatched} mismatched")
+    else:
+        print("all matched")
+    print("Test finished.")